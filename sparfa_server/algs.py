@@ -0,0 +1,255 @@
+from array import array
+from datetime import datetime, timedelta
+
+from numpy import (arange, argsort, asarray, einsum, frombuffer, full, int64, lexsort, maximum,
+                   minimum, ones, searchsorted, sort, unique, where, zeros)
+from scipy.sparse import coo_matrix, csr_matrix, issparse
+from scipy.special import expit
+
+__all__ = ('ResponseColumns', 'convert_Rs', 'refine_W_d')
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Step size used by refine_W_d
+# Gradients are averaged per exercise, so this is the step taken for each exercise
+REFINEMENT_LEARNING_RATE = 0.5
+
+
+def refine_W_d(W_NCxNQ, d_NQx1, H_mask_NCxNQ, U_NCxNL, G_NQxNL, G_mask_NQxNL,
+               num_epochs, learning_rate=REFINEMENT_LEARNING_RATE):
+    """
+    Refines existing W and d matrices using the given student knowledge (U) and responses (G)
+    This is done using a few epochs of projected gradient descent on the logistic SPARFA model,
+    where the probability of a correct response is given by sigmoid(W.T * U - d)
+    W is kept nonnegative and restricted to the hints in H_mask
+    Only the entries of W allowed by H_mask are stored and updated, so W and H_mask
+    can be scipy sparse matrices, in which case W is also returned as a sparse (CSR) matrix
+    :param W_NCxNQ:       Concept-exercise association matrix to be refined
+    :param d_NQx1:        Exercise difficulty vector to be refined
+    :param H_mask_NCxNQ:  Mask containing the allowed concept-exercise associations
+    :param U_NCxNL:       Student knowledge matrix
+    :param G_NQxNL:       Response correctness matrix
+    :param G_mask_NQxNL:  Mask containing the exercise-student pairs that have responses
+    :param num_epochs:    Number of gradient descent epochs
+    :param learning_rate: Gradient descent step size
+    :return:              Tuple containing the refined W and d matrices
+    """
+    NC, NQ = H_mask_NCxNQ.shape
+    H_mask = coo_matrix(H_mask_NCxNQ)
+    rows = H_mask.row[H_mask.data.astype(bool)]
+    cols = H_mask.col[H_mask.data.astype(bool)]
+    W_values = zeros(len(rows))
+    if len(rows) > 0:
+        W_values[:] = asarray(csr_matrix(W_NCxNQ)[rows, cols]).ravel()
+    d_NQx1 = asarray(d_NQx1, dtype=float).copy()
+
+    # Average the gradient over each exercise's responses
+    num_responses_NQx1 = maximum(G_mask_NQxNL.sum(axis=1, keepdims=True), 1)
+
+    for epoch in range(num_epochs):
+        W_T_QxC = csr_matrix((W_values, (cols, rows)), shape=(NQ, NC))
+
+        # Derivative of the negative log-likelihood with respect to W.T * U - d
+        E_NQxNL = (expit(W_T_QxC.dot(U_NCxNL) - d_NQx1) - G_NQxNL) * G_mask_NQxNL
+        E_NQxNL /= num_responses_NQx1
+
+        # Gradient of W restricted to the entries allowed by H_mask (rows of U.dot(E.T))
+        W_gradient = einsum('ij,ij->i', U_NCxNL[rows], E_NQxNL[cols])
+        W_values = maximum(W_values - learning_rate * W_gradient, 0)
+        d_NQx1 += learning_rate * E_NQxNL.sum(axis=1, keepdims=True)
+
+    W_NCxNQ_refined = csr_matrix((W_values, (rows, cols)), shape=(NC, NQ))
+    if not issparse(W_NCxNQ):
+        W_NCxNQ_refined = W_NCxNQ_refined.toarray()
+
+    return W_NCxNQ_refined, d_NQx1
+
+
+def _indices_in(ids, target_ids):
+    """Returns an array with the index of each of the ids in target_ids, or -1 if not found"""
+    ids = asarray([str(id) for id in ids])
+    target_ids = asarray([str(id) for id in target_ids])
+    if len(ids) == 0 or len(target_ids) == 0:
+        return full(len(ids), -1, dtype=int64)
+
+    order = argsort(target_ids)
+    positions = minimum(searchsorted(target_ids[order], ids), len(target_ids) - 1)
+    return where(target_ids[order][positions] == ids, order[positions], -1)
+
+
+def convert_Rs(responses, L_ids, Q_ids):
+    """
+    Vectorized replacement for SparfaAlgs.convert_Rs
+    Converts the given responses into the G and G_mask matrices
+    If a student answered the same exercise more than once, only the latest response is used
+    Responses from students not in L_ids or for exercises not in Q_ids are ignored
+    :param responses: ResponseColumns or list of response dicts in the format used by the algorithms
+    :param L_ids:     Student uuids, in the order of the G columns
+    :param Q_ids:     Exercise uuids, in the order of the G rows
+    :return:          Tuple containing the NQxNL G and G_mask matrices
+    """
+    if not isinstance(responses, ResponseColumns):
+        responses = ResponseColumns.from_dicts_for_algs(responses)
+
+    NL = len(L_ids)
+    NQ = len(Q_ids)
+    G_NQxNL = zeros((NQ, NL))
+    G_mask_NQxNL = zeros((NQ, NL), dtype=bool)
+
+    L_idx = _indices_in(responses.L_ids, L_ids)[responses.L_idx]
+    Q_idx = _indices_in(responses.Q_ids, Q_ids)[responses.Q_idx]
+    known = (L_idx >= 0) & (Q_idx >= 0)
+
+    # Stable sort by responded_at, so later responses win ties like in the original
+    order = where(known)[0]
+    order = order[argsort(responses.responded_at[order], kind='stable')]
+
+    # Find the last occurrence of each student/exercise pair
+    flat_idx = (Q_idx * NL + L_idx)[order][::-1]
+    flat_idx, first_idx = unique(flat_idx, return_index=True)
+    latest = order[::-1][first_idx]
+
+    G_NQxNL.flat[flat_idx] = responses.is_correct[latest]
+    G_mask_NQxNL.flat[flat_idx] = True
+
+    return G_NQxNL, G_mask_NQxNL
+
+
+def _latest_idx(L_idx, Q_idx, responded_at):
+    """
+    Returns the sorted indices of the latest response of each student/exercise pair
+    Like in convert_Rs, later responses win ties
+    """
+    if len(L_idx) == 0:
+        return arange(0, dtype=int64)
+
+    # Sort by pair, then responded_at, then position, so each pair's latest response is its last
+    order = lexsort((arange(len(L_idx)), responded_at, Q_idx, L_idx))
+    last = ones(len(order), dtype=bool)
+    last[:-1] = (L_idx[order][1:] != L_idx[order][:-1]) | (Q_idx[order][1:] != Q_idx[order][:-1])
+    return sort(order[last])
+
+
+class ResponseColumns(object):
+    """
+    Columnar representation of responses, used instead of 1 dict per response
+    Students and exercises are stored as indices into L_ids and Q_ids
+    and responded_at is stored as microseconds since the epoch
+    """
+
+    def __init__(self, L_ids, Q_ids, L_idx, Q_idx, is_correct, responded_at):
+        self.L_ids = L_ids
+        self.Q_ids = Q_ids
+        self.L_idx = asarray(L_idx, dtype=int64)
+        self.Q_idx = asarray(Q_idx, dtype=int64)
+        self.is_correct = asarray(is_correct, dtype=bool)
+        self.responded_at = asarray(responded_at, dtype=int64)
+
+    def __len__(self):
+        return len(self.L_idx)
+
+    @property
+    def L_idx_by_id(self):
+        return {L_id: idx for idx, L_id in enumerate(self.L_ids)}
+
+    @property
+    def Q_idx_by_id(self):
+        return {Q_id: idx for idx, Q_id in enumerate(self.Q_ids)}
+
+    @classmethod
+    def from_values(cls, values, batch_size=None):
+        """
+        Creates ResponseColumns from (student_uuid, exercise_uuid, is_correct, responded_at) tuples
+        The values can be a generator, so rows can be streamed in without being kept around
+        If a batch_size is given, only the latest response of each student/exercise pair is kept,
+        compacting the columns after every batch_size values,
+        so memory use is bounded by the number of pairs instead of the number of values
+        """
+        L_idx_by_id = {}
+        Q_idx_by_id = {}
+        columns = [array('q'), array('q'), array('b'), array('q')]
+        L_idx, Q_idx, is_correct, responded_at = columns
+        num_compacted = 0
+        for student_uuid, exercise_uuid, correct, responded in values:
+            L_idx.append(L_idx_by_id.setdefault(str(student_uuid), len(L_idx_by_id)))
+            Q_idx.append(Q_idx_by_id.setdefault(str(exercise_uuid), len(Q_idx_by_id)))
+            is_correct.append(correct)
+            responded_at.append((responded - EPOCH) // MICROSECOND)
+
+            if batch_size and len(L_idx) - num_compacted >= batch_size:
+                columns = cls._compacted_columns(columns)
+                L_idx, Q_idx, is_correct, responded_at = columns
+                num_compacted = len(L_idx)
+
+        if batch_size and len(L_idx) > num_compacted:
+            columns = cls._compacted_columns(columns)
+
+        L_idx, Q_idx, is_correct, responded_at = columns
+        return cls(
+            L_ids=list(L_idx_by_id),
+            Q_ids=list(Q_idx_by_id),
+            L_idx=frombuffer(L_idx, dtype=int64),
+            Q_idx=frombuffer(Q_idx, dtype=int64),
+            is_correct=frombuffer(is_correct, dtype=bool),
+            responded_at=frombuffer(responded_at, dtype=int64)
+        )
+
+    @staticmethod
+    def _compacted_columns(columns):
+        """
+        Returns new L_idx, Q_idx, is_correct and responded_at arrays (from the array module)
+        containing only the latest response of each student/exercise pair
+        """
+        L_idx, Q_idx, is_correct, responded_at = columns
+        latest = _latest_idx(
+            frombuffer(L_idx, dtype=int64),
+            frombuffer(Q_idx, dtype=int64),
+            frombuffer(responded_at, dtype=int64)
+        )
+        return [
+            array('q', frombuffer(L_idx, dtype=int64)[latest].tobytes()),
+            array('q', frombuffer(Q_idx, dtype=int64)[latest].tobytes()),
+            array('b', frombuffer(is_correct, dtype=bool)[latest].tobytes()),
+            array('q', frombuffer(responded_at, dtype=int64)[latest].tobytes())
+        ]
+
+    @classmethod
+    def from_dicts_for_algs(cls, response_dicts):
+        """Creates ResponseColumns from response dicts in the format used by the algorithms"""
+        response_dicts = list(response_dicts)
+        columns = cls.from_values((
+            response['L_id'], response['Q_id'], response['correct?'], EPOCH
+        ) for response in response_dicts)
+        columns.responded_at = asarray([
+            response['responded_at'] for response in response_dicts
+        ], dtype='datetime64[us]').view(int64)
+        return columns
+
+    def latest(self):
+        """
+        Returns new ResponseColumns containing only the latest response
+        of each student/exercise pair, in their original order
+        """
+        latest = _latest_idx(self.L_idx, self.Q_idx, self.responded_at)
+        return self.__class__(
+            L_ids=self.L_ids,
+            Q_ids=self.Q_ids,
+            L_idx=self.L_idx[latest],
+            Q_idx=self.Q_idx[latest],
+            is_correct=self.is_correct[latest],
+            responded_at=self.responded_at[latest]
+        )
+
+    def dicts_for_algs(self):
+        """Generates response dicts in the format used by the algorithms"""
+        responded_at = self.responded_at.view('datetime64[us]').astype(datetime)
+        for L_idx, Q_idx, is_correct, responded in zip(
+            self.L_idx.tolist(), self.Q_idx.tolist(), self.is_correct.tolist(), responded_at
+        ):
+            yield {
+                'L_id':         self.L_ids[L_idx],
+                'Q_id':         self.Q_ids[Q_idx],
+                'correct?':     is_correct,
+                'responded_at': str(responded)
+            }
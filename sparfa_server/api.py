@@ -83,9 +83,9 @@ def show():
     with transaction() as session:
         ecosystem_matrices_by_uuid = {
             ecosystem_matrix.uuid: ecosystem_matrix
-            for ecosystem_matrix in session.query(EcosystemMatrix).filter(
-                EcosystemMatrix.uuid.in_(ecosystem_matrix_uuids)
-            ).all()
+            for ecosystem_matrix in EcosystemMatrix.query_cached(
+                session, EcosystemMatrix.uuid.in_(ecosystem_matrix_uuids)
+            )
         }
 
         ecosystem_matrix_responses = []
@@ -122,13 +122,14 @@ def show():
 
             ecosystem_matrix = ecosystem_matrices_by_uuid.get(ecosystem_matrix_uuid)
             if ecosystem_matrix:
+                decoded_dict = ecosystem_matrix.decoded_dict
                 ecosystem_matrix_response.update({
                     key: value.isoformat() + 'Z' if hasattr(value, 'isoformat') else value
-                    for (key, value) in ecosystem_matrix.dict.items()
+                    for (key, value) in decoded_dict.items()
                     if key != 'uuid' and key != 'is_used_in_assignments'
                 })
 
-                if student_uuids != [] and ecosystem_matrix.Q_ids and ecosystem_matrix.C_ids:
+                if student_uuids != [] and decoded_dict['Q_ids'] and decoded_dict['C_ids']:
                     responded_before = responded_before_by_request_uuid[request_uuid]
                     query = session.query(Response).filter(
                         Response.ecosystem_uuid == ecosystem_matrix.ecosystem_uuid
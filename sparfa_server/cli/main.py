@@ -3,6 +3,7 @@ from click import group, version_option
 from .. import __version__
 from .loaders import load
 from .calcs import calc
+from .reports import report
 from .celery import celery
 
 
@@ -14,4 +15,5 @@ def main():
 
 main.add_command(load)
 main.add_command(calc)
+main.add_command(report)
 main.add_command(celery)
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from click import group, option, echo
+from sqlalchemy.sql.expression import func
+
+from ..orm import transaction, EcosystemMatrixStats
+
+
+@group()
+def report():
+    """Show reports."""
+
+
+@report.command()
+@option('--days', default=7, show_default=True, help='Only include the last DAYS days.')
+@option('--limit', default=20, show_default=True, help='Show at most LIMIT ecosystems.')
+def matrices(days, limit):
+    """Rank ecosystems by ecosystem matrix calculation cost"""
+    total_seconds = func.sum(
+        EcosystemMatrixStats.load_seconds +
+        EcosystemMatrixStats.calculation_seconds +
+        EcosystemMatrixStats.save_seconds
+    )
+
+    with transaction() as session:
+        rows = session.query(
+            EcosystemMatrixStats.ecosystem_uuid,
+            func.count(EcosystemMatrixStats.uuid),
+            total_seconds,
+            func.max(EcosystemMatrixStats.calculation_seconds),
+            func.max(EcosystemMatrixStats.num_responses),
+            func.max(EcosystemMatrixStats.num_loaded_responses),
+            func.max(EcosystemMatrixStats.num_students),
+            func.max(EcosystemMatrixStats.num_exercises),
+            func.max(EcosystemMatrixStats.peak_rss_kb)
+        ).filter(
+            EcosystemMatrixStats.created_at >= datetime.now() - timedelta(days=days)
+        ).group_by(EcosystemMatrixStats.ecosystem_uuid).order_by(
+            total_seconds.desc()
+        ).limit(limit).all()
+
+    echo('{:36}  {:>6}  {:>10}  {:>10}  {:>10}  {:>10}  {:>9}  {:>9}  {:>11}'.format(
+        'ecosystem_uuid', 'calcs', 'total_s', 'max_calc_s',
+        'responses', 'loaded', 'students', 'exercises', 'peak_rss_mb'
+    ))
+    for ecosystem_uuid, num_calcs, total, max_calculation, num_responses, \
+            num_loaded_responses, num_students, num_exercises, peak_rss_kb in rows:
+        echo('{:36}  {:6d}  {:10.1f}  {:10.1f}  {:10d}  {:10d}  {:9d}  {:9d}  {:11.1f}'.format(
+            ecosystem_uuid, num_calcs, total, max_calculation, num_responses,
+            num_loaded_responses, num_students, num_exercises, peak_rss_kb / 1024
+        ))
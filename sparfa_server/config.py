@@ -8,6 +8,19 @@ try:
 except ImportError:
     pass
 
+
+def _choice(name, default, choices):
+    """
+    Returns the lowercase value of the given environment variable, which must be 1 of the choices,
+    so a typo fails at startup instead of silently selecting another behavior
+    """
+    value = environ.get(name, default).lower()
+    if value not in choices:
+        raise ValueError('{} must be one of {}, not {!r}'.format(name, ', '.join(choices), value))
+
+    return value
+
+
 # General config
 PY_ENV = environ.get('PY_ENV', 'development').lower()
 PG_HOST = environ.get('PG_HOST', 'localhost')
@@ -32,6 +45,34 @@ BIGLEARN_SCHED_URL = environ.get('BIGLEARN_SCHED_URL',
 BIGLEARN_SCHED_TOKEN = environ.get('BIGLEARN_SCHED_TOKEN', '')
 BIGLEARN_SCHED_ALGORITHM_NAME = environ.get('BIGLEARN_SCHED_ALGORITHM_NAME', 'biglearn_sparfa')
 BIGLEARN_SPARFA_TOKEN = environ.get('BIGLEARN_SPARFA_TOKEN', '')
+# Number of refinement epochs used to warm-start ecosystem matrices (0 means always cold start)
+ECOSYSTEM_MATRIX_WARM_START_EPOCHS = int(environ.get('ECOSYSTEM_MATRIX_WARM_START_EPOCHS', '0'))
+# Number of processes used to calculate ecosystem matrices in parallel (0 means 1 per CPU)
+ECOSYSTEM_MATRIX_PROCESSES = int(environ.get('ECOSYSTEM_MATRIX_PROCESSES', '1'))
+# Number of threads used to calculate the exercises and CLUes of different ecosystems
+# in the same batch in parallel (1 calculates them one after another)
+ECOSYSTEM_CALCULATION_THREADS = int(environ.get('ECOSYSTEM_CALCULATION_THREADS', '1'))
+# Format used to store new ecosystem matrices: arrays, binary, compressed (binary with zlib)
+# or delta (compressed, but relative to the previous matrix for the same ecosystem when possible)
+# Matrices stored in any of these formats can always be read
+ECOSYSTEM_MATRIX_STORAGE = _choice('ECOSYSTEM_MATRIX_STORAGE', 'arrays',
+                                   ('arrays', 'binary', 'compressed', 'delta'))
+# Precision of the floats in new ecosystem matrices and in the decoded ones: double or single
+# Single precision halves the size of the binary formats and of the decoded matrices
+ECOSYSTEM_MATRIX_PRECISION = _choice('ECOSYSTEM_MATRIX_PRECISION', 'double', ('double', 'single'))
+# Memory budget for the decoded ecosystem matrices cached by each process (0 disables the cache)
+ECOSYSTEM_MATRIX_CACHE_MB = int(environ.get('ECOSYSTEM_MATRIX_CACHE_MB', '256'))
+# Local directory where ecosystem matrices are stored as memory-mapped files (empty disables it)
+ECOSYSTEM_MATRIX_STORE_DIR = environ.get('ECOSYSTEM_MATRIX_STORE_DIR', '')
+# Disk budget for the ecosystem matrices in the local store of each machine (0 means no limit)
+ECOSYSTEM_MATRIX_STORE_MB = int(environ.get('ECOSYSTEM_MATRIX_STORE_MB', '1024'))
+# Send exercise and CLUe updates to biglearn-scheduler in the background
+# while the next calculations are fetched and calculated: true or false
+PIPELINE_CALCULATIONS = environ.get('PIPELINE_CALCULATIONS', 'false').lower() == 'true'
+# Days each student's latest responses stay cached in Redis after last use (0 disables the cache)
+STUDENT_RESPONSE_CACHE_DAYS = int(environ.get('STUDENT_RESPONSE_CACHE_DAYS', '7'))
+# Days each exercise ordering stays cached in Redis (0 disables the cache)
+EXERCISE_ORDERING_CACHE_DAYS = int(environ.get('EXERCISE_ORDERING_CACHE_DAYS', '1'))
 
 # Environment-specific overrides
 if PY_ENV == 'test':
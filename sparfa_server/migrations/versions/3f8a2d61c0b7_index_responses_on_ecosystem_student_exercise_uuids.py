@@ -0,0 +1,27 @@
+"""index responses on ecosystem_uuid, student_uuid and exercise_uuid
+
+Revision ID: 3f8a2d61c0b7
+Revises: 695e7904bfb9
+Create Date: 2026-10-18 18:12:40.526931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a2d61c0b7'
+down_revision = '695e7904bfb9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The responses table is too large to lock while the index is built
+    with op.get_context().autocommit_block():
+        op.create_index('ix_responses_ecosystem_uuid_student_uuid_exercise_uuid', 'responses', ['ecosystem_uuid', 'student_uuid', 'exercise_uuid'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_responses_ecosystem_uuid_student_uuid_exercise_uuid', table_name='responses', postgresql_concurrently=True)
@@ -0,0 +1,191 @@
+"""added parent_uuid to ecosystem_matrix_payloads and made Q_ids and C_ids nullable
+
+Revision ID: 695e7904bfb9
+Revises: abb580eea8cc
+Create Date: 2026-10-18 17:04:51.902137
+
+"""
+from struct import Struct
+from zlib import compress, decompress
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from numpy import asarray, dtype, float32, frombuffer
+
+# revision identifiers, used by Alembic.
+revision = '695e7904bfb9'
+down_revision = 'abb580eea8cc'
+branch_labels = None
+depends_on = None
+
+ARRAY_ITEM_TYPES = {'f': sa.FLOAT(), 'i': sa.INTEGER(), 'b': sa.BOOLEAN()}
+
+# Copy of the binary ecosystem matrix format as of this revision, from sparfa_server.orm.binary,
+# so this migration does not depend on the current version of that module
+MATRIX_ARRAY_DTYPES = (
+    ('d_data', dtype('<f8')),
+    ('W_data', dtype('<f8')),
+    ('W_row', dtype('<i4')),
+    ('W_col', dtype('<i4')),
+    ('H_mask_data', dtype('?')),
+    ('H_mask_row', dtype('<i4')),
+    ('H_mask_col', dtype('<i4'))
+)
+DELTA_ARRAY_KEYS = ('d_data', 'W_data')
+SHARED_ARRAY_KEYS = tuple(key for key, __ in MATRIX_ARRAY_DTYPES if key not in DELTA_ARRAY_KEYS)
+MAGIC = b'SPFA'
+VERSION = 1
+IS_COMPRESSED = 1
+IS_SINGLE_PRECISION = 2
+IS_DELTA = 4
+HEADER = Struct('<4sBB2x{}Q'.format(len(MATRIX_ARRAY_DTYPES)))
+ALIGNMENT = 8
+
+
+def _matrix_array_dtypes(is_single_precision):
+    return tuple(
+        (key, dtype('<f4') if is_single_precision and array_dtype.kind == 'f' else array_dtype)
+        for key, array_dtype in MATRIX_ARRAY_DTYPES
+    )
+
+
+def encode_matrix_arrays(arrays, is_single_precision):
+    """Encodes the given arrays as a full compressed matrix"""
+    arrays = [asarray(arrays[key], dtype=array_dtype)
+              for key, array_dtype in _matrix_array_dtypes(is_single_precision)]
+    body = compress(b''.join(
+        array.tobytes() + b'\0' * (-array.nbytes % ALIGNMENT) for array in arrays
+    ))
+    flags = IS_COMPRESSED | (IS_SINGLE_PRECISION if is_single_precision else 0)
+    return HEADER.pack(MAGIC, VERSION, flags, *(len(array) for array in arrays)) + body
+
+
+def _decode_matrix_arrays(data):
+    data = memoryview(data)
+    magic, version, flags, *lengths = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or \
+            flags & ~(IS_COMPRESSED | IS_SINGLE_PRECISION | IS_DELTA):
+        raise ValueError('Unsupported ecosystem matrix data format')
+
+    body = data[HEADER.size:]
+    if flags & IS_COMPRESSED:
+        body = decompress(body)
+
+    arrays = {}
+    offset = 0
+    for (key, array_dtype), length in zip(
+        _matrix_array_dtypes(flags & IS_SINGLE_PRECISION), lengths
+    ):
+        arrays[key] = frombuffer(body, dtype=array_dtype, count=length, offset=offset)
+        nbytes = length * array_dtype.itemsize
+        offset += nbytes + -nbytes % ALIGNMENT
+
+    return flags, arrays
+
+
+def decode_matrix_arrays(data):
+    flags, arrays = _decode_matrix_arrays(data)
+    if flags & IS_DELTA:
+        raise ValueError('Delta-encoded ecosystem matrix data requires its parent matrix')
+
+    return arrays
+
+
+def _xor(array, other_array):
+    uint_dtype = dtype('<u{}'.format(array.dtype.itemsize))
+    return (array.view(uint_dtype) ^ other_array.view(uint_dtype)).view(array.dtype)
+
+
+def _unshuffle(array):
+    return array.view('u1').reshape((array.dtype.itemsize, -1)).transpose().ravel().view(
+        array.dtype
+    )
+
+
+def decode_matrix_delta(data, parent_arrays):
+    flags, delta_arrays = _decode_matrix_arrays(data)
+    if not flags & IS_DELTA:
+        raise ValueError('Ecosystem matrix data is not delta-encoded')
+
+    arrays = {key: parent_arrays[key] for key in SHARED_ARRAY_KEYS}
+    for key in DELTA_ARRAY_KEYS:
+        delta_array = _unshuffle(delta_arrays[key])
+        arrays[key] = _xor(delta_array, asarray(parent_arrays[key], dtype=delta_array.dtype))
+
+    return arrays
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('ecosystem_matrix_payloads', sa.Column('parent_uuid', postgresql.UUID(), nullable=True))
+    op.create_index(op.f('ix_ecosystem_matrix_payloads_parent_uuid'), 'ecosystem_matrix_payloads', ['parent_uuid'], unique=False)
+    op.create_foreign_key(op.f('ecosystem_matrix_payloads_parent_uuid_fkey'), 'ecosystem_matrix_payloads', 'ecosystem_matrix_payloads', ['parent_uuid'], ['uuid'])
+    op.alter_column('ecosystem_matrix_payloads', 'Q_ids',
+               existing_type=postgresql.ARRAY(postgresql.UUID()),
+               nullable=True)
+    op.alter_column('ecosystem_matrix_payloads', 'C_ids',
+               existing_type=postgresql.ARRAY(postgresql.UUID()),
+               nullable=True)
+    # ### end Alembic commands ###
+
+
+def _materialize_delta_payload(connection, payloads, row):
+    data = connection.execute(
+        sa.select([payloads.c.data]).where(payloads.c.uuid == row.uuid)
+    ).scalar()
+    parent = connection.execute(
+        sa.select([payloads]).where(payloads.c.uuid == row.parent_uuid)
+    ).first()
+    parent_arrays = decode_matrix_arrays(parent.data) if parent.data is not None else {
+        key: asarray(parent[key] or [], dtype=array_dtype)
+        for key, array_dtype in MATRIX_ARRAY_DTYPES
+    }
+    arrays = decode_matrix_delta(data, parent_arrays)
+    connection.execute(payloads.update().where(payloads.c.uuid == row.uuid).values(
+        parent_uuid=None,
+        Q_ids=parent.Q_ids,
+        C_ids=parent.C_ids,
+        data=encode_matrix_arrays(arrays, is_single_precision=arrays['d_data'].dtype == float32)
+    ))
+
+
+def downgrade():
+    # Delta-encoded matrices are rewritten as full compressed matrices, 1 at a time
+    # Their parents can be delta-encoded too, so each pass only rewrites the matrices
+    # whose parents are full matrices, until no delta-encoded matrices are left
+    connection = op.get_bind()
+    payloads = sa.table(
+        'ecosystem_matrix_payloads',
+        sa.column('uuid', postgresql.UUID()),
+        sa.column('parent_uuid', postgresql.UUID()),
+        sa.column('Q_ids', postgresql.ARRAY(postgresql.UUID())),
+        sa.column('C_ids', postgresql.ARRAY(postgresql.UUID())),
+        sa.column('data', postgresql.BYTEA()),
+        *[sa.column(key, postgresql.ARRAY(ARRAY_ITEM_TYPES[array_dtype.kind]))
+          for key, array_dtype in MATRIX_ARRAY_DTYPES]
+    )
+    parents = payloads.alias('parents')
+    while True:
+        rows = connection.execute(
+            sa.select([payloads.c.uuid, payloads.c.parent_uuid]).select_from(
+                payloads.join(parents, payloads.c.parent_uuid == parents.c.uuid)
+            ).where(parents.c.parent_uuid.is_(None))
+        ).fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            _materialize_delta_payload(connection, payloads, row)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.alter_column('ecosystem_matrix_payloads', 'C_ids',
+               existing_type=postgresql.ARRAY(postgresql.UUID()),
+               nullable=False)
+    op.alter_column('ecosystem_matrix_payloads', 'Q_ids',
+               existing_type=postgresql.ARRAY(postgresql.UUID()),
+               nullable=False)
+    op.drop_constraint(op.f('ecosystem_matrix_payloads_parent_uuid_fkey'), 'ecosystem_matrix_payloads', type_='foreignkey')
+    op.drop_index(op.f('ix_ecosystem_matrix_payloads_parent_uuid'), table_name='ecosystem_matrix_payloads')
+    op.drop_column('ecosystem_matrix_payloads', 'parent_uuid')
+    # ### end Alembic commands ###
@@ -0,0 +1,28 @@
+"""removed ix_responses_ecosystem_uuid, which is covered by the composite responses index
+
+Revision ID: e5b1d7a3c924
+Revises: 7a3f5d8e2b61
+Create Date: 2026-10-18 23:05:17.284613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1d7a3c924'
+down_revision = '7a3f5d8e2b61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ix_responses_ecosystem_uuid_student_uuid_exercise_uuid starts with ecosystem_uuid
+    # The responses table is too large to lock while the index is dropped
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_responses_ecosystem_uuid', table_name='responses', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_responses_ecosystem_uuid', 'responses', ['ecosystem_uuid'], unique=False, postgresql_concurrently=True)
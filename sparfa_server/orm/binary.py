@@ -0,0 +1,160 @@
+from struct import Struct
+from zlib import compress, decompress
+
+from numpy import array_equal, asarray, dtype, frombuffer
+
+__all__ = ('MATRIX_ARRAY_DTYPES', 'matrix_array_dtypes', 'encode_matrix_arrays',
+           'decode_matrix_arrays', 'encode_matrix_delta', 'decode_matrix_delta')
+
+# Arrays stored in the binary EcosystemMatrix format, in storage order, with their dtypes
+# All dtypes are little-endian so the format does not depend on the machine
+MATRIX_ARRAY_DTYPES = (
+    ('d_data', dtype('<f8')),
+    ('W_data', dtype('<f8')),
+    ('W_row', dtype('<i4')),
+    ('W_col', dtype('<i4')),
+    ('H_mask_data', dtype('?')),
+    ('H_mask_row', dtype('<i4')),
+    ('H_mask_col', dtype('<i4'))
+)
+# Arrays that delta-encoded matrices store relative to their parent and share with it
+DELTA_ARRAY_KEYS = ('d_data', 'W_data')
+SHARED_ARRAY_KEYS = tuple(key for key, __ in MATRIX_ARRAY_DTYPES if key not in DELTA_ARRAY_KEYS)
+
+MAGIC = b'SPFA'
+VERSION = 1
+IS_COMPRESSED = 1
+# d_data and W_data are stored as '<f4' instead of '<f8'
+IS_SINGLE_PRECISION = 2
+# d_data and W_data are relative to another matrix, see encode_matrix_delta
+IS_DELTA = 4
+KNOWN_FLAGS = IS_COMPRESSED | IS_SINGLE_PRECISION | IS_DELTA
+# magic, version, flags, padding and the length of each array
+HEADER = Struct('<4sBB2x{}Q'.format(len(MATRIX_ARRAY_DTYPES)))
+# Arrays start at multiples of this many bytes, so they can be used without copying
+ALIGNMENT = 8
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def matrix_array_dtypes(is_single_precision=False):
+    """MATRIX_ARRAY_DTYPES, with '<f4' instead of '<f8' if is_single_precision is True"""
+    if not is_single_precision:
+        return MATRIX_ARRAY_DTYPES
+
+    return tuple(
+        (key, dtype('<f4') if array_dtype.kind == 'f' else array_dtype)
+        for key, array_dtype in MATRIX_ARRAY_DTYPES
+    )
+
+
+def encode_matrix_arrays(arrays, is_compressed=False, is_single_precision=False, is_delta=False):
+    """
+    Encodes the given dict of arrays into the binary EcosystemMatrix format
+    The format is a fixed-size header followed by the raw little-endian arrays,
+    optionally compressed with zlib
+    """
+    arrays = [asarray(arrays[key], dtype=array_dtype)
+              for key, array_dtype in matrix_array_dtypes(is_single_precision)]
+
+    body = b''.join(
+        array.tobytes() + b'\0' * _padding(array.nbytes) for array in arrays
+    )
+    if is_compressed:
+        body = compress(body)
+
+    flags = (IS_COMPRESSED if is_compressed else 0) | \
+        (IS_SINGLE_PRECISION if is_single_precision else 0) | (IS_DELTA if is_delta else 0)
+    return HEADER.pack(MAGIC, VERSION, flags, *(len(array) for array in arrays)) + body
+
+
+def _decode_matrix_arrays(data):
+    data = memoryview(data)
+    magic, version, flags, *lengths = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or flags & ~KNOWN_FLAGS:
+        raise ValueError('Unsupported ecosystem matrix data format')
+
+    body = data[HEADER.size:]
+    if flags & IS_COMPRESSED:
+        body = decompress(body)
+
+    arrays = {}
+    offset = 0
+    for (key, array_dtype), length in zip(
+        matrix_array_dtypes(flags & IS_SINGLE_PRECISION), lengths
+    ):
+        arrays[key] = frombuffer(body, dtype=array_dtype, count=length, offset=offset)
+        nbytes = length * array_dtype.itemsize
+        offset += nbytes + _padding(nbytes)
+
+    return flags, arrays
+
+
+def decode_matrix_arrays(data):
+    """
+    Decodes the binary EcosystemMatrix format into a dict of read-only arrays
+    Uncompressed arrays are views into the given data, without any copying
+    """
+    flags, arrays = _decode_matrix_arrays(data)
+    if flags & IS_DELTA:
+        raise ValueError('Delta-encoded ecosystem matrix data requires its parent matrix')
+
+    return arrays
+
+
+def _xor(array, other_array):
+    # XOR of the bit patterns, which is exact and mostly zero bits for similar floats
+    uint_dtype = dtype('<u{}'.format(array.dtype.itemsize))
+    return (array.view(uint_dtype) ^ other_array.view(uint_dtype)).view(array.dtype)
+
+
+def _shuffle(array):
+    # Groups the nth bytes of all elements together, so the zero bytes compress better
+    return array.view('u1').reshape((-1, array.dtype.itemsize)).transpose().ravel().view(
+        array.dtype
+    )
+
+
+def _unshuffle(array):
+    return array.view('u1').reshape((array.dtype.itemsize, -1)).transpose().ravel().view(
+        array.dtype
+    )
+
+
+def encode_matrix_delta(arrays, parent_arrays):
+    """
+    Encodes the given dict of arrays relative to the arrays of its parent matrix
+    Only the XOR of the d_data and W_data bits is stored, byte-shuffled and compressed with zlib,
+    so every other array must be the same as in the parent matrix
+    Returns None if that is not the case and the arrays cannot be delta-encoded
+    """
+    if len(arrays['d_data']) != len(parent_arrays['d_data']) or any(
+        not array_equal(arrays[key], parent_arrays[key]) for key in SHARED_ARRAY_KEYS
+    ):
+        return None
+
+    is_single_precision = asarray(arrays['d_data']).dtype.itemsize == 4
+    array_dtypes = dict(matrix_array_dtypes(is_single_precision))
+    delta_arrays = {key: [] for key in SHARED_ARRAY_KEYS}
+    for key in DELTA_ARRAY_KEYS:
+        delta_arrays[key] = _shuffle(_xor(asarray(arrays[key], dtype=array_dtypes[key]),
+                                          asarray(parent_arrays[key], dtype=array_dtypes[key])))
+
+    return encode_matrix_arrays(delta_arrays, is_compressed=True,
+                                is_single_precision=is_single_precision, is_delta=True)
+
+
+def decode_matrix_delta(data, parent_arrays):
+    """Decodes the result of encode_matrix_delta into a dict of arrays, given the parent's arrays"""
+    flags, delta_arrays = _decode_matrix_arrays(data)
+    if not flags & IS_DELTA:
+        raise ValueError('Ecosystem matrix data is not delta-encoded')
+
+    arrays = {key: parent_arrays[key] for key in SHARED_ARRAY_KEYS}
+    for key in DELTA_ARRAY_KEYS:
+        delta_array = _unshuffle(delta_arrays[key])
+        arrays[key] = _xor(delta_array, asarray(parent_arrays[key], dtype=delta_array.dtype))
+
+    return arrays
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from mmap import mmap
+from threading import Lock
+
+from scipy.sparse import coo_matrix
+
+from ..config import ECOSYSTEM_MATRIX_CACHE_MB
+from .store import ECOSYSTEM_MATRIX_STORE
+
+__all__ = ('DecodedEcosystemMatrix', 'EcosystemMatrixCache', 'ECOSYSTEM_MATRIX_CACHE')
+
+# Rough number of bytes used by each id in the id lists and index maps
+BYTES_PER_ID = 256
+
+
+def _is_memory_mapped(array):
+    """Returns True if the given array is a view into a memory-mapped file"""
+    base = array
+    while base is not None:
+        if isinstance(base, mmap):
+            return True
+        base = base.obj if isinstance(base, memoryview) else getattr(base, 'base', None)
+
+    return False
+
+
+class DecodedEcosystemMatrix(object):
+    """Decoded arrays and id index maps of an EcosystemMatrix, which never change once saved"""
+
+    def __init__(self, ecosystem_matrix):
+        self.uuid = ecosystem_matrix.uuid
+        self.ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
+        self.Q_ids = list(ecosystem_matrix.Q_ids)
+        self.C_ids = list(ecosystem_matrix.C_ids)
+        self.Q_idx_by_id = {Q_id: idx for idx, Q_id in enumerate(self.Q_ids)}
+        self.C_idx_by_id = {C_id: idx for idx, C_id in enumerate(self.C_ids)}
+
+        shape = (len(self.C_ids), len(self.Q_ids))
+        is_stored = ECOSYSTEM_MATRIX_STORE is not None and self.uuid is not None
+        stored = ECOSYSTEM_MATRIX_STORE.get(self.uuid) if is_stored else None
+        if stored is None and is_stored:
+            ECOSYSTEM_MATRIX_STORE.add(self.uuid, ecosystem_matrix.arrays, shape)
+            stored = ECOSYSTEM_MATRIX_STORE.get(self.uuid)
+
+        if stored is None:
+            self.arrays = ecosystem_matrix.arrays
+            self.W_NCxNQ = coo_matrix(
+                (self.arrays['W_data'], (self.arrays['W_row'], self.arrays['W_col'])), shape=shape
+            ).toarray()
+            self.H_mask_NCxNQ = coo_matrix(
+                (self.arrays['H_mask_data'],
+                 (self.arrays['H_mask_row'], self.arrays['H_mask_col'])),
+                shape=shape
+            ).toarray()
+        else:
+            # Read-only memory-mapped arrays shared with all other processes on this machine,
+            # including the dense W and H_mask, so they are never copied into this process
+            self.arrays, self.W_NCxNQ, self.H_mask_NCxNQ = stored
+
+        self.d_NQx1 = self.arrays['d_data'].reshape((-1, 1))
+
+    @property
+    def nbytes(self):
+        """
+        Rough number of bytes of process memory used by this matrix
+        Memory-mapped arrays, including the dense W and H_mask read from the store,
+        are shared with other processes through the OS page cache
+        and d_NQx1 is a view of d_data, so they are not counted,
+        but the dense W and H_mask that this process built itself are
+        """
+        return sum(
+            array.nbytes for array in list(self.arrays.values()) + [self.W_NCxNQ, self.H_mask_NCxNQ]
+            if not _is_memory_mapped(array)
+        ) + 2 * BYTES_PER_ID * (len(self.Q_ids) + len(self.C_ids))
+
+
+class EcosystemMatrixCache(object):
+    """
+    Process-local LRU cache of DecodedEcosystemMatrix objects, keyed by ecosystem matrix uuid
+    The least recently used matrices are evicted once the cache uses more than max_bytes
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._decoded_ecosystem_matrices = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, uuid):
+        return uuid in self._decoded_ecosystem_matrices
+
+    def __len__(self):
+        return len(self._decoded_ecosystem_matrices)
+
+    def get(self, ecosystem_matrix):
+        """Returns the cached DecodedEcosystemMatrix for the given EcosystemMatrix or decodes it"""
+        uuid = ecosystem_matrix.uuid
+        with self._lock:
+            decoded_ecosystem_matrix = self._decoded_ecosystem_matrices.get(uuid)
+            if decoded_ecosystem_matrix is not None:
+                self._decoded_ecosystem_matrices.move_to_end(uuid)
+                self.hits += 1
+                return decoded_ecosystem_matrix
+
+            self.misses += 1
+
+        decoded_ecosystem_matrix = DecodedEcosystemMatrix(ecosystem_matrix)
+        if uuid is not None:
+            self.add(decoded_ecosystem_matrix)
+        return decoded_ecosystem_matrix
+
+    def add(self, decoded_ecosystem_matrix):
+        nbytes = decoded_ecosystem_matrix.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._discard(decoded_ecosystem_matrix.uuid)
+            self._decoded_ecosystem_matrices[decoded_ecosystem_matrix.uuid] = \
+                decoded_ecosystem_matrix
+            self.num_bytes += nbytes
+
+            while self.num_bytes > self.max_bytes:
+                __, evicted_ecosystem_matrix = self._decoded_ecosystem_matrices.popitem(
+                    last=False
+                )
+                self.num_bytes -= evicted_ecosystem_matrix.nbytes
+
+    def discard(self, uuid):
+        with self._lock:
+            self._discard(uuid)
+
+    def _discard(self, uuid):
+        decoded_ecosystem_matrix = self._decoded_ecosystem_matrices.pop(uuid, None)
+        if decoded_ecosystem_matrix is not None:
+            self.num_bytes -= decoded_ecosystem_matrix.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._decoded_ecosystem_matrices.clear()
+            self.num_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+ECOSYSTEM_MATRIX_CACHE = EcosystemMatrixCache(max_bytes=ECOSYSTEM_MATRIX_CACHE_MB * 2**20)
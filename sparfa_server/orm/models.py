@@ -1,16 +1,27 @@
 from datetime import datetime
+from hashlib import sha256
 from uuid import uuid4
 
-from sqlalchemy import Column, Index
+from sqlalchemy import Column, ForeignKey, Index, func, text, update
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import ARRAY, BOOLEAN, FLOAT, INTEGER, TIMESTAMP, UUID
+from sqlalchemy.dialects.postgresql import (ARRAY, BIGINT, BOOLEAN, BYTEA, FLOAT,
+                                            INTEGER, TEXT, TIMESTAMP, UUID, insert)
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.sql.expression import not_
-from scipy.sparse import coo_matrix
-from numpy import array
+from scipy.sparse import coo_matrix, csr_matrix
+from numpy import array, asarray, float32
 
 from sparfa_algs.sgd.sparfa_algs import SparfaAlgs
 
-__all__ = ('Course', 'Ecosystem', 'Page', 'Response', 'EcosystemMatrix')
+from ..config import ECOSYSTEM_MATRIX_PRECISION, ECOSYSTEM_MATRIX_STORAGE
+from ..algs import ResponseColumns, convert_Rs, refine_W_d
+from .binary import (MATRIX_ARRAY_DTYPES, matrix_array_dtypes, encode_matrix_arrays,
+                     decode_matrix_arrays, encode_matrix_delta, decode_matrix_delta)
+from .cache import ECOSYSTEM_MATRIX_CACHE
+from .store import ECOSYSTEM_MATRIX_STORE
+
+__all__ = ('Course', 'Ecosystem', 'Page', 'Response', 'EcosystemMatrixPayload',
+           'EcosystemMatrix', 'EcosystemMatrixStats', 'CalculationLease')
 
 
 class BaseBase(object):
@@ -41,6 +52,9 @@ class Ecosystem(Base):
     metadata_sequence_number = Column(INTEGER, nullable=False, index=True, unique=True)
     sequence_number = Column(INTEGER, nullable=False)
     last_ecosystem_matrix_update_calculation_uuid = Column(UUID)
+    # Number of real responses received since the last ecosystem matrix calculation started
+    # Used to calculate the ecosystem matrices for the most active ecosystems first
+    num_pending_responses = Column(INTEGER, default=0, nullable=False)
     default_conflict_update_columns = ['last_ecosystem_matrix_update_calculation_uuid']
 
 
@@ -53,46 +67,226 @@ class Page(Base):
 class Response(Base):
     __tablename__ = 'responses'
     course_uuid = Column(UUID, nullable=False, index=True)
-    ecosystem_uuid = Column(UUID, nullable=False, index=True)
+    ecosystem_uuid = Column(UUID, nullable=False)
     trial_uuid = Column(UUID, nullable=False, index=True, unique=True)
     student_uuid = Column(UUID, nullable=False, index=True)
     exercise_uuid = Column(UUID, nullable=False, index=True)
     is_correct = Column(BOOLEAN, nullable=False)
     is_real_response = Column(BOOLEAN, nullable=False)
     responded_at = Column(TIMESTAMP, nullable=False)
+    # Id of the last transaction that inserted or updated this response, from the database,
+    # so responses can be ordered by when they were committed regardless of any app clock
+    # NULL for responses saved before this column was added
+    transaction_id = Column(BIGINT, default=func.txid_current(),
+                            onupdate=func.txid_current(), server_default=text('txid_current()'))
+    # Also used to load only the responses committed after an ecosystem matrix was calculated
     __table_args__ = (Index('ix_real_responses_ecosystem_uuid',
                             ecosystem_uuid,
-                            postgresql_where=is_real_response),)
+                            transaction_id,
+                            postgresql_where=is_real_response),
+                      # Used to load only the responses to the exercises being calculated
+                      Index('ix_responses_ecosystem_uuid_student_uuid_exercise_uuid',
+                            ecosystem_uuid,
+                            student_uuid,
+                            exercise_uuid))
     default_conflict_index_elements = ['trial_uuid']
     default_conflict_update_columns = ['uuid', 'is_correct', 'is_real_response', 'responded_at']
 
+    @staticmethod
+    def dict_for_algs_from_values(student_uuid, exercise_uuid, is_correct, responded_at):
+        return {
+            'L_id':         str(student_uuid),
+            'Q_id':         str(exercise_uuid),
+            'correct?':     is_correct,
+            'responded_at': str(responded_at)
+        }
+
     @property
     def dict_for_algs(self):
+        return self.dict_for_algs_from_values(
+            student_uuid=self.student_uuid,
+            exercise_uuid=self.exercise_uuid,
+            is_correct=self.is_correct,
+            responded_at=self.responded_at
+        )
+
+
+class EcosystemMatrixPayload(Base):
+    """
+    Large columns of an EcosystemMatrix, which never change once saved
+    Kept in a separate table so queries and updates on ecosystem_matrices do not touch them
+    """
+    __tablename__ = 'ecosystem_matrix_payloads'
+    uuid = Column(UUID, ForeignKey('ecosystem_matrices.uuid', ondelete='CASCADE'),
+                  primary_key=True)
+    # Delta-encoded payloads have a parent payload, which is never delta-encoded itself
+    # Their Q_ids, C_ids and H_mask are the parent's and their data is relative to the parent's
+    parent_uuid = Column(UUID, ForeignKey('ecosystem_matrix_payloads.uuid'), index=True)
+    parent = relationship('EcosystemMatrixPayload', remote_side=[uuid])
+    Q_ids = Column(ARRAY(UUID))
+    C_ids = Column(ARRAY(UUID))
+    # Either data or all of the ARRAY columns below are set, depending on ECOSYSTEM_MATRIX_STORAGE
+    # data contains the same arrays in the binary format from orm/binary.py
+    data = Column(BYTEA)
+    d_data = Column(ARRAY(FLOAT))
+    W_data = Column(ARRAY(FLOAT))
+    W_row = Column(ARRAY(INTEGER))
+    W_col = Column(ARRAY(INTEGER))
+    H_mask_data = Column(ARRAY(BOOLEAN))
+    H_mask_row = Column(ARRAY(INTEGER))
+    H_mask_col = Column(ARRAY(INTEGER))
+
+    @property
+    def arrays(self):
+        """Dict containing the arrays stored in this payload, which must not be delta-encoded"""
+        if self.data is not None:
+            return decode_matrix_arrays(self.data)
+
         return {
-            'L_id':         str(self.student_uuid),
-            'Q_id':         str(self.exercise_uuid),
-            'correct?':     self.is_correct,
-            'responded_at': str(self.responded_at)
+            key: asarray(getattr(self, key) or [], dtype=array_dtype)
+            for key, array_dtype in MATRIX_ARRAY_DTYPES
         }
 
 
+def _payload_column_property(key, is_shared=False):
+    """
+    Property that reads and writes the given column of an EcosystemMatrix's payload
+    Shared columns are read from the parent payload if the payload is delta-encoded
+    """
+
+    def getter(self):
+        payload = self.payload
+        if payload is None:
+            return None
+
+        if is_shared and payload.parent_uuid is not None:
+            return getattr(payload.parent, key)
+
+        return getattr(payload, key)
+
+    def setter(self, value):
+        if self.payload is None:
+            self.payload = EcosystemMatrixPayload()
+        setattr(self.payload, key, value)
+
+    return property(getter, setter)
+
+
 class EcosystemMatrix(Base):
     __tablename__ = 'ecosystem_matrices'
     ecosystem_uuid = Column(UUID, nullable=False, index=True)
     is_used_in_assignments = Column(BOOLEAN, default=False, nullable=False)
     superseded_at = Column(TIMESTAMP)
-    Q_ids = Column(ARRAY(UUID), nullable=False)
-    C_ids = Column(ARRAY(UUID), nullable=False)
-    d_data = Column(ARRAY(FLOAT), nullable=False)
-    W_data = Column(ARRAY(FLOAT), nullable=False)
-    W_row = Column(ARRAY(INTEGER), nullable=False)
-    W_col = Column(ARRAY(INTEGER), nullable=False)
-    H_mask_data = Column(ARRAY(BOOLEAN), nullable=False)
-    H_mask_row = Column(ARRAY(INTEGER), nullable=False)
-    H_mask_col = Column(ARRAY(INTEGER), nullable=False)
+    num_responses = Column(INTEGER)
+    # Number of responses used by the last cold start (full SGD) this matrix was refined from
+    cold_start_num_responses = Column(INTEGER)
+    # Oldest transaction still running when the responses used to calculate this matrix were read
+    # Every response with a lower transaction_id was committed and used by this matrix
+    responses_watermark = Column(BIGINT)
+    pages_hash = Column(TEXT)
+    # Loaded only when needed; the payload rows are deleted together with their matrices
+    payload = relationship(EcosystemMatrixPayload, uselist=False,
+                           cascade='all, delete-orphan', passive_deletes=True)
     __table_args__ = (Index('ix_deletable_ecosystem_matrices_superseded_at',
                             superseded_at,
                             postgresql_where=not_(is_used_in_assignments)),)
+    # Columns only used to decide how to calculate the next matrix for the same ecosystem
+    INTERNAL_COLUMNS = ('num_responses', 'cold_start_num_responses',
+                        'responses_watermark', 'pages_hash')
+    # Columns that never change once saved and that can be cached in decoded form
+    # They are stored in EcosystemMatrixPayload but can be used as if they were in this model
+    PAYLOAD_COLUMNS = ('Q_ids', 'C_ids', 'data') + tuple(key for key, __ in MATRIX_ARRAY_DTYPES)
+    Q_ids = _payload_column_property('Q_ids', is_shared=True)
+    C_ids = _payload_column_property('C_ids', is_shared=True)
+    data = _payload_column_property('data')
+    d_data = _payload_column_property('d_data')
+    W_data = _payload_column_property('W_data')
+    W_row = _payload_column_property('W_row')
+    W_col = _payload_column_property('W_col')
+    H_mask_data = _payload_column_property('H_mask_data')
+    H_mask_row = _payload_column_property('H_mask_row')
+    H_mask_col = _payload_column_property('H_mask_col')
+
+    @property
+    def is_delta_encoded(self):
+        return self.payload is not None and self.payload.parent_uuid is not None
+
+    @property
+    def payload_dict(self):
+        """Values of the payload columns, always fully materialized even for delta-encoded ones"""
+        if not self.is_delta_encoded:
+            return {key: getattr(self, key) for key in self.PAYLOAD_COLUMNS}
+
+        arrays = self.arrays
+        payload_dict = {key: None for key in self.PAYLOAD_COLUMNS}
+        payload_dict.update(Q_ids=self.Q_ids, C_ids=self.C_ids, data=encode_matrix_arrays(
+            arrays, is_compressed=True, is_single_precision=arrays['d_data'].dtype == float32
+        ))
+        return payload_dict
+
+    @property
+    def dict(self):
+        """Values of both this matrix and its payload, which can be used to recreate it"""
+        values = super().dict
+        values.update(self.payload_dict)
+        return values
+
+    @classmethod
+    def upsert_values(cls, session, values, previous_ecosystem_matrices=()):
+        """
+        Upserts the given values, as returned by dict, into both tables
+        If ECOSYSTEM_MATRIX_STORAGE is delta, the payloads are delta-encoded relative to
+        the given previous_ecosystem_matrices for the same ecosystems whenever possible
+        """
+        previous_ecosystem_matrix_by_ecosystem_uuid = {
+            ecosystem_matrix.ecosystem_uuid: ecosystem_matrix
+            for ecosystem_matrix in previous_ecosystem_matrices
+        } if ECOSYSTEM_MATRIX_STORAGE == 'delta' else {}
+
+        payload_values = []
+        for matrix_values in values:
+            payload = EcosystemMatrixPayload(
+                uuid=matrix_values['uuid'],
+                **{key: matrix_values.get(key) for key in cls.PAYLOAD_COLUMNS}
+            )
+            previous_ecosystem_matrix = previous_ecosystem_matrix_by_ecosystem_uuid.get(
+                matrix_values['ecosystem_uuid']
+            )
+            if previous_ecosystem_matrix is not None:
+                payload = cls._delta_encoded_payload(payload, previous_ecosystem_matrix)
+            payload_values.append(payload.dict)
+
+        session.upsert_values(cls, [
+            {key: value for key, value in matrix_values.items()
+             if key not in cls.PAYLOAD_COLUMNS} for matrix_values in values
+        ])
+        session.upsert_values(EcosystemMatrixPayload, payload_values)
+
+    @staticmethod
+    def _delta_encoded_payload(payload, previous_ecosystem_matrix):
+        """
+        Returns a payload equivalent to the given one that is delta-encoded relative to
+        the previous matrix's parent payload, or to its payload if it is not delta-encoded
+        Returns the given payload if it cannot be delta-encoded or that does not make it smaller
+        """
+        if previous_ecosystem_matrix.is_delta_encoded:
+            parent = previous_ecosystem_matrix.payload.parent
+            parent_uuid = previous_ecosystem_matrix.payload.parent_uuid
+        else:
+            parent = previous_ecosystem_matrix.payload
+            parent_uuid = previous_ecosystem_matrix.uuid
+        if [str(Q_id) for Q_id in payload.Q_ids] != [str(Q_id) for Q_id in parent.Q_ids] or \
+                [str(C_id) for C_id in payload.C_ids] != [str(C_id) for C_id in parent.C_ids]:
+            return payload
+
+        arrays = payload.arrays
+        data = encode_matrix_delta(arrays, parent.arrays)
+        if data is None or len(data) >= len(encode_matrix_arrays(
+            arrays, is_compressed=True, is_single_precision=arrays['d_data'].dtype == float32
+        )):
+            return payload
+
+        return EcosystemMatrixPayload(uuid=payload.uuid, parent_uuid=parent_uuid, data=data)
 
     @property
     def NC(self):
@@ -103,58 +297,339 @@ class EcosystemMatrix(Base):
         return len(self.Q_ids)
 
     @property
-    def W_NCxNQ(self):
-        return coo_matrix(
-            (self.W_data, (self.W_row, self.W_col)),
+    def arrays(self):
+        """
+        Dict containing all the arrays that make up this matrix, regardless of storage format
+        The float arrays use the precision set by ECOSYSTEM_MATRIX_PRECISION
+        """
+        payload = self.payload
+        if payload is None:
+            arrays = EcosystemMatrixPayload().arrays
+        elif payload.parent_uuid is not None:
+            arrays = decode_matrix_delta(payload.data, payload.parent.arrays)
+        else:
+            arrays = payload.arrays
+
+        return {
+            key: arrays[key].astype(array_dtype, copy=False)
+            for key, array_dtype in matrix_array_dtypes(ECOSYSTEM_MATRIX_PRECISION == 'single')
+        }
+
+    def _set_arrays(self, **arrays):
+        ECOSYSTEM_MATRIX_CACHE.discard(self.uuid)
+
+        if self.is_delta_encoded:
+            # Changing a delta-encoded matrix turns it back into a full matrix
+            for key, value in self.payload_dict.items():
+                setattr(self.payload, key, value)
+            self.payload.parent = None
+            self.payload.parent_uuid = None
+
+        is_single_precision = ECOSYSTEM_MATRIX_PRECISION == 'single'
+        if ECOSYSTEM_MATRIX_STORAGE == 'arrays':
+            # The ARRAY columns are always double precision,
+            # but the values are rounded so they decode to the same single precision arrays
+            array_dtypes = dict(matrix_array_dtypes(is_single_precision))
+            all_arrays = {} if self.data is None else self.arrays
+            all_arrays.update(arrays)
+            for key, value in all_arrays.items():
+                setattr(self, key, asarray(value, dtype=array_dtypes[key]).tolist())
+            self.data = None
+        else:
+            # New matrices are only delta-encoded when saved, see upsert_values
+            all_arrays = self.arrays
+            all_arrays.update(arrays)
+            self.data = encode_matrix_arrays(
+                all_arrays,
+                is_compressed=ECOSYSTEM_MATRIX_STORAGE in ('compressed', 'delta'),
+                is_single_precision=is_single_precision
+            )
+            for key, array_dtype in MATRIX_ARRAY_DTYPES:
+                setattr(self, key, None)
+
+    @property
+    def decoded(self):
+        """DecodedEcosystemMatrix for this matrix, from the process-local cache if possible"""
+        return ECOSYSTEM_MATRIX_CACHE.get(self)
+
+    @property
+    def decoded_dict(self):
+        """
+        Same as dict, but with the arrays always in the ARRAY columns instead of data
+        and without the INTERNAL_COLUMNS, so it only contains the matrix itself
+        The ids and arrays come from the cache if possible, so they do not need to be loaded
+        """
+        decoded = self.decoded
+        # Only the columns of this model, without the payload
+        decoded_dict = {key: value for key, value in super().dict.items()
+                        if key not in self.INTERNAL_COLUMNS}
+        decoded_dict.update(Q_ids=decoded.Q_ids, C_ids=decoded.C_ids)
+        decoded_dict.update({
+            # Single precision values are sent as the shortest decimals that round-trip,
+            # instead of gaining spurious digits when converted to double precision
+            key: value.astype(str).astype(float).tolist() if value.dtype == float32
+            else value.tolist() for key, value in decoded.arrays.items()
+        })
+        return decoded_dict
+
+    @classmethod
+    def query_cached(cls, session, *criterion):
+        """
+        Queries the ecosystem matrices matching the given criterion
+        The payloads are only loaded for matrices that are not in the process-local cache
+        and are then added to it, so the cached matrices can be used through decoded
+        Only the ids are loaded for matrices that are in the local ECOSYSTEM_MATRIX_STORE
+        """
+        ecosystem_matrices = session.query(cls).filter(*criterion).all()
+
+        uncached_uuids = [ecosystem_matrix.uuid for ecosystem_matrix in ecosystem_matrices
+                          if ecosystem_matrix.uuid not in ECOSYSTEM_MATRIX_CACHE]
+        stored_uuids = [] if ECOSYSTEM_MATRIX_STORE is None else \
+            [uuid for uuid in uncached_uuids if uuid in ECOSYSTEM_MATRIX_STORE]
+        unstored_uuids = [uuid for uuid in uncached_uuids if uuid not in set(stored_uuids)]
+        for uuids, keys in ((stored_uuids, ('Q_ids', 'C_ids')),
+                            (unstored_uuids, cls.PAYLOAD_COLUMNS)):
+            if uuids:
+                # Loads the payloads and the parents of delta-encoded payloads
+                # into the ecosystem_matrices already in the session
+                for ecosystem_matrix in session.query(cls).filter(cls.uuid.in_(uuids)).options(
+                    selectinload(cls.payload).load_only('parent_uuid', *keys),
+                    selectinload(cls.payload).selectinload(
+                        EcosystemMatrixPayload.parent
+                    ).load_only(*keys)
+                ).all():
+                    ECOSYSTEM_MATRIX_CACHE.get(ecosystem_matrix)
+
+        return ecosystem_matrices
+
+    def _csr_matrix(self, arrays, prefix):
+        """Returns the NCxNQ CSR matrix stored in the given arrays with the given key prefix"""
+        return csr_matrix(
+            (arrays[prefix + '_data'], (arrays[prefix + '_row'], arrays[prefix + '_col'])),
             shape=(self.NC, self.NQ)
-        ).toarray()
+        )
+
+    @property
+    def matrices(self):
+        """
+        Dict containing the arrays, the W and H_mask CSR matrices and the d vector of this matrix
+        Each access to arrays decodes the payload again,
+        so this decodes it once for callers that need more than 1 of them
+        """
+        arrays = self.arrays
+        return {
+            'arrays': arrays,
+            'W_NCxNQ_csr': self._csr_matrix(arrays, 'W'),
+            'H_mask_NCxNQ_csr': self._csr_matrix(arrays, 'H_mask'),
+            'd_NQx1': array(arrays['d_data'], ndmin=2).transpose()
+        }
+
+    @property
+    def W_NCxNQ_csr(self):
+        return self._csr_matrix(self.arrays, 'W')
+
+    @property
+    def W_NCxNQ(self):
+        return self.W_NCxNQ_csr.toarray()
 
     @W_NCxNQ.setter
     def W_NCxNQ(self, matrix):
+        # Both dense and sparse matrices are accepted, but explicit zeros are not stored
         sparse_matrix = coo_matrix(matrix)
-        self.W_data = sparse_matrix.data.tolist()
-        self.W_row = sparse_matrix.row.tolist()
-        self.W_col = sparse_matrix.col.tolist()
+        nonzero = sparse_matrix.data != 0
+        self._set_arrays(
+            W_data=sparse_matrix.data[nonzero],
+            W_row=sparse_matrix.row[nonzero],
+            W_col=sparse_matrix.col[nonzero]
+        )
+
+    @property
+    def H_mask_NCxNQ_csr(self):
+        return self._csr_matrix(self.arrays, 'H_mask')
 
     @property
     def H_mask_NCxNQ(self):
-        return coo_matrix(
-            (self.H_mask_data, (self.H_mask_row, self.H_mask_col)),
-            shape=(self.NC, self.NQ)
-        ).toarray()
+        return self.H_mask_NCxNQ_csr.toarray()
 
     @H_mask_NCxNQ.setter
     def H_mask_NCxNQ(self, matrix):
         sparse_matrix = coo_matrix(matrix)
-        self.H_mask_data = sparse_matrix.data.tolist()
-        self.H_mask_row = sparse_matrix.row.tolist()
-        self.H_mask_col = sparse_matrix.col.tolist()
+        self._set_arrays(
+            H_mask_data=sparse_matrix.data,
+            H_mask_row=sparse_matrix.row,
+            H_mask_col=sparse_matrix.col
+        )
 
     @property
     def d_NQx1(self):
-        return array(self.d_data, ndmin=2).transpose()
+        return array(self.arrays['d_data'], ndmin=2).transpose()
 
     @d_NQx1.setter
     def d_NQx1(self, arr):
-        self.d_data = arr.flatten().tolist()
+        self._set_arrays(d_data=asarray(arr).flatten())
 
     @staticmethod
     def _response_dicts_for_algs_from_responses(responses):
+        if isinstance(responses, ResponseColumns):
+            return list(responses.dicts_for_algs())
+
         return [resp if isinstance(resp, dict) else resp.dict_for_algs for resp in responses]
 
     @classmethod
-    def from_ecosystem_uuid_pages_responses(cls, ecosystem_uuid, pages, responses):
+    def _response_columns_from_responses(cls, responses):
+        if isinstance(responses, ResponseColumns):
+            return responses
+
+        return ResponseColumns.from_dicts_for_algs(
+            cls._response_dicts_for_algs_from_responses(responses)
+        )
+
+    def has_same_structure(self, C_ids, hints):
+        """
+        Returns True if this matrix has exactly the given concepts and concept-exercise hints,
+        which means its W and d can be used to warm-start a new calculation
+        """
+        if set(str(C_id) for C_id in self.C_ids) != set(str(C_id) for C_id in C_ids):
+            return False
+
+        arrays = self.arrays
+        return set(
+            (str(self.Q_ids[col]), str(self.C_ids[row])) for row, col, data in zip(
+                arrays['H_mask_row'].tolist(),
+                arrays['H_mask_col'].tolist(),
+                arrays['H_mask_data'].tolist()
+            ) if data
+        ) == set((str(hint['Q_id']), str(hint['C_id'])) for hint in hints)
+
+    def can_warm_start(self, C_ids, hints, num_responses):
+        """
+        Returns True if a new matrix with the given structure and number of responses
+        can be obtained by refining this matrix instead of running SGD from scratch
+        We fall back to a cold start once the number of responses has doubled since the last
+        cold start, so that repeated refinements do not drift too far from a full SGD solution
+        """
+        cold_start_num_responses = self.cold_start_num_responses or self.num_responses
+        return bool(cold_start_num_responses) and \
+            0 < num_responses < 2 * cold_start_num_responses and \
+            self.has_same_structure(C_ids=C_ids, hints=hints)
+
+    def has_same_inputs(self, num_responses, last_response_transaction_id, pages_hash):
+        """
+        Returns True if this matrix was calculated from the given number of responses and pages
+        and no response was saved since, according to the given last transaction_id
+        of the ecosystem's responses, so recalculating it would be pointless
+        Responses saved by transactions that were still running when this matrix's responses
+        were read might not have been used, so they are never considered the same
+        """
+        return self.num_responses == num_responses and \
+            self.responses_watermark is not None and \
+            (last_response_transaction_id is None or
+             last_response_transaction_id < self.responses_watermark) and \
+            self.pages_hash == pages_hash
+
+    def refined_with_responses(self, responses, num_epochs, num_responses=None):
+        """
+        Returns a new EcosystemMatrix whose W and d were obtained by refining this matrix's
+        W and d using the given responses, without running SGD from scratch
+        The responses can be either all of the ecosystem's responses or only the new ones,
+        in which case num_responses must be the total number of responses in the ecosystem
+        """
+        response_columns = self._response_columns_from_responses(responses)
+        if num_responses is None:
+            num_responses = len(response_columns)
+
+        if len(response_columns) == 0:
+            return self.__class__(
+                uuid=str(uuid4()),
+                ecosystem_uuid=self.ecosystem_uuid,
+                num_responses=num_responses,
+                cold_start_num_responses=self.cold_start_num_responses or self.num_responses,
+                pages_hash=self.pages_hash,
+                **self.payload_dict
+            )
+
+        algs = self.to_sparfa_algs_with_student_uuids_responses(
+            student_uuids=response_columns.L_ids,
+            responses=response_columns
+        )
+
+        # W and H_mask stay sparse during the refinement
+        # algs keeps this matrix's Q_ids and C_ids order, since G was built using that order
+        matrices = self.matrices
+        H_mask_NCxNQ = matrices['H_mask_NCxNQ_csr']
+        W_NCxNQ, d_NQx1 = refine_W_d(
+            W_NCxNQ=matrices['W_NCxNQ_csr'],
+            d_NQx1=matrices['d_NQx1'],
+            H_mask_NCxNQ=H_mask_NCxNQ,
+            U_NCxNL=algs.U_NCxNL,
+            G_NQxNL=algs.G_NQxNL,
+            G_mask_NQxNL=algs.G_mask_NQxNL,
+            num_epochs=num_epochs
+        )
+
+        return self.__class__(
+            uuid=str(uuid4()),
+            ecosystem_uuid=self.ecosystem_uuid,
+            num_responses=num_responses,
+            cold_start_num_responses=self.cold_start_num_responses or self.num_responses,
+            pages_hash=self.pages_hash,
+            Q_ids=self.Q_ids,
+            C_ids=self.C_ids,
+            d_NQx1=d_NQx1,
+            W_NCxNQ=W_NCxNQ,
+            H_mask_NCxNQ=H_mask_NCxNQ
+        )
+
+    @staticmethod
+    def C_ids_hints_from_pages(pages):
         page_dicts = [page if isinstance(page, dict) else page.dict for page in pages]
-        response_dicts = cls._response_dicts_for_algs_from_responses(responses)
 
-        hints = [{
+        return [page['uuid'] for page in page_dicts], [{
             'Q_id': exercise_uuid, 'C_id': page['uuid']
         } for page in page_dicts for exercise_uuid in page['exercise_uuids']]
 
+    @classmethod
+    def pages_hash_from_pages(cls, pages):
+        """Returns a hash of the given pages' concepts and hints that does not depend on order"""
+        C_ids, hints = cls.C_ids_hints_from_pages(pages)
+        return sha256(repr((
+            sorted(str(C_id) for C_id in C_ids),
+            sorted((str(hint['Q_id']), str(hint['C_id'])) for hint in hints)
+        )).encode()).hexdigest()
+
+    @classmethod
+    def from_ecosystem_uuid_pages_responses(cls, ecosystem_uuid, pages, responses,
+                                            previous_ecosystem_matrix=None,
+                                            warm_start_epochs=0,
+                                            num_responses=None):
+        """
+        Calculates a new EcosystemMatrix for the given ecosystem, pages and responses
+        If a previous_ecosystem_matrix with the same structure is given and warm_start_epochs > 0,
+        its W and d are refined for warm_start_epochs instead of running SGD from scratch
+        If the responses were compacted to the latest response of each student/exercise pair,
+        num_responses must be the total number of responses in the ecosystem
+        """
+        C_ids, hints = cls.C_ids_hints_from_pages(pages)
+        response_dicts = cls._response_dicts_for_algs_from_responses(responses)
+        if num_responses is None:
+            num_responses = len(response_dicts)
+
+        if warm_start_epochs > 0 and previous_ecosystem_matrix is not None and \
+                previous_ecosystem_matrix.can_warm_start(
+                    C_ids=C_ids,
+                    hints=hints,
+                    num_responses=num_responses
+                ):
+            return previous_ecosystem_matrix.refined_with_responses(
+                responses=response_dicts,
+                num_epochs=warm_start_epochs,
+                num_responses=num_responses
+            )
+
         algs, __ = SparfaAlgs.from_Ls_Qs_Cs_Hs_Rs(
             L_ids=list(set(response['L_id'] for response in response_dicts)),
             Q_ids=[hint['Q_id'] for hint in hints],
-            C_ids=[page['uuid'] for page in page_dicts],
+            C_ids=C_ids,
             hints=hints,
             responses=response_dicts
         )
@@ -162,6 +637,9 @@ class EcosystemMatrix(Base):
         return cls(
             uuid=str(uuid4()),
             ecosystem_uuid=ecosystem_uuid,
+            num_responses=num_responses,
+            cold_start_num_responses=num_responses,
+            pages_hash=cls.pages_hash_from_pages(pages),
             Q_ids=algs.Q_ids,
             C_ids=algs.C_ids,
             d_NQx1=algs.d_NQx1,
@@ -170,25 +648,120 @@ class EcosystemMatrix(Base):
         )
 
     def to_sparfa_algs_with_student_uuids_responses(self, student_uuids, responses):
+        return self.decoded_to_sparfa_algs_with_student_uuids_responses(
+            self.decoded, student_uuids, responses
+        )
+
+    @classmethod
+    def decoded_to_sparfa_algs_with_student_uuids_responses(cls, decoded,
+                                                            student_uuids, responses):
+        """
+        Same as to_sparfa_algs_with_student_uuids_responses, but for a DecodedEcosystemMatrix
+        It does not use any EcosystemMatrix or session, so it can be called from other threads
+        """
         L_ids = list(set(student_uuids))
 
-        G_NQxNL, G_mask_NQxNL = SparfaAlgs.convert_Rs(
-            responses=self._response_dicts_for_algs_from_responses(responses),
+        G_NQxNL, G_mask_NQxNL = convert_Rs(
+            responses=cls._response_columns_from_responses(responses),
             L_ids=L_ids,
-            Q_ids=self.Q_ids
+            Q_ids=decoded.Q_ids
         )
 
         # All Q's and C's in W and H must also be in Q_ids and C_ids
         # There are no restrictions on L_ids, so they can be downselected ahead of time
+        # SparfaAlgs gets copies of the cached arrays in case it modifies them
         algs, __ = SparfaAlgs.from_W_d(
-            W_NCxNQ=self.W_NCxNQ,
-            d_NQx1=self.d_NQx1,
-            H_mask_NCxNQ=self.H_mask_NCxNQ,
+            W_NCxNQ=decoded.W_NCxNQ.copy(),
+            d_NQx1=decoded.d_NQx1.copy(),
+            H_mask_NCxNQ=decoded.H_mask_NCxNQ.copy(),
             G_NQxNL=G_NQxNL,
             G_mask_NQxNL=G_mask_NQxNL,
             L_ids=L_ids,
-            Q_ids=self.Q_ids,
-            C_ids=self.C_ids
+            Q_ids=list(decoded.Q_ids),
+            C_ids=list(decoded.C_ids)
         )
 
         return algs
+
+
+class EcosystemMatrixStats(Base):
+    """Statistics about the calculation of an EcosystemMatrix, used for capacity planning"""
+    __tablename__ = 'ecosystem_matrix_stats'
+    ecosystem_uuid = Column(UUID, nullable=False, index=True)
+    ecosystem_matrix_uuid = Column(UUID, nullable=False)
+    is_delta = Column(BOOLEAN, nullable=False)
+    # Total number of responses the matrix was calculated from
+    num_responses = Column(INTEGER, nullable=False)
+    # Number of responses loaded for this calculation, which is smaller for delta calculations
+    num_loaded_responses = Column(INTEGER, nullable=False)
+    num_students = Column(INTEGER, nullable=False)
+    num_exercises = Column(INTEGER, nullable=False)
+    num_concepts = Column(INTEGER, nullable=False)
+    load_seconds = Column(FLOAT, nullable=False)
+    calculation_seconds = Column(FLOAT, nullable=False)
+    save_seconds = Column(FLOAT, nullable=False)
+    peak_rss_kb = Column(INTEGER, nullable=False)
+
+
+class CalculationLease(Base):
+    """
+    Claim on a biglearn-scheduler calculation, so it is only calculated by 1 worker at a time
+    The uuid is the calculation uuid
+    Leases are deleted once the calculation is done and expire in case the worker dies
+    Expiry uses the database clock, so workers on machines with different clocks agree on it
+    """
+    __tablename__ = 'calculation_leases'
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+
+    @classmethod
+    def claim(cls, session, calculation_uuids, duration):
+        """
+        Claims the given calculations for the given duration (timedelta)
+        Calculations already claimed by unexpired leases are skipped
+        The claims are only visible to other workers once the transaction is committed
+        :return: Set containing the uuids of the calculations that were claimed
+        """
+        calculation_uuids = sorted(set(str(uuid) for uuid in calculation_uuids))
+        if not calculation_uuids:
+            return set()
+
+        # Inserting in a consistent order prevents deadlocks between concurrent claims
+        now = func.now()
+        insert_stmt = insert(cls).values([{
+            'uuid': calculation_uuid,
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': now + duration
+        } for calculation_uuid in calculation_uuids])
+        stmt = insert_stmt.on_conflict_do_update(
+            index_elements=['uuid'],
+            set_={'updated_at': insert_stmt.excluded.updated_at,
+                  'expires_at': insert_stmt.excluded.expires_at},
+            where=cls.expires_at <= now
+        ).returning(cls.uuid)
+        return set(str(row.uuid) for row in session.execute(stmt))
+
+    @classmethod
+    def extend(cls, session, calculation_uuids, duration):
+        """
+        Extends the existing leases for the given calculations to expire after the given duration
+        :return: Set containing the uuids of the calculations whose leases were extended
+        """
+        calculation_uuids = sorted(set(str(uuid) for uuid in calculation_uuids))
+        if not calculation_uuids:
+            return set()
+
+        now = func.now()
+        stmt = update(cls).where(cls.uuid.in_(calculation_uuids)).values(
+            updated_at=now, expires_at=now + duration
+        ).returning(cls.uuid)
+        return set(str(row.uuid) for row in session.execute(stmt))
+
+    @classmethod
+    def release(cls, session, calculation_uuids):
+        """Deletes the leases for the given calculations"""
+        calculation_uuids = sorted(set(str(uuid) for uuid in calculation_uuids))
+        if calculation_uuids:
+            session.query(cls).filter(
+                cls.uuid.in_(calculation_uuids)
+            ).delete(synchronize_session=False)
@@ -1,4 +1,5 @@
 from uuid import UUID
+from datetime import datetime
 from contextlib import contextmanager, closing
 
 from sqlalchemy import create_engine
@@ -43,9 +44,19 @@ class BiglearnSession(Session):
                     'conflict_index_elements must also be provided'
                 )
 
+            set_ = {key: getattr(insert_stmt.excluded, key) for key in conflict_update_columns}
+            # Like ORM updates, upserts that update existing rows also update their updated_at
+            if 'updated_at' in cls.__table__.columns and 'updated_at' not in set_:
+                set_['updated_at'] = datetime.now()
+            # Same for the columns updated by SQL expressions, such as Response.transaction_id
+            for column in cls.__table__.columns:
+                if column.onupdate is not None and column.onupdate.is_clause_element and \
+                        column.key not in set_:
+                    set_[column.key] = column.onupdate.arg
+
             stmt = insert_stmt.on_conflict_do_update(
                 index_elements=conflict_index_elements,
-                set_={key: getattr(insert_stmt.excluded, key) for key in conflict_update_columns}
+                set_=set_
             )
         elif conflict_index_elements:
             stmt = insert_stmt.on_conflict_do_nothing(index_elements=conflict_index_elements)
@@ -0,0 +1,158 @@
+from os import getpid, makedirs, path, remove, replace, scandir, utime
+from struct import Struct
+
+from threading import get_ident
+
+from numpy import ascontiguousarray, dtype, float32, memmap
+from scipy.sparse import coo_matrix
+
+from ..config import ECOSYSTEM_MATRIX_STORE_DIR, ECOSYSTEM_MATRIX_STORE_MB
+from .binary import ALIGNMENT, encode_matrix_arrays, decode_matrix_arrays
+
+__all__ = ('EcosystemMatrixStore', 'ECOSYSTEM_MATRIX_STORE')
+
+ARRAYS_SUFFIX = '.spfa'
+MAGIC = b'SPFS'
+VERSION = 1
+# magic, version, padding, length of the sparse arrays in the binary format and shape of W
+# The header is followed by the sparse arrays, the dense W and the dense H_mask,
+# each starting at a multiple of ALIGNMENT bytes
+HEADER = Struct('<4sB3xQQQ')
+
+
+def _padded(size):
+    return size + -size % ALIGNMENT
+
+
+class EcosystemMatrixStore(object):
+    """
+    Local directory of immutable, uuid-named ecosystem matrix files
+    Each file contains the sparse arrays of a matrix in the uncompressed binary format,
+    followed by its dense W and H_mask, so they do not need to be built by every process
+    The files are memory-mapped read-only, so every process on the same machine
+    shares a single copy of each matrix through the OS page cache
+    The least recently used files are deleted once the files use more than max_bytes
+    (0 means no limit), so each machine evicts the matrices it no longer uses
+    """
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        makedirs(directory, exist_ok=True)
+
+    def _path(self, uuid, suffix):
+        return path.join(self.directory, str(uuid) + suffix)
+
+    def __contains__(self, uuid):
+        return path.exists(self._path(uuid, ARRAYS_SUFFIX))
+
+    def get(self, uuid):
+        """
+        Returns a tuple containing a dict with the memory-mapped sparse arrays of the given matrix
+        and its memory-mapped dense W_NCxNQ and H_mask_NCxNQ, or None if it is not in the store
+        """
+        file_path = self._path(uuid, ARRAYS_SUFFIX)
+        try:
+            data = memmap(file_path, mode='r')
+        except FileNotFoundError:
+            return None
+
+        magic, version, arrays_nbytes, NC, NQ = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            # Written by an older version, so it is replaced
+            self.discard(uuid)
+            return None
+
+        offset = HEADER.size
+        arrays = decode_matrix_arrays(data[offset:offset + arrays_nbytes])
+        offset += _padded(arrays_nbytes)
+        W_dtype = arrays['W_data'].dtype
+        W_NCxNQ = data[offset:offset + NC * NQ * W_dtype.itemsize].view(W_dtype).reshape(
+            (NC, NQ)
+        )
+        offset += _padded(W_NCxNQ.nbytes)
+        H_mask_NCxNQ = data[offset:offset + NC * NQ].view(dtype('?')).reshape((NC, NQ))
+
+        # The modification time is used to evict the least recently used files
+        try:
+            utime(file_path)
+        except FileNotFoundError:
+            pass
+
+        return arrays, W_NCxNQ, H_mask_NCxNQ
+
+    def _write(self, uuid, suffix, write):
+        # Write to a thread-specific temporary file and rename it,
+        # so other processes never see partially-written files
+        file_path = self._path(uuid, suffix)
+        tmp_path = '{}.{}.{}.tmp'.format(file_path, getpid(), get_ident())
+        with open(tmp_path, 'wb') as file:
+            write(file)
+        replace(tmp_path, file_path)
+
+    def add(self, uuid, arrays, shape):
+        """
+        Writes the given matrix arrays and the dense W and H_mask of the given shape (NC, NQ)
+        to the store, unless they are already there,
+        then evicts the least recently used matrices if the store is over its size limit
+        """
+        if uuid in self:
+            return
+
+        is_single_precision = arrays['d_data'].dtype == float32
+        data = encode_matrix_arrays(arrays, is_single_precision=is_single_precision)
+        W_NCxNQ = ascontiguousarray(coo_matrix(
+            (arrays['W_data'], (arrays['W_row'], arrays['W_col'])), shape=shape
+        ).toarray(), dtype='<f4' if is_single_precision else '<f8')
+        H_mask_NCxNQ = ascontiguousarray(coo_matrix(
+            (arrays['H_mask_data'], (arrays['H_mask_row'], arrays['H_mask_col'])), shape=shape
+        ).toarray(), dtype='?')
+
+        def write(file):
+            file.write(HEADER.pack(MAGIC, VERSION, len(data), *shape))
+            for chunk in (data, W_NCxNQ.tobytes(), H_mask_NCxNQ.tobytes()):
+                file.write(chunk)
+                file.write(b'\0' * (-len(chunk) % ALIGNMENT))
+
+        self._write(uuid, ARRAYS_SUFFIX, write)
+        self.evict()
+
+    def discard(self, uuid):
+        """Removes the given matrix from the store, if it is there"""
+        # Processes that already mapped the file keep using it until they unmap it
+        try:
+            remove(self._path(uuid, ARRAYS_SUFFIX))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Deletes the least recently used matrices until the store uses at most max_bytes"""
+        if not self.max_bytes:
+            return
+
+        entries = []
+        with scandir(self.directory) as directory_entries:
+            for entry in directory_entries:
+                if entry.name.endswith(ARRAYS_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Evicted by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        num_bytes = sum(size for mtime, size, file_path in entries)
+        for mtime, size, file_path in sorted(entries):
+            if num_bytes <= self.max_bytes:
+                break
+
+            try:
+                remove(file_path)
+            except FileNotFoundError:
+                pass
+            num_bytes -= size
+
+
+ECOSYSTEM_MATRIX_STORE = EcosystemMatrixStore(
+    ECOSYSTEM_MATRIX_STORE_DIR, max_bytes=ECOSYSTEM_MATRIX_STORE_MB * 2**20
+) if ECOSYSTEM_MATRIX_STORE_DIR else None
@@ -1,19 +1,41 @@
 from collections import defaultdict
-from datetime import datetime
-from uuid import UUID
-from textwrap import dedent
+from datetime import datetime, timedelta
+from uuid import uuid4
 from random import shuffle
-
-from sqlalchemy import literal_column, text
+from time import perf_counter
+from resource import getrusage, RUSAGE_SELF
+from os import cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+
+from sqlalchemy.orm import load_only, selectinload
 from sqlalchemy.sql.expression import func
 
+from ..config import (ECOSYSTEM_CALCULATION_THREADS, ECOSYSTEM_MATRIX_PROCESSES,
+                      ECOSYSTEM_MATRIX_STORAGE, ECOSYSTEM_MATRIX_WARM_START_EPOCHS,
+                      PIPELINE_CALCULATIONS)
+from ..algs import ResponseColumns
 from ..biglearn import BLSCHED
-from ..orm import transaction, Ecosystem, Page, Response, EcosystemMatrix
+from ..orm import (transaction, Ecosystem, Page, Response, EcosystemMatrixPayload,
+                   EcosystemMatrix, EcosystemMatrixStats, CalculationLease)
+from ..orm.store import ECOSYSTEM_MATRIX_STORE
 from .celery import task
+from .exercise_orderings import (exercise_ordering_key, fetch_exercise_orderings,
+                                 store_exercise_orderings)
+from .student_responses import fetch_student_responses
 
 __all__ = ('calculate_ecosystem_matrices', 'calculate_exercises', 'calculate_clues')
 
 ECOSYSTEM_BATCH_SIZE = 1
+# ECOSYSTEM_MATRIX_PROCESSES = 0 means 1 process per CPU
+NUM_ECOSYSTEM_MATRIX_PROCESSES = ECOSYSTEM_MATRIX_PROCESSES or cpu_count()
+# Number of responses fetched from the database at a time when calculating ecosystem matrices
+RESPONSE_BATCH_SIZE = 10000
+# Calculations claimed by workers that die are calculated again once their leases expire
+CALCULATION_LEASE_DURATION = timedelta(minutes=5)
+# Ecosystem matrix calculations run SGD outside of any transaction, so their leases are longer
+ECOSYSTEM_MATRIX_LEASE_DURATION = timedelta(hours=1)
 
 
 @task
@@ -28,62 +50,154 @@ def calculate_ecosystem_matrices():
 
         calc_ecosystem_uuids = calculation_by_ecosystem_uuid.keys()
 
+        # The calculation happens in 3 phases to avoid keeping a transaction open during SGD:
+        # 1. Claim the calculations with leases and load their inputs (short transaction)
+        # 2. Calculate the new ecosystem matrices (no transaction)
+        # 3. Save the new ecosystem matrices, unless another worker saved a matrix
+        #    for the same ecosystem in the meantime (short transaction)
+        calculation_uuid_by_ecosystem_uuid = {}
+        previous_calculation_uuid_by_ecosystem_uuid = {}
+        ecosystem_matrix_inputs = []
         with transaction() as session:
             # Skip unknown ecosystems and ecosystems we can't lock immediately
+            # Claim enough ecosystems to keep all ecosystem matrix processes busy,
+            # starting with the ecosystems that received the most responses since their last update
             known_ecosystems = session.query(Ecosystem).filter(
                 Ecosystem.uuid.in_(calc_ecosystem_uuids), Ecosystem.sequence_number > 0
-            ).with_for_update(key_share=True, skip_locked=True).limit(ECOSYSTEM_BATCH_SIZE).all()
+            ).order_by(Ecosystem.num_pending_responses.desc()).with_for_update(
+                key_share=True, skip_locked=True
+            ).limit(
+                max(ECOSYSTEM_BATCH_SIZE, NUM_ECOSYSTEM_MATRIX_PROCESSES)
+            ).all()
 
             if not known_ecosystems:
                 break
 
-            ecosystems = []
-            ecosystem_matrix_requests = []
+            # The pending responses counted so far will be included in this calculation
+            num_pending_responses_by_ecosystem_uuid = {
+                eco.uuid: eco.num_pending_responses for eco in known_ecosystems
+            }
+
             for eco in known_ecosystems:
                 calc = calculation_by_ecosystem_uuid[eco.uuid]
                 # Skip ecosystems we already calculated
                 if eco.last_ecosystem_matrix_update_calculation_uuid != calc['calculation_uuid']:
-                    eco.last_ecosystem_matrix_update_calculation_uuid = calc['calculation_uuid']
-                    ecosystems.append(eco)
-                # Tell biglearn-scheduler we calculated all ecosystems,
-                # even ones we skipped because we had already calculated them
-                ecosystem_matrix_requests.append({'calculation_uuid': calc['calculation_uuid']})
+                    calculation_uuid_by_ecosystem_uuid[eco.uuid] = calc['calculation_uuid']
+                    previous_calculation_uuid_by_ecosystem_uuid[eco.uuid] = \
+                        eco.last_ecosystem_matrix_update_calculation_uuid
+
+            # The row locks are released when this transaction commits, but the leases are not,
+            # so other workers skip the calculations that we are still calculating
+            claimed_calculation_uuids = CalculationLease.claim(
+                session,
+                calculation_uuid_by_ecosystem_uuid.values(),
+                ECOSYSTEM_MATRIX_LEASE_DURATION
+            )
+            calculation_uuid_by_ecosystem_uuid = {
+                ecosystem_uuid: calculation_uuid
+                for ecosystem_uuid, calculation_uuid in calculation_uuid_by_ecosystem_uuid.items()
+                if str(calculation_uuid) in claimed_calculation_uuids
+            }
+
+            # Tell biglearn-scheduler we calculated all ecosystems,
+            # even ones we skipped because we had already calculated them,
+            # but not the ones being calculated by other workers
+            ecosystem_matrix_requests = [
+                {'calculation_uuid': calculation_by_ecosystem_uuid[eco.uuid]['calculation_uuid']}
+                for eco in known_ecosystems
+                if eco.uuid in calculation_uuid_by_ecosystem_uuid or
+                eco.uuid not in previous_calculation_uuid_by_ecosystem_uuid
+            ]
+
+            if not ecosystem_matrix_requests:
+                break
 
-            if ecosystems:
-                ecosystem_uuids = [ecosystem.uuid for ecosystem in ecosystems]
+            if calculation_uuid_by_ecosystem_uuid:
+                ecosystem_uuids = list(calculation_uuid_by_ecosystem_uuid.keys())
 
                 pages = session.query(Page).filter(Page.ecosystem_uuid.in_(ecosystem_uuids)).all()
                 pages_by_ecosystem_uuid = defaultdict(list)
                 for page in pages:
                     pages_by_ecosystem_uuid[page.ecosystem_uuid].append(page)
 
-                responses = session.query(Response).filter(
-                    Response.ecosystem_uuid.in_(ecosystem_uuids),
-                    Response.is_real_response.is_(True)
-                ).all()
-                responses_by_ecosystem_uuid = defaultdict(list)
-                for response in responses:
-                    responses_by_ecosystem_uuid[response.ecosystem_uuid].append(response)
-
-                session.upsert_models(Ecosystem, ecosystems)
-
-                session.query(EcosystemMatrix).filter(
+                # The current ecosystem matrices are used to skip unchanged ecosystems
+                # and to warm-start the calculations
+                # Their payloads are only needed when warm-starting
+                current_ecosystem_matrix_query = session.query(EcosystemMatrix).filter(
                     EcosystemMatrix.ecosystem_uuid.in_(ecosystem_uuids),
                     EcosystemMatrix.superseded_at.is_(None)
-                ).update({EcosystemMatrix.superseded_at: datetime.now()}, synchronize_session=False)
-
-                session.upsert_models(
-                    EcosystemMatrix,
-                    [EcosystemMatrix.from_ecosystem_uuid_pages_responses(
-                        ecosystem_uuid=ecosystem_uuid,
-                        pages=pages_by_ecosystem_uuid[ecosystem_uuid],
-                        responses=responses_by_ecosystem_uuid[ecosystem_uuid]
-                    ) for ecosystem_uuid in ecosystem_uuids]
                 )
+                if ECOSYSTEM_MATRIX_WARM_START_EPOCHS > 0:
+                    current_ecosystem_matrix_query = current_ecosystem_matrix_query.options(
+                        selectinload(EcosystemMatrix.payload).selectinload(
+                            EcosystemMatrixPayload.parent
+                        )
+                    )
+                else:
+                    current_ecosystem_matrix_query = current_ecosystem_matrix_query.options(
+                        load_only(
+                            EcosystemMatrix.uuid,
+                            EcosystemMatrix.ecosystem_uuid,
+                            EcosystemMatrix.num_responses,
+                            EcosystemMatrix.responses_watermark,
+                            EcosystemMatrix.pages_hash
+                        )
+                    )
+                current_ecosystem_matrix_by_ecosystem_uuid = {
+                    ecosystem_matrix.ecosystem_uuid: ecosystem_matrix
+                    for ecosystem_matrix in current_ecosystem_matrix_query.all()
+                }
+
+                unchanged_ecosystems = []
+                for ecosystem in known_ecosystems:
+                    if ecosystem.uuid not in calculation_uuid_by_ecosystem_uuid:
+                        continue
+
+                    load_start = perf_counter()
+                    inputs = _load_ecosystem_matrix_inputs(
+                        session=session,
+                        ecosystem_uuid=ecosystem.uuid,
+                        pages=pages_by_ecosystem_uuid[ecosystem.uuid],
+                        current_ecosystem_matrix=current_ecosystem_matrix_by_ecosystem_uuid.get(
+                            ecosystem.uuid
+                        )
+                    )
+                    if inputs is None:
+                        # Nothing changed since the current ecosystem matrix was calculated,
+                        # so mark the calculation as done and keep using the current matrix
+                        ecosystem.last_ecosystem_matrix_update_calculation_uuid = \
+                            calculation_uuid_by_ecosystem_uuid.pop(ecosystem.uuid)
+                        unchanged_ecosystems.append(ecosystem)
+                    else:
+                        inputs['load_seconds'] = perf_counter() - load_start
+                        ecosystem_matrix_inputs.append(inputs)
+
+                if unchanged_ecosystems:
+                    CalculationLease.release(session, [
+                        ecosystem.last_ecosystem_matrix_update_calculation_uuid
+                        for ecosystem in unchanged_ecosystems
+                    ])
+                    session.upsert_models(Ecosystem, unchanged_ecosystems)
+                    _consume_pending_responses(session, {
+                        ecosystem.uuid: num_pending_responses_by_ecosystem_uuid[ecosystem.uuid]
+                        for ecosystem in unchanged_ecosystems
+                    })
+
+        try:
+            _calculate_and_save_ecosystem_matrices(
+                ecosystem_matrix_inputs,
+                calculation_uuid_by_ecosystem_uuid,
+                previous_calculation_uuid_by_ecosystem_uuid,
+                num_pending_responses_by_ecosystem_uuid
+            )
+        finally:
+            if calculation_uuid_by_ecosystem_uuid:
+                with transaction() as session:
+                    CalculationLease.release(session, calculation_uuid_by_ecosystem_uuid.values())
 
         # There is a potential race condition where another worker might process the same
-        # ecosystem matrix update since we end the transaction and release the locks
-        # before sending the update back to biglearn-scheduler
+        # ecosystem matrix update after we release the leases
+        # but before we send the update back to biglearn-scheduler
         # This is why we store the last calculation_uuid in the ecosystem
         # and skip the actual work if it matches
         BLSCHED.ecosystem_matrices_updated(ecosystem_matrix_requests)
@@ -91,207 +205,728 @@ def calculate_ecosystem_matrices():
         calculations = BLSCHED.fetch_ecosystem_matrix_updates()
 
 
-@task
-def calculate_exercises():
-    """Calculate all personalized exercises"""
-    calculations = BLSCHED.fetch_exercise_calculations()
-    while calculations:
-        calculation_by_uuid = {}
-        for calculation in calculations:
-            calculation_by_uuid[calculation['calculation_uuid']] = calculation
-
-        with transaction() as session:
-            # Attempt to advisory lock calculations received
-            # https://stackoverflow.com/a/3530326
-            query = [func.pg_try_advisory_xact_lock(
-                (UUID(uuid).int >> 64) - 2**63
-            ).label(uuid) for uuid in calculation_by_uuid]
-            result = session.execute(session.query(*query).statement).first()
-            locked_calculations = [
-              calculation_by_uuid[uuid] for uuid, locked in result.items() if locked
-            ]
-
-            # Process only calculations that we successfully locked
-            if not locked_calculations:
-                break
-
-            calculations_by_ecosystem_uuid = defaultdict(list)
-            for calculation in locked_calculations:
-                calculations_by_ecosystem_uuid[calculation['ecosystem_uuid']].append(calculation)
-
-            ecosystem_matrices = session.query(EcosystemMatrix).filter(
-                EcosystemMatrix.ecosystem_uuid.in_(calculations_by_ecosystem_uuid.keys()),
+def _calculate_and_save_ecosystem_matrices(ecosystem_matrix_inputs,
+                                           calculation_uuid_by_ecosystem_uuid,
+                                           previous_calculation_uuid_by_ecosystem_uuid,
+                                           num_pending_responses_by_ecosystem_uuid):
+    """
+    Phases 2 and 3 of calculate_ecosystem_matrices: calculates the ecosystem matrices
+    for the given inputs and saves the ones for ecosystems whose last calculation_uuid
+    is still the one read when the inputs were loaded
+    """
+    if not ecosystem_matrix_inputs:
+        return
+
+    ecosystem_matrix_results = _calculate_ecosystem_matrices(ecosystem_matrix_inputs)
+
+    save_start = perf_counter()
+    saved_ecosystem_uuids = []
+    with transaction() as session:
+        # Lock the ecosystems again, this time exclusively and waiting for the locks,
+        # so only one worker at a time can check and update each ecosystem,
+        # and skip the ecosystems that another worker calculated in the meantime,
+        # even for a different calculation, so we never supersede a newer matrix
+        # The locks are taken in a consistent order so workers cannot deadlock
+        ecosystems = []
+        for ecosystem in session.query(Ecosystem).filter(
+            Ecosystem.uuid.in_(calculation_uuid_by_ecosystem_uuid.keys())
+        ).order_by(Ecosystem.uuid).with_for_update().all():
+            if ecosystem.last_ecosystem_matrix_update_calculation_uuid == \
+                    previous_calculation_uuid_by_ecosystem_uuid[ecosystem.uuid]:
+                ecosystem.last_ecosystem_matrix_update_calculation_uuid = \
+                    calculation_uuid_by_ecosystem_uuid[ecosystem.uuid]
+                ecosystems.append(ecosystem)
+
+        if ecosystems:
+            ecosystem_uuids = [ecosystem.uuid for ecosystem in ecosystems]
+            saved_ecosystem_uuids = ecosystem_uuids
+
+            session.upsert_models(Ecosystem, ecosystems)
+            _consume_pending_responses(session, {
+                ecosystem_uuid: num_pending_responses_by_ecosystem_uuid[ecosystem_uuid]
+                for ecosystem_uuid in ecosystem_uuids
+            })
+
+            # The new matrices are delta-encoded relative to the ones they supersede
+            previous_ecosystem_matrices = session.query(EcosystemMatrix).filter(
+                EcosystemMatrix.ecosystem_uuid.in_(ecosystem_uuids),
                 EcosystemMatrix.superseded_at.is_(None)
-            ).all()
+            ).options(
+                selectinload(EcosystemMatrix.payload).selectinload(
+                    EcosystemMatrixPayload.parent
+                )
+            ).all() if ECOSYSTEM_MATRIX_STORAGE == 'delta' else []
 
-            if not ecosystem_matrices:
+            session.query(EcosystemMatrix).filter(
+                EcosystemMatrix.ecosystem_uuid.in_(ecosystem_uuids),
+                EcosystemMatrix.superseded_at.is_(None)
+            ).update(
+                {EcosystemMatrix.superseded_at: datetime.now()}, synchronize_session=False
+            )
+
+            EcosystemMatrix.upsert_values(session, [
+                values for values, stats in ecosystem_matrix_results
+                if values['ecosystem_uuid'] in ecosystem_uuids
+            ], previous_ecosystem_matrices=previous_ecosystem_matrices)
+    save_seconds = perf_counter() - save_start
+
+    if saved_ecosystem_uuids:
+        # The matrices are saved in a single transaction, so each gets an equal share of its time
+        save_seconds /= len(saved_ecosystem_uuids)
+        with transaction() as session:
+            session.upsert_values(EcosystemMatrixStats, [
+                dict(stats, save_seconds=save_seconds)
+                for values, stats in ecosystem_matrix_results
+                if stats['ecosystem_uuid'] in saved_ecosystem_uuids
+            ])
+
+        if ECOSYSTEM_MATRIX_STORE is not None:
+            # Other workers on this machine can now map the new matrices right away
+            for values, stats in ecosystem_matrix_results:
+                if values['ecosystem_uuid'] in saved_ecosystem_uuids:
+                    ECOSYSTEM_MATRIX_STORE.add(values['uuid'], EcosystemMatrix(**values).arrays,
+                                               (len(values['C_ids']), len(values['Q_ids'])))
+
+
+def _consume_pending_responses(session, num_pending_responses_by_ecosystem_uuid):
+    """
+    Subtracts the given numbers of pending responses from the given ecosystems
+    Responses received while the ecosystem matrices were being calculated remain pending
+    """
+    for ecosystem_uuid, num_pending_responses in sorted(
+        num_pending_responses_by_ecosystem_uuid.items()
+    ):
+        if num_pending_responses:
+            session.query(Ecosystem).filter(Ecosystem.uuid == ecosystem_uuid).update(
+                {Ecosystem.num_pending_responses: func.greatest(
+                    Ecosystem.num_pending_responses - num_pending_responses, 0
+                )},
+                synchronize_session=False
+            )
+
+
+def _load_ecosystem_matrix_inputs(session, ecosystem_uuid, pages, current_ecosystem_matrix=None):
+    """
+    Loads everything needed to calculate a new ecosystem matrix
+    The result contains no ORM objects, so it can be sent to another process
+    Returns None if the responses and pages have not changed
+    since the current ecosystem matrix was calculated
+    """
+    previous_ecosystem_matrix = current_ecosystem_matrix \
+        if ECOSYSTEM_MATRIX_WARM_START_EPOCHS > 0 else None
+    pages_hash = EcosystemMatrix.pages_hash_from_pages(pages)
+    inputs = {
+        'ecosystem_uuid': ecosystem_uuid,
+        'pages': [page.dict for page in pages],
+        'previous_ecosystem_matrix': None if previous_ecosystem_matrix is None
+        else previous_ecosystem_matrix.dict,
+        'warm_start_epochs': ECOSYSTEM_MATRIX_WARM_START_EPOCHS
+    }
+
+    query = session.query(Response).filter(
+        Response.ecosystem_uuid == ecosystem_uuid, Response.is_real_response.is_(True)
+    )
+
+    # Every transaction older than the oldest one still running has been committed or rolled back,
+    # so all the responses they saved are read below and later transactions are read next time
+    # This is taken before the responses are read, so any response committed in between
+    # will be read again next time, which is harmless, since only the latest response
+    # for each student and exercise is used
+    responses_watermark = session.query(
+        func.txid_snapshot_xmin(func.txid_current_snapshot())
+    ).scalar()
+    num_responses, last_response_transaction_id = query.with_entities(
+        func.count(), func.max(Response.transaction_id)
+    ).one()
+
+    if current_ecosystem_matrix is not None and current_ecosystem_matrix.has_same_inputs(
+        num_responses=num_responses,
+        last_response_transaction_id=last_response_transaction_id,
+        pages_hash=pages_hash
+    ):
+        return None
+
+    inputs.update({
+        'num_responses': num_responses,
+        'responses_watermark': responses_watermark
+    })
+
+    checkpoint = None if previous_ecosystem_matrix is None else \
+        previous_ecosystem_matrix.responses_watermark
+    if checkpoint is not None:
+        C_ids, hints = EcosystemMatrix.C_ids_hints_from_pages(pages)
+        if previous_ecosystem_matrix.can_warm_start(
+            C_ids=C_ids, hints=hints, num_responses=num_responses
+        ):
+            # Refine the previous ecosystem matrix using only the responses saved by transactions
+            # that might not have been committed yet when its responses were read
+            inputs.update({
+                'is_delta': True,
+                'responses': _stream_response_columns(query.filter(
+                    Response.transaction_id >= checkpoint
+                ))
+            })
+            return inputs
+
+    inputs.update({
+        'is_delta': False,
+        'responses': _stream_response_columns(query)
+    })
+    return inputs
+
+
+def _stream_response_columns(query):
+    """
+    Streams the given responses from the database into ResponseColumns
+    Only the columns used by the algorithms are loaded, without creating ORM objects,
+    using a server-side cursor that holds only RESPONSE_BATCH_SIZE rows at a time
+    Each batch is compacted as it arrives, keeping only the latest response
+    of each student/exercise pair, which is all the algorithms use
+    """
+    return ResponseColumns.from_values(query.with_entities(
+        Response.student_uuid, Response.exercise_uuid, Response.is_correct, Response.responded_at
+    ).yield_per(RESPONSE_BATCH_SIZE), batch_size=RESPONSE_BATCH_SIZE)
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak RSS of this process to its current RSS, so it can be measured per calculation
+    This requires Linux, so elsewhere the peak RSS of the process so far is measured instead
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_kb():
+    """Returns the peak RSS of this process since it started or since _reset_peak_rss, in kB"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return getrusage(RUSAGE_SELF).ru_maxrss
+
+
+def _calculate_ecosystem_matrix(inputs):
+    """
+    Calculates a new ecosystem matrix from the result of _load_ecosystem_matrix_inputs
+    Returns the new ecosystem matrix's values and the values for its EcosystemMatrixStats,
+    except for save_seconds, so this function can run in another process
+    """
+    # Each process calculates 1 ecosystem matrix at a time, so the reset does not affect others
+    _reset_peak_rss()
+    calculation_start = perf_counter()
+    previous_ecosystem_matrix = None if inputs['previous_ecosystem_matrix'] is None \
+        else EcosystemMatrix(**inputs['previous_ecosystem_matrix'])
+
+    if inputs['is_delta']:
+        ecosystem_matrix = previous_ecosystem_matrix.refined_with_responses(
+            responses=inputs['responses'],
+            num_epochs=inputs['warm_start_epochs'],
+            num_responses=inputs['num_responses']
+        )
+    else:
+        ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+            ecosystem_uuid=inputs['ecosystem_uuid'],
+            pages=inputs['pages'],
+            responses=inputs['responses'],
+            previous_ecosystem_matrix=previous_ecosystem_matrix,
+            warm_start_epochs=inputs['warm_start_epochs'],
+            num_responses=inputs['num_responses']
+        )
+
+    ecosystem_matrix.responses_watermark = inputs['responses_watermark']
+
+    return ecosystem_matrix.dict, {
+        'uuid': str(uuid4()),
+        'ecosystem_uuid': ecosystem_matrix.ecosystem_uuid,
+        'ecosystem_matrix_uuid': ecosystem_matrix.uuid,
+        'is_delta': inputs['is_delta'],
+        'num_responses': inputs['num_responses'],
+        'num_loaded_responses': len(inputs['responses']),
+        'num_students': len(inputs['responses'].L_ids),
+        'num_exercises': ecosystem_matrix.NQ,
+        'num_concepts': ecosystem_matrix.NC,
+        'load_seconds': inputs['load_seconds'],
+        'calculation_seconds': perf_counter() - calculation_start,
+        # Peak memory usage of this process during this calculation,
+        # which is what limits worker capacity
+        'peak_rss_kb': _peak_rss_kb()
+    }
+
+
+def _calculate_ecosystem_matrices(ecosystem_matrix_inputs):
+    """
+    Calculates the ecosystem matrices for the given inputs,
+    using a pool of NUM_ECOSYSTEM_MATRIX_PROCESSES processes if there is more than 1 of them
+    Returns the results of _calculate_ecosystem_matrix in the same order as the inputs
+    """
+    num_processes = min(NUM_ECOSYSTEM_MATRIX_PROCESSES, len(ecosystem_matrix_inputs))
+    if num_processes <= 1:
+        return [_calculate_ecosystem_matrix(inputs) for inputs in ecosystem_matrix_inputs]
+
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        return list(executor.map(_calculate_ecosystem_matrix, ecosystem_matrix_inputs))
+
+
+def _update_calculations_and_commit(stack, update_calculations, requests):
+    # Exiting the stack commits the transaction, which releases the calculations' locks
+    with stack:
+        update_calculations(requests)
+
+
+def _process_calculations(fetch_calculations, calculate, update_calculations):
+    """
+    Fetches calculations from biglearn-scheduler, calculates them and sends back the updates
+    until there are no calculations left or calculate returns None
+    The transaction is kept open until the updates have been sent to biglearn-scheduler,
+    so the calculations stay locked until their update is acknowledged
+    """
+    if PIPELINE_CALCULATIONS:
+        return _process_calculations_pipelined(
+            fetch_calculations, calculate, update_calculations
+        )
+
+    calculations = fetch_calculations()
+    while calculations:
+        with transaction() as session:
+            requests = calculate(session, calculations)
+            if requests is None:
                 break
 
-            known_exercise_uuids_by_calculation_uuid = defaultdict(set)
-            unknown_exercise_uuids_by_calculation_uuid = defaultdict(set)
-            calculation_values = []
-            # Skip calculations that don't have an ecosystem matrix
-            for ecosystem_matrix in ecosystem_matrices:
-                ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
-                Q_ids_set = set(ecosystem_matrix.Q_ids)
-
-                ecosystem_calculations = calculations_by_ecosystem_uuid[ecosystem_uuid]
-                for calculation in ecosystem_calculations:
-                    calc_uuid = calculation['calculation_uuid']
-
-                    # Partition exercise_uuids into known and unknown
-                    for exercise_uuid in calculation['exercise_uuids']:
-                        if exercise_uuid in Q_ids_set:
-                            known_exercise_uuids_by_calculation_uuid[calc_uuid].add(exercise_uuid)
-                        else:
-                            unknown_exercise_uuids_by_calculation_uuid[calc_uuid].add(exercise_uuid)
-
-                    calculation_values.append(
-                        "(UUID('{0}'), UUID('{1}'), UUID('{2}'))".format(
-                            calc_uuid,
-                            ecosystem_uuid,
-                            calculation['student_uuid']
-                        )
+            # There are no updates to the DB in this transaction,
+            # so we can perform this request with the transaction still open
+            # This way we keep rows locked until the update has been sent to biglearn-scheduler
+            update_calculations(requests)
+
+        calculations = fetch_calculations()
+
+
+def _process_calculations_pipelined(fetch_calculations, calculate, update_calculations):
+    """
+    Same as _process_calculations, but each batch's updates are sent in a background thread
+    while the next batch is fetched and calculated
+    Each batch's transaction is only committed after its updates are acknowledged
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        update = None
+        updating_calculation_uuids = set()
+        try:
+            calculations = fetch_calculations()
+            while calculations:
+                # biglearn-scheduler keeps returning calculations until their updates are received
+                # Skip the ones being updated, or wait for the update if there is nothing else
+                calculations = [
+                    calculation for calculation in calculations
+                    if calculation['calculation_uuid'] not in updating_calculation_uuids
+                ]
+                if not calculations:
+                    update.result()
+                    update = None
+                    updating_calculation_uuids = set()
+                    calculations = fetch_calculations()
+                    continue
+
+                with ExitStack() as stack:
+                    session = stack.enter_context(transaction())
+                    requests = calculate(session, calculations)
+                    if requests is None:
+                        break
+
+                    # Only 1 batch is updated at a time
+                    if update is not None:
+                        update.result()
+                    update = executor.submit(
+                        _update_calculations_and_commit,
+                        stack.pop_all(),
+                        update_calculations,
+                        requests
                     )
 
-            response_dicts_by_calculation_uuid = defaultdict(list)
-            # Beware that uuid columns return UUID objects (not strings) when using from_statement()
-            for result in session.query(
-                literal_column('calculation_uuid'), Response
-            ).from_statement(text(dedent("""
-                SELECT "values"."calculation_uuid", "responses".*
-                FROM "responses" INNER JOIN (VALUES {}) AS "values"
-                    ("calculation_uuid", "ecosystem_uuid", "student_uuid")
-                    ON "responses"."student_uuid" = "values"."student_uuid"
-                        AND "responses"."ecosystem_uuid" = "values"."ecosystem_uuid"
-            """.format(', '.join(calculation_values))).strip())).all():
-                calc_uuid = str(result.calculation_uuid)
-                response = result.Response
-                if str(
-                    response.exercise_uuid
-                ) in known_exercise_uuids_by_calculation_uuid[calc_uuid]:
-                    response_dicts_by_calculation_uuid[calc_uuid].append(response.dict_for_algs)
-
-            exercise_calculation_requests = []
-            for ecosystem_matrix in ecosystem_matrices:
-                ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
-                ecosystem_calculations = calculations_by_ecosystem_uuid[ecosystem_uuid]
-
-                algs = ecosystem_matrix.to_sparfa_algs_with_student_uuids_responses(
-                    student_uuids=[calc['student_uuid'] for calc in ecosystem_calculations],
-                    responses=[
-                        resp
-                        for calc in ecosystem_calculations
-                        for resp in response_dicts_by_calculation_uuid[calc['calculation_uuid']]
-                    ]
+                updating_calculation_uuids = set(
+                    calculation['calculation_uuid'] for calculation in calculations
                 )
+                calculations = fetch_calculations()
+        finally:
+            if update is not None:
+                update.result()
+
+
+def _update_exercise_calculations(exercise_calculation_requests):
+    calculation_uuids = [
+        request['calculation_uuid'] for request in exercise_calculation_requests
+    ]
+
+    # The leases were claimed before the calculation and may have been waiting on a previous
+    # update, so they are extended to make sure they do not expire during this update
+    with transaction() as session:
+        CalculationLease.extend(session, calculation_uuids, CALCULATION_LEASE_DURATION)
+
+    BLSCHED.update_exercise_calculations(exercise_calculation_requests)
+
+    # The calculations are released only after biglearn-scheduler acknowledges the update
+    with transaction() as session:
+        CalculationLease.release(session, calculation_uuids)
+
+
+def _calculate_exercise_batch(session, calculations):
+    """
+    Claims and calculates the given personalized exercise calculations
+    Returns the exercise calculation updates, or None if nothing else can be calculated
+    Calculations that are not updated are released immediately and the others are released
+    by _update_exercise_calculations
+    """
+    calculation_by_uuid = {}
+    for calculation in calculations:
+        calculation_by_uuid[calculation['calculation_uuid']] = calculation
+
+    # The claims are committed immediately so other workers can skip these calculations
+    with transaction() as lease_session:
+        claimed_uuids = CalculationLease.claim(
+            lease_session, calculation_by_uuid.keys(), CALCULATION_LEASE_DURATION
+        )
+
+    # Process only calculations that we successfully claimed
+    if not claimed_uuids:
+        return None
+
+    exercise_calculation_requests = None
+    try:
+        exercise_calculation_requests = _calculate_claimed_exercises(session, [
+            calculation for uuid, calculation in calculation_by_uuid.items()
+            if uuid in claimed_uuids
+        ])
+        return exercise_calculation_requests
+    finally:
+        unused_uuids = claimed_uuids - set(
+            request['calculation_uuid'] for request in exercise_calculation_requests or []
+        )
+        if unused_uuids:
+            with transaction() as lease_session:
+                CalculationLease.release(lease_session, unused_uuids)
+
+
+def _map_ecosystem_calculations(function, ecosystem_matrices_calculations):
+    """
+    Returns function(decoded_ecosystem_matrix, calculations)
+    for each of the given (ecosystem_matrix, calculations) tuples, in order
+    The ecosystems are processed in ECOSYSTEM_CALCULATION_THREADS threads if more than 1,
+    since the NumPy and SciPy calculations release the GIL for most of their work
+    """
+    # Decoding a matrix that is not cached can load its payload through the session,
+    # which is not thread-safe, so the matrices are decoded in this thread
+    # and the function only gets the DecodedEcosystemMatrix objects
+    decoded_ecosystem_matrices_calculations = [
+        (ecosystem_matrix.decoded, calculations)
+        for ecosystem_matrix, calculations in ecosystem_matrices_calculations
+    ]
+
+    num_threads = min(ECOSYSTEM_CALCULATION_THREADS, len(decoded_ecosystem_matrices_calculations))
+    if num_threads <= 1:
+        return [function(decoded_ecosystem_matrix, calculations)
+                for decoded_ecosystem_matrix, calculations in
+                decoded_ecosystem_matrices_calculations]
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(function, *zip(*decoded_ecosystem_matrices_calculations)))
+
+
+def _order_ecosystem_exercises(decoded_ecosystem_matrix, calculations,
+                               known_exercise_uuids_by_calculation_uuid,
+                               response_dicts_by_calculation_uuid):
+    """
+    Orders the known exercise uuids of the given calculations, which all use the given matrix
+    Returns a dict mapping each calculation uuid to its ordered exercise uuids
+    """
+    # Each student's knowledge is estimated only from the responses of the calculation,
+    # so calculations for the same student are split into separate algs
+    calculations_by_round = []
+    num_rounds_by_student_uuid = defaultdict(int)
+    for calculation in calculations:
+        student_uuid = str(calculation['student_uuid'])
+        if num_rounds_by_student_uuid[student_uuid] == len(calculations_by_round):
+            calculations_by_round.append([])
+        calculations_by_round[num_rounds_by_student_uuid[student_uuid]].append(calculation)
+        num_rounds_by_student_uuid[student_uuid] += 1
+
+    ordered_exercise_uuids_by_calculation_uuid = {}
+    for round_calculations in calculations_by_round:
+        algs = EcosystemMatrix.decoded_to_sparfa_algs_with_student_uuids_responses(
+            decoded_ecosystem_matrix,
+            student_uuids=[calc['student_uuid'] for calc in round_calculations],
+            responses=[
+                resp
+                for calc in round_calculations
+                for resp in response_dicts_by_calculation_uuid[calc['calculation_uuid']]
+            ]
+        )
+
+        for calculation in round_calculations:
+            calc_uuid = calculation['calculation_uuid']
+            ordered_Q_infos = algs.tesr(
+                target_L_id=calculation['student_uuid'],
+                target_Q_ids=known_exercise_uuids_by_calculation_uuid[calc_uuid],
+                target_responses=response_dicts_by_calculation_uuid[calc_uuid]
+            )
+            ordered_exercise_uuids_by_calculation_uuid[calc_uuid] = [
+                info.Q_id for info in ordered_Q_infos
+            ]
+    return ordered_exercise_uuids_by_calculation_uuid
+
+
+def _calculate_claimed_exercises(session, claimed_calculations):
+    """Calculates the given personalized exercise calculations, which must already be claimed"""
+    calculations_by_ecosystem_uuid = defaultdict(list)
+    for calculation in claimed_calculations:
+        calculations_by_ecosystem_uuid[calculation['ecosystem_uuid']].append(calculation)
+
+    ecosystem_matrices = EcosystemMatrix.query_cached(
+        session,
+        EcosystemMatrix.ecosystem_uuid.in_(calculations_by_ecosystem_uuid.keys()),
+        EcosystemMatrix.superseded_at.is_(None)
+    )
+
+    if not ecosystem_matrices:
+        return None
+
+    known_exercise_uuids_by_calculation_uuid = defaultdict(set)
+    unknown_exercise_uuids_by_calculation_uuid = defaultdict(set)
+    known_exercise_uuids_by_ecosystem_student_uuids = defaultdict(set)
+    # Skip calculations that don't have an ecosystem matrix
+    for ecosystem_matrix in ecosystem_matrices:
+        ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
+        Q_idx_by_id = ecosystem_matrix.decoded.Q_idx_by_id
+
+        ecosystem_calculations = calculations_by_ecosystem_uuid[ecosystem_uuid]
+        for calculation in ecosystem_calculations:
+            calc_uuid = calculation['calculation_uuid']
+
+            # Partition exercise_uuids into known and unknown
+            for exercise_uuid in calculation['exercise_uuids']:
+                if exercise_uuid in Q_idx_by_id:
+                    known_exercise_uuids_by_calculation_uuid[calc_uuid].add(exercise_uuid)
+                else:
+                    unknown_exercise_uuids_by_calculation_uuid[calc_uuid].add(exercise_uuid)
+
+            known_exercise_uuids_by_ecosystem_student_uuids[
+                (str(ecosystem_uuid), str(calculation['student_uuid']))
+            ].update(known_exercise_uuids_by_calculation_uuid[calc_uuid])
+
+    # Only the responses to known exercises are returned
+    response_dicts_by_ecosystem_student_uuids = fetch_student_responses(
+        session, known_exercise_uuids_by_ecosystem_student_uuids
+    )
+
+    response_dicts_by_calculation_uuid = defaultdict(list)
+    for ecosystem_matrix in ecosystem_matrices:
+        ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
+        for calculation in calculations_by_ecosystem_uuid[ecosystem_uuid]:
+            calc_uuid = calculation['calculation_uuid']
+            known_exercise_uuids = known_exercise_uuids_by_calculation_uuid[calc_uuid]
+            # Calculations for the same student can have different exercises
+            response_dicts_by_calculation_uuid[calc_uuid] = [
+                response_dict
+                for response_dict in response_dicts_by_ecosystem_student_uuids[
+                    (str(ecosystem_uuid), str(calculation['student_uuid']))
+                ] if response_dict['Q_id'] in known_exercise_uuids
+            ]
 
-                for calculation in ecosystem_calculations:
-                    calculation_uuid = calculation['calculation_uuid']
-
-                    ordered_Q_infos = algs.tesr(
-                        target_L_id=calculation['student_uuid'],
-                        target_Q_ids=known_exercise_uuids_by_calculation_uuid[calculation_uuid],
-                        target_responses=response_dicts_by_calculation_uuid[calculation_uuid]
-                    )
-                    ordered_exercise_uuids = [info.Q_id for info in ordered_Q_infos]
-
-                    # Put any unknown exercise uuids at the end of the list in random order
-                    unknown_exercise_uuids = list(
-                        unknown_exercise_uuids_by_calculation_uuid[calculation_uuid]
-                    )
-                    shuffle(unknown_exercise_uuids)
-                    ordered_exercise_uuids.extend(unknown_exercise_uuids)
+    # Orderings only depend on the ecosystem matrix, the candidate exercises and the student's
+    # responses to them, so cached orderings are reused until one of these changes
+    ordering_key_by_calculation_uuid = {}
+    for ecosystem_matrix in ecosystem_matrices:
+        ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
+        for calculation in calculations_by_ecosystem_uuid[ecosystem_uuid]:
+            calc_uuid = calculation['calculation_uuid']
+            ordering_key_by_calculation_uuid[calc_uuid] = exercise_ordering_key(
+                ecosystem_matrix_uuid=ecosystem_matrix.uuid,
+                student_uuid=calculation['student_uuid'],
+                exercise_uuids=known_exercise_uuids_by_calculation_uuid[calc_uuid],
+                response_dicts=response_dicts_by_calculation_uuid[calc_uuid]
+            )
+    cached_ordered_exercise_uuids_by_key = fetch_exercise_orderings(
+        ordering_key_by_calculation_uuid.values()
+    )
+
+    ordered_exercise_uuids_by_calculation_uuid = {}
+    uncalculated_ecosystem_matrices_calculations = []
+    for ecosystem_matrix in ecosystem_matrices:
+        uncalculated_calculations = []
+        for calculation in calculations_by_ecosystem_uuid[ecosystem_matrix.ecosystem_uuid]:
+            calc_uuid = calculation['calculation_uuid']
+            key = ordering_key_by_calculation_uuid[calc_uuid]
+            if key in cached_ordered_exercise_uuids_by_key:
+                ordered_exercise_uuids_by_calculation_uuid[calc_uuid] = \
+                    cached_ordered_exercise_uuids_by_key[key]
+            else:
+                uncalculated_calculations.append(calculation)
+
+        # Skip building the algs if all of the orderings were cached
+        if uncalculated_calculations:
+            uncalculated_ecosystem_matrices_calculations.append(
+                (ecosystem_matrix, uncalculated_calculations)
+            )
+
+    calculated_ordered_exercise_uuids_by_key = {}
+    for calculated_ordered_exercise_uuids_by_calculation_uuid in _map_ecosystem_calculations(
+        partial(
+            _order_ecosystem_exercises,
+            known_exercise_uuids_by_calculation_uuid=known_exercise_uuids_by_calculation_uuid,
+            response_dicts_by_calculation_uuid=response_dicts_by_calculation_uuid
+        ),
+        uncalculated_ecosystem_matrices_calculations
+    ):
+        for calc_uuid, ordered_exercise_uuids in \
+                calculated_ordered_exercise_uuids_by_calculation_uuid.items():
+            ordered_exercise_uuids_by_calculation_uuid[calc_uuid] = ordered_exercise_uuids
+            calculated_ordered_exercise_uuids_by_key[
+                ordering_key_by_calculation_uuid[calc_uuid]
+            ] = ordered_exercise_uuids
+
+    exercise_calculation_requests = []
+    for ecosystem_matrix in ecosystem_matrices:
+        for calculation in calculations_by_ecosystem_uuid[ecosystem_matrix.ecosystem_uuid]:
+            calculation_uuid = calculation['calculation_uuid']
+            ordered_exercise_uuids = list(
+                ordered_exercise_uuids_by_calculation_uuid[calculation_uuid]
+            )
+
+            # Put any unknown exercise uuids at the end of the list in random order
+            unknown_exercise_uuids = list(
+                unknown_exercise_uuids_by_calculation_uuid[calculation_uuid]
+            )
+            shuffle(unknown_exercise_uuids)
+            ordered_exercise_uuids.extend(unknown_exercise_uuids)
+
+            exercise_calculation_requests.append({
+                'calculation_uuid': calculation_uuid,
+                'ecosystem_matrix_uuid': ecosystem_matrix.uuid,
+                'exercise_uuids': ordered_exercise_uuids
+            })
+
+    store_exercise_orderings(calculated_ordered_exercise_uuids_by_key)
+
+    return exercise_calculation_requests
+
+
+def _calculate_ecosystem_clues(decoded_ecosystem_matrix, calculations,
+                               response_dicts_by_trial_uuid):
+    """
+    Calculates the given CLUe calculations, which all use the given matrix
+    Returns the CLUe calculation updates
+    """
+    ecosystem_uuid = decoded_ecosystem_matrix.ecosystem_uuid
+    algs = EcosystemMatrix.decoded_to_sparfa_algs_with_student_uuids_responses(
+        decoded_ecosystem_matrix,
+        student_uuids=[
+            student_uuid
+            for calculation in calculations
+            for student_uuid in calculation['student_uuids']
+        ],
+        responses=[response_dicts_by_trial_uuid[response['trial_uuid']]
+                   for calculation in calculations
+                   for response in calculation['responses']]
+    )
+
+    Q_idx_by_id = decoded_ecosystem_matrix.Q_idx_by_id
+
+    clue_calculation_requests = []
+    for calculation in calculations:
+        clue_mean, clue_min, clue_max, clue_is_real = algs.calc_clue_interval(
+            confidence=.5,
+            target_L_ids=calculation['student_uuids'],
+            target_Q_ids=[uuid for uuid in calculation['exercise_uuids']
+                          if uuid in Q_idx_by_id]
+        )
+
+        clue_calculation_requests.append({
+            'calculation_uuid': calculation['calculation_uuid'],
+            'clue_data': {
+                'minimum': clue_min,
+                'most_likely': clue_mean,
+                'maximum': clue_max,
+                'is_real': clue_is_real,
+                'ecosystem_uuid': ecosystem_uuid
+            }
+        })
+
+    return clue_calculation_requests
+
+
+def _calculate_clue_batch(session, calculations):
+    """
+    Locks and calculates the given CLUe calculations
+    Returns the CLUe calculation updates, or None if nothing else can be calculated
+    """
+    trial_uuids = set(response['trial_uuid']
+                      for calculation in calculations
+                      for response in calculation['responses'])
+
+    # Skip calculations with unknown responses and responses that we can't lock immediately
+    responses = session.query(Response).filter(
+        Response.trial_uuid.in_(trial_uuids)
+    ).with_for_update(key_share=True, skip_locked=True).all()
+    responses_by_trial_uuid = {}
+    for response in responses:
+        responses_by_trial_uuid[response.trial_uuid] = response
+
+    calculations_by_ecosystem_uuid = defaultdict(list)
+    for calc in calculations:
+        if all(resp['trial_uuid'] in responses_by_trial_uuid for resp in calc['responses']):
+            calculations_by_ecosystem_uuid[calc['ecosystem_uuid']].append(calc)
+
+    if not calculations_by_ecosystem_uuid:
+        return None
+
+    ecosystem_matrices = EcosystemMatrix.query_cached(
+        session,
+        EcosystemMatrix.ecosystem_uuid.in_(calculations_by_ecosystem_uuid.keys()),
+        EcosystemMatrix.superseded_at.is_(None)
+    )
+
+    if not ecosystem_matrices:
+        return None
+
+    # The responses are converted in this thread, so the CLUe calculations do not use the session
+    response_dicts_by_trial_uuid = {
+        trial_uuid: response.dict_for_algs
+        for trial_uuid, response in responses_by_trial_uuid.items()
+    }
+
+    # Skip calculations that don't have an ecosystem matrix
+    return [
+        clue_calculation_request
+        for ecosystem_clue_calculation_requests in _map_ecosystem_calculations(
+            partial(_calculate_ecosystem_clues,
+                    response_dicts_by_trial_uuid=response_dicts_by_trial_uuid),
+            [(ecosystem_matrix, calculations_by_ecosystem_uuid[ecosystem_matrix.ecosystem_uuid])
+             for ecosystem_matrix in ecosystem_matrices]
+        )
+        for clue_calculation_request in ecosystem_clue_calculation_requests
+    ]
 
-                    exercise_calculation_requests.append({
-                        'calculation_uuid': calculation_uuid,
-                        'ecosystem_matrix_uuid': ecosystem_matrix.uuid,
-                        'exercise_uuids': ordered_exercise_uuids
-                    })
 
-            # There are no updates to the DB in this transaction,
-            # so we can perform this request with the transaction still open
-            # This way we keep rows locked until the update has been sent to biglearn-scheduler
-            BLSCHED.update_exercise_calculations(exercise_calculation_requests)
-
-        calculations = BLSCHED.fetch_exercise_calculations()
+@task
+def calculate_exercises():
+    """Calculate all personalized exercises"""
+    _process_calculations(
+        BLSCHED.fetch_exercise_calculations,
+        _calculate_exercise_batch,
+        _update_exercise_calculations
+    )
 
 
 @task
 def calculate_clues():
     """Calculate all CLUes"""
-    calculations = BLSCHED.fetch_clue_calculations()
-    while calculations:
-        trial_uuids = set(response['trial_uuid']
-                          for calculation in calculations
-                          for response in calculation['responses'])
-
-        with transaction() as session:
-            # Skip calculations with unknown responses and responses that we can't lock immediately
-            responses = session.query(Response).filter(
-                Response.trial_uuid.in_(trial_uuids)
-            ).with_for_update(key_share=True, skip_locked=True).all()
-            responses_by_trial_uuid = {}
-            for response in responses:
-                responses_by_trial_uuid[response.trial_uuid] = response
-
-            calculations_by_ecosystem_uuid = defaultdict(list)
-            for calc in calculations:
-                if all(resp['trial_uuid'] in responses_by_trial_uuid for resp in calc['responses']):
-                    calculations_by_ecosystem_uuid[calc['ecosystem_uuid']].append(calc)
-
-            if not calculations_by_ecosystem_uuid:
-                break
-
-            ecosystem_matrices = session.query(EcosystemMatrix).filter(
-                EcosystemMatrix.ecosystem_uuid.in_(calculations_by_ecosystem_uuid.keys()),
-                EcosystemMatrix.superseded_at.is_(None)
-            ).all()
-
-            if not ecosystem_matrices:
-                break
-
-            clue_calculation_requests = []
-            # Skip calculations that don't have an ecosystem matrix
-            for ecosystem_matrix in ecosystem_matrices:
-                ecosystem_uuid = ecosystem_matrix.ecosystem_uuid
-                ecosystem_calculations = calculations_by_ecosystem_uuid[ecosystem_uuid]
-
-                algs = ecosystem_matrix.to_sparfa_algs_with_student_uuids_responses(
-                    student_uuids=[
-                        student_uuid
-                        for calculation in ecosystem_calculations
-                        for student_uuid in calculation['student_uuids']
-                    ],
-                    responses=[responses_by_trial_uuid[response['trial_uuid']]
-                               for calculation in ecosystem_calculations
-                               for response in calculation['responses']]
-                )
-
-                Q_ids_set = set(ecosystem_matrix.Q_ids)
-
-                for calculation in ecosystem_calculations:
-                    clue_mean, clue_min, clue_max, clue_is_real = algs.calc_clue_interval(
-                        confidence=.5,
-                        target_L_ids=calculation['student_uuids'],
-                        target_Q_ids=[uuid for uuid in calculation['exercise_uuids']
-                                      if uuid in Q_ids_set]
-                    )
-
-                    clue_calculation_requests.append({
-                        'calculation_uuid': calculation['calculation_uuid'],
-                        'clue_data': {
-                            'minimum': clue_min,
-                            'most_likely': clue_mean,
-                            'maximum': clue_max,
-                            'is_real': clue_is_real,
-                            'ecosystem_uuid': ecosystem_uuid
-                        }
-                    })
-
-            # There are no updates to the DB in this transaction,
-            # so we can perform this request with the transaction still open
-            # This way we keep rows locked until the update has been sent to biglearn-scheduler
-            BLSCHED.update_clue_calculations(clue_calculation_requests)
-
-        calculations = BLSCHED.fetch_clue_calculations()
+    _process_calculations(
+        BLSCHED.fetch_clue_calculations,
+        _calculate_clue_batch,
+        BLSCHED.update_clue_calculations
+    )
@@ -22,6 +22,7 @@ CALCULATE_ECOSYSTEM_MATRICES_QUEUE = '{}calculate.ecosystem-matrices'.format(AMQ
 CALCULATE_EXERCISES_QUEUE = '{}calculate.exercises'.format(AMQP_QUEUE_PREFIX)
 CALCULATE_CLUES_QUEUE = '{}calculate.clues'.format(AMQP_QUEUE_PREFIX)
 CLEANUP_ECOSYSTEM_MATRICES_QUEUE = '{}cleanup.ecosystem-matrices'.format(AMQP_QUEUE_PREFIX)
+CLEANUP_CALCULATION_LEASES_QUEUE = '{}cleanup.calculation-leases'.format(AMQP_QUEUE_PREFIX)
 
 app = Celery('sparfa_server')
 app.conf.update(
@@ -70,6 +71,11 @@ app.conf.update(
             'task': 'sparfa_server.tasks.clean.cleanup_ecosystem_matrices',
             'schedule': timedelta(days=1),
             'options': {'queue': CLEANUP_ECOSYSTEM_MATRICES_QUEUE}
+        },
+        'cleanup_calculation_leases': {
+            'task': 'sparfa_server.tasks.clean.cleanup_calculation_leases',
+            'schedule': timedelta(days=1),
+            'options': {'queue': CLEANUP_CALCULATION_LEASES_QUEUE}
         }
     },
     beat_scheduler='redbeat.schedulers.RedBeatScheduler',
@@ -88,7 +94,8 @@ app.conf.update(
         Queue(CALCULATE_ECOSYSTEM_MATRICES_QUEUE, routing_key=CALCULATE_ECOSYSTEM_MATRICES_QUEUE),
         Queue(CALCULATE_EXERCISES_QUEUE, routing_key=CALCULATE_EXERCISES_QUEUE),
         Queue(CALCULATE_CLUES_QUEUE, routing_key=CALCULATE_CLUES_QUEUE),
-        Queue(CLEANUP_ECOSYSTEM_MATRICES_QUEUE, routing_key=CLEANUP_ECOSYSTEM_MATRICES_QUEUE)
+        Queue(CLEANUP_ECOSYSTEM_MATRICES_QUEUE, routing_key=CLEANUP_ECOSYSTEM_MATRICES_QUEUE),
+        Queue(CLEANUP_CALCULATION_LEASES_QUEUE, routing_key=CLEANUP_CALCULATION_LEASES_QUEUE)
     ],
     ONCE={
         'backend': 'celery_once.backends.Redis',
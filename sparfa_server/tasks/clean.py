@@ -1,9 +1,12 @@
 from datetime import timedelta, datetime
 
-from ..orm import transaction, EcosystemMatrix
+from sqlalchemy import exists, func
+
+from ..orm import transaction, EcosystemMatrixPayload, EcosystemMatrix, CalculationLease
+from ..orm.store import ECOSYSTEM_MATRIX_STORE
 from .celery import task
 
-__all__ = ('cleanup_ecosystem_matrices',)
+__all__ = ('cleanup_ecosystem_matrices', 'cleanup_calculation_leases')
 
 CLEANUP_AFTER = timedelta(days=30)
 BATCH_SIZE = 1000
@@ -14,9 +17,12 @@ def cleanup_ecosystem_matrices():
     """Calculate old unused ecosystem matrices"""
     while True:
         with transaction() as session:
+            # Matrices that are the parents of delta-encoded matrices are kept until
+            # all of those matrices are deleted, since they are needed to materialize them
             ecosystem_matrices = session.query(EcosystemMatrix.uuid).filter(
                 EcosystemMatrix.is_used_in_assignments.is_(False),
-                EcosystemMatrix.superseded_at <= datetime.now() - CLEANUP_AFTER
+                EcosystemMatrix.superseded_at <= datetime.now() - CLEANUP_AFTER,
+                ~exists().where(EcosystemMatrixPayload.parent_uuid == EcosystemMatrix.uuid)
             ).with_for_update(skip_locked=True).limit(BATCH_SIZE).all()
 
             if ecosystem_matrices:
@@ -24,5 +30,21 @@ def cleanup_ecosystem_matrices():
                     EcosystemMatrix.uuid.in_([matrix.uuid for matrix in ecosystem_matrices])
                 ).delete(synchronize_session=False)
 
-            if len(ecosystem_matrices) < BATCH_SIZE:
-                break
+        # The files are only deleted once the transaction is committed,
+        # so a rollback never leaves matrices that are still in use without their files
+        # This only affects this machine's store, the others evict the files once unused
+        if ECOSYSTEM_MATRIX_STORE is not None:
+            for matrix in ecosystem_matrices:
+                ECOSYSTEM_MATRIX_STORE.discard(matrix.uuid)
+
+        if len(ecosystem_matrices) < BATCH_SIZE:
+            break
+
+
+@task
+def cleanup_calculation_leases():
+    """Delete the expired leases of calculations that were never calculated again"""
+    with transaction() as session:
+        session.query(CalculationLease).filter(
+            CalculationLease.expires_at <= func.now() - CLEANUP_AFTER
+        ).delete(synchronize_session=False)
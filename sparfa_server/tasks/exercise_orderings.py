@@ -0,0 +1,77 @@
+from hashlib import sha256
+from logging import getLogger
+
+from redis.exceptions import RedisError
+
+from ..config import EXERCISE_ORDERING_CACHE_DAYS
+from .redis import REDIS
+
+__all__ = ('exercise_ordering_key', 'fetch_exercise_orderings', 'store_exercise_orderings')
+
+LOGGER = getLogger(__name__)
+KEY_PREFIX = 'exercise_orderings'
+TTL = EXERCISE_ORDERING_CACHE_DAYS * 24 * 60 * 60
+
+
+def exercise_ordering_key(ecosystem_matrix_uuid, student_uuid, exercise_uuids, response_dicts):
+    """
+    Returns the key of the ordering of the given exercise uuids for the given student
+    The key changes whenever the ordering could change: when the ecosystem matrix is superseded,
+    when the candidate exercises change or when the given student responses change
+    """
+    digest = sha256()
+    for exercise_uuid in sorted(str(uuid) for uuid in exercise_uuids):
+        digest.update(';{}'.format(exercise_uuid).encode())
+    digest.update(b'|')
+    for response in sorted(
+        (str(response['Q_id']), bool(response['correct?']), str(response['responded_at']))
+        for response in response_dicts
+    ):
+        digest.update(';{}:{:d}:{}'.format(*response).encode())
+    return '{}:{}:{}:{}'.format(
+        KEY_PREFIX, ecosystem_matrix_uuid, student_uuid, digest.hexdigest()
+    )
+
+
+def fetch_exercise_orderings(keys):
+    """
+    Returns a dict mapping each of the given keys that is cached
+    to the list of ordered exercise uuids cached under it
+    If the cache is unavailable, none of the keys are cached
+    """
+    keys = sorted(set(keys))
+    if not TTL or not keys:
+        return {}
+
+    try:
+        values = REDIS.mget(keys)
+    except RedisError:
+        LOGGER.warning('Failed to fetch {} cached exercise orderings'.format(len(keys)),
+                       exc_info=True)
+        return {}
+
+    return {
+        key: value.decode().split(',') if value else []
+        for key, value in zip(keys, values) if value is not None
+    }
+
+
+def store_exercise_orderings(ordered_exercise_uuids_by_key):
+    """
+    Caches the given lists of ordered exercise uuids under their keys
+    If the cache is unavailable, they are simply not cached
+    """
+    if not TTL or not ordered_exercise_uuids_by_key:
+        return
+
+    try:
+        with REDIS.pipeline(transaction=False) as pipeline:
+            for key, ordered_exercise_uuids in sorted(ordered_exercise_uuids_by_key.items()):
+                pipeline.setex(key, TTL, ','.join(
+                    str(exercise_uuid) for exercise_uuid in ordered_exercise_uuids
+                ))
+            pipeline.execute()
+    except RedisError:
+        LOGGER.warning('Failed to cache {} exercise orderings'.format(
+            len(ordered_exercise_uuids_by_key)
+        ), exc_info=True)
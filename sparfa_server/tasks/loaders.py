@@ -1,11 +1,12 @@
 from uuid import uuid4
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from sqlalchemy import func
 
 from ..biglearn import BLAPI
 from ..orm import transaction, Ecosystem, EcosystemMatrix, Page, Course, Response
 from .celery import task
+from .student_responses import update_student_responses
 
 __all__ = ('load_ecosystem_metadata', 'load_ecosystem_events',
            'load_course_metadata', 'load_course_events')
@@ -153,7 +154,9 @@ def _load_grouped_ecosystem_events(session, ecosystems):
         session.upsert_values(Page, page_values)
 
     if ecosystem_matrices:
-        session.upsert_models(EcosystemMatrix, ecosystem_matrices)
+        EcosystemMatrix.upsert_values(
+            session, [ecosystem_matrix.dict for ecosystem_matrix in ecosystem_matrices]
+        )
 
     return ecosystem_uuids_to_requery
 
@@ -203,12 +206,18 @@ def load_course_events(event_types=['record_response'], batch_size=1000):
                 key_share=True, skip_locked=True
             ).all()
 
-            course_uuids_to_requery.extend(_load_grouped_course_events(session, courses))
+            requery_course_uuids, num_pending_responses_by_ecosystem_uuid = \
+                _load_grouped_course_events(session, courses)
+            course_uuids_to_requery.extend(requery_course_uuids)
 
-            if len(courses) < batch_size:
-                break
+            num_courses = len(courses)
+            if courses:
+                last_course_uuid = courses[-1].uuid
+
+        _add_pending_responses(num_pending_responses_by_ecosystem_uuid)
 
-            last_course_uuid = courses[-1].uuid
+        if num_courses < batch_size:
+            break
 
     # Retry courses that we couldn't query before
     # This is done to avoid starvation, in case some course is emitting lots of events
@@ -223,12 +232,22 @@ def load_course_events(event_types=['record_response'], batch_size=1000):
 
             course_uuids_to_requery = course_uuids_to_requery[batch_size:]
 
-            course_uuids_to_requery.extend(_load_grouped_course_events(session, courses))
+            requery_course_uuids, num_pending_responses_by_ecosystem_uuid = \
+                _load_grouped_course_events(session, courses)
+            course_uuids_to_requery.extend(requery_course_uuids)
+
+        _add_pending_responses(num_pending_responses_by_ecosystem_uuid)
 
 
 def _load_grouped_course_events(session, courses):
+    """
+    Loads the events of the given courses
+    Returns the uuids of the courses that have more events to load
+    and the number of new real responses for each ecosystem
+    """
+    num_pending_responses_by_ecosystem_uuid = Counter()
     if not courses:
-        return []
+        return [], num_pending_responses_by_ecosystem_uuid
 
     courses_by_req_uuid = {str(uuid4()): course for course in courses}
     event_requests = [{
@@ -303,4 +322,36 @@ def _load_grouped_course_events(session, courses):
     if response_values_dict:
         session.upsert_values(Response, list(response_values_dict.values()))
 
-    return course_uuids_to_requery
+        # If this transaction is rolled back, the course sequence numbers are not updated
+        # and the same events are loaded again, so the cache is updated before the commit
+        update_student_responses(session, list(response_values_dict))
+
+        num_pending_responses_by_ecosystem_uuid.update(
+            values['ecosystem_uuid'] for values in response_values_dict.values()
+            if values['is_real_response']
+        )
+
+    return course_uuids_to_requery, num_pending_responses_by_ecosystem_uuid
+
+
+def _add_pending_responses(num_pending_responses_by_ecosystem_uuid):
+    """
+    Adds the given numbers of pending responses to the given ecosystems
+    This happens in its own short transaction, after the responses are committed,
+    so the ecosystems are not locked while course events are loaded
+    and ecosystem matrix calculations consuming the pending responses are not blocked
+    Responses received again are counted twice, but this is only used for prioritization
+    """
+    if not num_pending_responses_by_ecosystem_uuid:
+        return
+
+    with transaction() as session:
+        # The ecosystems are updated in a consistent order to avoid deadlocks
+        for ecosystem_uuid, num_pending_responses in sorted(
+            num_pending_responses_by_ecosystem_uuid.items()
+        ):
+            session.query(Ecosystem).filter(Ecosystem.uuid == ecosystem_uuid).update(
+                {Ecosystem.num_pending_responses:
+                 Ecosystem.num_pending_responses + num_pending_responses},
+                synchronize_session=False
+            )
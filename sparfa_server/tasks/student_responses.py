@@ -0,0 +1,262 @@
+from collections import defaultdict
+from logging import getLogger
+from textwrap import dedent
+
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, TEXT
+
+from ..algs import EPOCH, MICROSECOND
+from ..config import STUDENT_RESPONSE_CACHE_DAYS
+from ..orm import Response
+from .redis import REDIS
+
+__all__ = ('update_student_responses', 'fetch_student_responses')
+
+LOGGER = getLogger(__name__)
+KEY_PREFIX = 'student_responses'
+# Hash field set only when the hash contains the student's whole response history
+COMPLETE_FIELD = b'complete'
+TTL = STUDENT_RESPONSE_CACHE_DAYS * 24 * 60 * 60
+
+# Each hash maps exercise uuids to "responded_at_in_microseconds:is_correct"
+# Responses are only stored if they are at least as recent as the one already cached,
+# so concurrent updates can be merged in any order
+# ARGV: TTL, is_complete, exercise_uuid_1, value_1, exercise_uuid_2, value_2, ...
+MERGE_SCRIPT = REDIS.register_script("""
+for i = 3, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(string.match(current, '^%d+')) <=
+                      tonumber(string.match(ARGV[i + 1], '^%d+')) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+if ARGV[2] == '1' then
+    redis.call('HSET', KEYS[1], 'complete', '1')
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+""")
+
+# These statements are the same for every batch, so they do not grow with the batch
+# and Postgres does not have to parse a different statement every time
+LATEST_VALUES_QUERY = text(dedent("""
+    SELECT "responses"."ecosystem_uuid", "responses"."student_uuid",
+        "responses"."exercise_uuid", "responses"."is_correct", "responses"."responded_at"
+    FROM "responses" INNER JOIN UNNEST(
+        CAST(:ecosystem_uuids AS UUID[]), CAST(:student_uuids AS UUID[])
+    ) AS "values" ("ecosystem_uuid", "student_uuid")
+        ON "responses"."student_uuid" = "values"."student_uuid"
+            AND "responses"."ecosystem_uuid" = "values"."ecosystem_uuid"
+""").strip()).bindparams(
+    bindparam('ecosystem_uuids', type_=ARRAY(TEXT)), bindparam('student_uuids', type_=ARRAY(TEXT))
+)
+# Uses the ix_responses_ecosystem_uuid_student_uuid_exercise_uuid index
+EXERCISE_LATEST_VALUES_QUERY = text(dedent("""
+    SELECT "responses"."ecosystem_uuid", "responses"."student_uuid",
+        "responses"."exercise_uuid", "responses"."is_correct", "responses"."responded_at"
+    FROM "responses" INNER JOIN UNNEST(
+        CAST(:ecosystem_uuids AS UUID[]),
+        CAST(:student_uuids AS UUID[]),
+        CAST(:exercise_uuids AS UUID[])
+    ) AS "values" ("ecosystem_uuid", "student_uuid", "exercise_uuid")
+        ON "responses"."ecosystem_uuid" = "values"."ecosystem_uuid"
+            AND "responses"."student_uuid" = "values"."student_uuid"
+            AND "responses"."exercise_uuid" = "values"."exercise_uuid"
+""").strip()).bindparams(
+    bindparam('ecosystem_uuids', type_=ARRAY(TEXT)),
+    bindparam('student_uuids', type_=ARRAY(TEXT)),
+    bindparam('exercise_uuids', type_=ARRAY(TEXT))
+)
+
+
+def _key(ecosystem_uuid, student_uuid):
+    return '{}:{}:{}'.format(KEY_PREFIX, ecosystem_uuid, student_uuid)
+
+
+def _merge(client, ecosystem_uuid, student_uuid, values, is_complete):
+    args = [TTL, int(is_complete)]
+    for exercise_uuid, is_correct, responded_at in values:
+        args.append(str(exercise_uuid))
+        args.append('{}:{}'.format((responded_at - EPOCH) // MICROSECOND, int(is_correct)))
+    MERGE_SCRIPT(keys=[_key(ecosystem_uuid, student_uuid)], args=args, client=client)
+
+
+def update_student_responses(session, trial_uuids):
+    """
+    Merges the responses with the given trial uuids into the cached student responses
+    The responses are read back from the session, so they must have already been saved to it
+    Redis errors are logged instead of raised, so responses can be saved while Redis is down
+    """
+    if not TTL or not trial_uuids:
+        return
+
+    values_by_ecosystem_student_uuids = defaultdict(list)
+    for response in session.query(
+        Response.ecosystem_uuid,
+        Response.student_uuid,
+        Response.exercise_uuid,
+        Response.is_correct,
+        Response.responded_at
+    ).filter(Response.trial_uuid.in_(trial_uuids)):
+        values_by_ecosystem_student_uuids[
+            (response.ecosystem_uuid, response.student_uuid)
+        ].append((response.exercise_uuid, response.is_correct, response.responded_at))
+
+    ecosystem_student_uuids = sorted(values_by_ecosystem_student_uuids)
+    try:
+        with REDIS.pipeline(transaction=False) as pipeline:
+            for ecosystem_uuid, student_uuid in ecosystem_student_uuids:
+                _merge(pipeline, ecosystem_uuid, student_uuid,
+                       values_by_ecosystem_student_uuids[(ecosystem_uuid, student_uuid)],
+                       is_complete=False)
+            pipeline.execute()
+    except RedisError:
+        # The cached students would be missing these responses, so their hashes are dropped
+        # and their responses will be loaded from the database again
+        # If that fails as well, the hashes can miss these responses until they expire,
+        # which only affects the ordering of these students' exercises
+        LOGGER.exception('Failed to cache the responses of {} students'.format(
+            len(ecosystem_student_uuids)
+        ))
+        try:
+            REDIS.delete(*[_key(ecosystem_uuid, student_uuid)
+                           for ecosystem_uuid, student_uuid in ecosystem_student_uuids])
+        except RedisError:
+            LOGGER.exception('Failed to drop the cached responses of {} students'.format(
+                len(ecosystem_student_uuids)
+            ))
+
+
+def _query_latest_values(session, exercise_uuids_by_ecosystem_student_uuids, is_complete):
+    """
+    Returns a dict mapping each of the given (ecosystem_uuid, student_uuid) tuples
+    to a dict containing the student's latest (is_correct, responded_at) for each exercise uuid
+    If is_complete is True, all of the students' responses are loaded,
+    otherwise only their responses to the given exercise uuids are loaded
+    """
+    latest_values_by_ecosystem_student_uuids = {
+        ecosystem_student_uuid: {}
+        for ecosystem_student_uuid in exercise_uuids_by_ecosystem_student_uuids
+    }
+    if is_complete:
+        ecosystem_uuids, student_uuids = zip(*exercise_uuids_by_ecosystem_student_uuids)
+        results = session.execute(LATEST_VALUES_QUERY, {
+            'ecosystem_uuids': list(ecosystem_uuids), 'student_uuids': list(student_uuids)
+        })
+    else:
+        ecosystem_uuids = []
+        student_uuids = []
+        exercise_uuids = []
+        for (ecosystem_uuid, student_uuid), student_exercise_uuids in \
+                exercise_uuids_by_ecosystem_student_uuids.items():
+            ecosystem_uuids.extend([ecosystem_uuid] * len(student_exercise_uuids))
+            student_uuids.extend([student_uuid] * len(student_exercise_uuids))
+            exercise_uuids.extend(student_exercise_uuids)
+        results = session.execute(EXERCISE_LATEST_VALUES_QUERY, {
+            'ecosystem_uuids': ecosystem_uuids,
+            'student_uuids': student_uuids,
+            'exercise_uuids': exercise_uuids
+        })
+
+    for response in results:
+        latest_values = latest_values_by_ecosystem_student_uuids[
+            (str(response.ecosystem_uuid), str(response.student_uuid))
+        ]
+        exercise_uuid = str(response.exercise_uuid)
+        if exercise_uuid not in latest_values or \
+                latest_values[exercise_uuid][1] <= response.responded_at:
+            latest_values[exercise_uuid] = (response.is_correct, response.responded_at)
+
+    return latest_values_by_ecosystem_student_uuids
+
+
+def fetch_student_responses(session, exercise_uuids_by_ecosystem_student_uuids):
+    """
+    Returns a dict mapping each of the given (ecosystem_uuid, student_uuid) tuples
+    to a list containing the student's latest response to each of the given exercise uuids,
+    as response dicts in the format used by the algorithms
+    Students that are not fully cached are loaded from the database and then cached
+    If the cache is disabled, only the responses to the given exercises are loaded
+    If the cache is unavailable, all of the students are loaded from the database
+    """
+    exercise_uuids_by_ecosystem_student_uuids = {
+        (str(ecosystem_uuid), str(student_uuid)): set(str(uuid) for uuid in exercise_uuids)
+        for (ecosystem_uuid, student_uuid), exercise_uuids in
+        exercise_uuids_by_ecosystem_student_uuids.items()
+    }
+    ecosystem_student_uuids = sorted(exercise_uuids_by_ecosystem_student_uuids)
+    latest_values_by_ecosystem_student_uuids = {}
+    uncached_ecosystem_student_uuids = ecosystem_student_uuids
+
+    if TTL and ecosystem_student_uuids:
+        try:
+            with REDIS.pipeline(transaction=False) as pipeline:
+                for ecosystem_uuid, student_uuid in ecosystem_student_uuids:
+                    key = _key(ecosystem_uuid, student_uuid)
+                    pipeline.hgetall(key)
+                    pipeline.expire(key, TTL)
+                hashes = pipeline.execute()[::2]
+        except RedisError:
+            LOGGER.warning('Failed to fetch the cached responses of {} students, '
+                           'loading them from the database'.format(len(ecosystem_student_uuids)),
+                           exc_info=True)
+            hashes = [{} for ecosystem_student_uuid in ecosystem_student_uuids]
+
+        uncached_ecosystem_student_uuids = []
+        for ecosystem_student_uuid, cached_values in zip(ecosystem_student_uuids, hashes):
+            if cached_values.pop(COMPLETE_FIELD, None) is None:
+                uncached_ecosystem_student_uuids.append(ecosystem_student_uuid)
+                continue
+
+            latest_values = {}
+            for exercise_uuid, value in cached_values.items():
+                responded_at, is_correct = value.split(b':')
+                latest_values[exercise_uuid.decode()] = (
+                    is_correct == b'1', EPOCH + int(responded_at) * MICROSECOND
+                )
+            latest_values_by_ecosystem_student_uuids[ecosystem_student_uuid] = latest_values
+
+    if uncached_ecosystem_student_uuids:
+        # The whole history is only needed to cache it
+        uncached_latest_values_by_ecosystem_student_uuids = _query_latest_values(session, {
+            ecosystem_student_uuid: exercise_uuids_by_ecosystem_student_uuids[
+                ecosystem_student_uuid
+            ] for ecosystem_student_uuid in uncached_ecosystem_student_uuids
+        }, is_complete=bool(TTL))
+
+        if TTL:
+            # Responses loaded in the meantime were already merged into the hashes,
+            # so we merge instead of overwriting them
+            # The responses were already loaded, so failing to cache them is not an error
+            try:
+                with REDIS.pipeline(transaction=False) as pipeline:
+                    for (ecosystem_uuid, student_uuid), latest_values in sorted(
+                        uncached_latest_values_by_ecosystem_student_uuids.items()
+                    ):
+                        _merge(pipeline, ecosystem_uuid, student_uuid, [
+                            (exercise_uuid, is_correct, responded_at)
+                            for exercise_uuid, (is_correct, responded_at) in latest_values.items()
+                        ], is_complete=True)
+                    pipeline.execute()
+            except RedisError:
+                LOGGER.warning('Failed to cache the responses of {} students'.format(
+                    len(uncached_latest_values_by_ecosystem_student_uuids)
+                ), exc_info=True)
+
+        latest_values_by_ecosystem_student_uuids.update(
+            uncached_latest_values_by_ecosystem_student_uuids
+        )
+
+    return {
+        (ecosystem_uuid, student_uuid): [Response.dict_for_algs_from_values(
+            student_uuid=student_uuid,
+            exercise_uuid=exercise_uuid,
+            is_correct=is_correct,
+            responded_at=responded_at
+        ) for exercise_uuid, (is_correct, responded_at) in sorted(latest_values.items())
+            if exercise_uuid in exercise_uuids_by_ecosystem_student_uuids[
+                (ecosystem_uuid, student_uuid)
+            ]]
+        for (ecosystem_uuid, student_uuid), latest_values in
+        latest_values_by_ecosystem_student_uuids.items()
+    }
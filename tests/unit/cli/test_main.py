@@ -2,4 +2,4 @@ from sparfa_server.cli.main import main
 
 
 def test_main():
-    assert set(main.commands.keys()) == set(('load', 'calc', 'celery'))
+    assert set(main.commands.keys()) == set(('load', 'calc', 'report', 'celery'))
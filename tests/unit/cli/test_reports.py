@@ -0,0 +1,48 @@
+from uuid import uuid4
+
+from pytest import raises
+
+from sparfa_server.orm import EcosystemMatrixStats
+from sparfa_server.cli.reports import report, matrices
+
+
+def test_report():
+    assert set(report.commands.keys()) == set(('matrices',))
+
+
+def test_matrices(transaction, capsys):
+    cheap_ecosystem_uuid = str(uuid4())
+    expensive_ecosystem_uuid = str(uuid4())
+    stats = [EcosystemMatrixStats(
+        uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem_uuid,
+        ecosystem_matrix_uuid=str(uuid4()),
+        is_delta=False,
+        num_responses=10,
+        num_loaded_responses=4,
+        num_students=2,
+        num_exercises=5,
+        num_concepts=1,
+        load_seconds=seconds,
+        calculation_seconds=seconds,
+        save_seconds=seconds,
+        peak_rss_kb=1024
+    ) for ecosystem_uuid, seconds in (
+        (cheap_ecosystem_uuid, 1), (expensive_ecosystem_uuid, 2), (expensive_ecosystem_uuid, 3)
+    )]
+
+    with transaction() as session:
+        for stat in stats:
+            session.add(stat)
+
+    with raises(SystemExit):
+        matrices(())
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('ecosystem_uuid')
+    assert lines[1].split() == [
+        expensive_ecosystem_uuid, '2', '15.0', '3.0', '10', '4', '2', '5', '1.0'
+    ]
+    assert lines[2].split() == [
+        cheap_ecosystem_uuid, '1', '3.0', '1.0', '10', '4', '2', '5', '1.0'
+    ]
@@ -0,0 +1,89 @@
+from numpy import array, dtype
+from pytest import raises
+
+from sparfa_server.orm.binary import (encode_matrix_arrays, decode_matrix_arrays,
+                                      encode_matrix_delta, decode_matrix_delta)
+
+ARRAYS = {
+    'd_data': [1.0, 0.5, 0.0],
+    'W_data': [0.25, 0.75],
+    'W_row': [0, 1],
+    'W_col': [2, 0],
+    'H_mask_data': [True, True, True],
+    'H_mask_row': [0, 1, 1],
+    'H_mask_col': [2, 0, 1]
+}
+
+
+def test_encode_decode_matrix_arrays():
+    data = encode_matrix_arrays(ARRAYS)
+    arrays = decode_matrix_arrays(data)
+
+    assert {key: value.tolist() for key, value in arrays.items()} == ARRAYS
+    # The arrays are views into the data
+    for value in arrays.values():
+        assert not value.flags.owndata
+        assert not value.flags.writeable
+
+
+def test_encode_decode_compressed_matrix_arrays():
+    data = encode_matrix_arrays(ARRAYS, is_compressed=True)
+    arrays = decode_matrix_arrays(data)
+
+    assert {key: value.tolist() for key, value in arrays.items()} == ARRAYS
+
+
+def test_encode_decode_single_precision_matrix_arrays():
+    data = encode_matrix_arrays(ARRAYS, is_single_precision=True)
+    arrays = decode_matrix_arrays(data)
+
+    assert arrays['d_data'].dtype == dtype('<f4')
+    assert arrays['W_data'].dtype == dtype('<f4')
+    assert len(data) < len(encode_matrix_arrays(ARRAYS))
+    assert {key: value.tolist() for key, value in arrays.items()} == ARRAYS
+
+
+def test_encode_decode_empty_matrix_arrays():
+    arrays = decode_matrix_arrays(encode_matrix_arrays({key: [] for key in ARRAYS}))
+
+    assert {key: value.tolist() for key, value in arrays.items()} == {key: [] for key in ARRAYS}
+
+
+def test_decode_invalid_matrix_arrays():
+    with raises(ValueError):
+        decode_matrix_arrays(b'\0' * 64)
+
+    # Unknown flags
+    data = bytearray(encode_matrix_arrays(ARRAYS))
+    data[5] = 4
+    with raises(ValueError):
+        decode_matrix_arrays(bytes(data))
+
+
+def test_encode_decode_matrix_delta():
+    parent_arrays = decode_matrix_arrays(encode_matrix_arrays(ARRAYS))
+    arrays = dict(parent_arrays, d_data=array([1.0, 0.25, 0.125]), W_data=array([0.5, 0.75]))
+
+    data = encode_matrix_delta(arrays, parent_arrays)
+    delta_arrays = decode_matrix_delta(data, parent_arrays)
+
+    assert {key: value.tolist() for key, value in delta_arrays.items()} == \
+        {key: value.tolist() for key, value in arrays.items()}
+
+    # Delta-encoded data cannot be decoded without its parent
+    with raises(ValueError):
+        decode_matrix_arrays(data)
+
+    with raises(ValueError):
+        decode_matrix_delta(encode_matrix_arrays(ARRAYS), parent_arrays)
+
+
+def test_encode_matrix_delta_different_structure():
+    parent_arrays = decode_matrix_arrays(encode_matrix_arrays(ARRAYS))
+
+    assert encode_matrix_delta(
+        dict(parent_arrays, d_data=array([1.0, 0.5])), parent_arrays
+    ) is None
+    assert encode_matrix_delta(
+        dict(parent_arrays, W_row=array([1, 0]), W_col=array([0, 2])), parent_arrays
+    ) is None
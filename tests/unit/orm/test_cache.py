@@ -0,0 +1,103 @@
+from uuid import uuid4
+
+from numpy import array
+
+from sparfa_server.orm import EcosystemMatrix
+from sparfa_server.orm.cache import DecodedEcosystemMatrix, EcosystemMatrixCache
+
+
+def _ecosystem_matrix():
+    return EcosystemMatrix(
+        uuid=uuid4(),
+        ecosystem_uuid=uuid4(),
+        C_ids=[uuid4(), uuid4()],
+        Q_ids=[uuid4(), uuid4(), uuid4()],
+        d_NQx1=array(((1.0,), (0.5,), (0.0,))),
+        W_NCxNQ=array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0))),
+        H_mask_NCxNQ=array(((False, True, True), (True, True, False)))
+    )
+
+
+def test_decoded_ecosystem_matrix():
+    ecosystem_matrix = _ecosystem_matrix()
+    decoded = DecodedEcosystemMatrix(ecosystem_matrix)
+
+    assert decoded.uuid == ecosystem_matrix.uuid
+    assert decoded.ecosystem_uuid == ecosystem_matrix.ecosystem_uuid
+    assert decoded.Q_ids == ecosystem_matrix.Q_ids
+    assert decoded.C_ids == ecosystem_matrix.C_ids
+    assert decoded.Q_idx_by_id == {
+        Q_id: idx for idx, Q_id in enumerate(ecosystem_matrix.Q_ids)
+    }
+    assert decoded.C_idx_by_id == {
+        C_id: idx for idx, C_id in enumerate(ecosystem_matrix.C_ids)
+    }
+    assert (decoded.d_NQx1 == ecosystem_matrix.d_NQx1).all()
+    assert (decoded.W_NCxNQ == ecosystem_matrix.W_NCxNQ).all()
+    assert (decoded.H_mask_NCxNQ == ecosystem_matrix.H_mask_NCxNQ).all()
+    assert decoded.nbytes > 0
+
+
+def test_ecosystem_matrix_cache_get():
+    cache = EcosystemMatrixCache(max_bytes=2**20)
+    ecosystem_matrix = _ecosystem_matrix()
+
+    decoded = cache.get(ecosystem_matrix)
+    assert ecosystem_matrix.uuid in cache
+    assert cache.misses == 1
+    assert cache.hits == 0
+    assert cache.num_bytes == decoded.nbytes
+
+    assert cache.get(ecosystem_matrix) is decoded
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+    cache.discard(ecosystem_matrix.uuid)
+    assert ecosystem_matrix.uuid not in cache
+    assert cache.num_bytes == 0
+
+    assert cache.get(ecosystem_matrix) is not decoded
+    assert cache.misses == 2
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
+    assert cache.hits == 0
+    assert cache.misses == 0
+
+
+def test_ecosystem_matrix_cache_eviction():
+    ecosystem_matrices = [_ecosystem_matrix() for i in range(3)]
+    nbytes = DecodedEcosystemMatrix(ecosystem_matrices[0]).nbytes
+    cache = EcosystemMatrixCache(max_bytes=2 * nbytes)
+
+    cache.get(ecosystem_matrices[0])
+    cache.get(ecosystem_matrices[1])
+    # Makes ecosystem_matrices[0] the most recently used
+    cache.get(ecosystem_matrices[0])
+    cache.get(ecosystem_matrices[2])
+
+    assert len(cache) == 2
+    assert ecosystem_matrices[0].uuid in cache
+    assert ecosystem_matrices[1].uuid not in cache
+    assert ecosystem_matrices[2].uuid in cache
+    assert cache.num_bytes == 2 * nbytes
+
+
+def test_ecosystem_matrix_cache_disabled():
+    cache = EcosystemMatrixCache(max_bytes=0)
+    ecosystem_matrix = _ecosystem_matrix()
+
+    decoded = cache.get(ecosystem_matrix)
+    assert decoded.uuid == ecosystem_matrix.uuid
+    assert ecosystem_matrix.uuid not in cache
+    assert cache.num_bytes == 0
+
+
+def test_ecosystem_matrix_cache_unsaved():
+    cache = EcosystemMatrixCache(max_bytes=2**20)
+    ecosystem_matrix = _ecosystem_matrix()
+    ecosystem_matrix.uuid = None
+
+    cache.get(ecosystem_matrix)
+    assert len(cache) == 0
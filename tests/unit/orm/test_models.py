@@ -1,10 +1,16 @@
 from uuid import uuid4
 from random import choice
-from datetime import datetime
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
 
-from numpy import array
+from numpy import allclose, array, float32
+from scipy.sparse import csr_matrix
+from sqlalchemy import func
 
-from sparfa_server.orm.models import Course, BaseBase, Response, EcosystemMatrix, Page
+from sparfa_server.algs import ResponseColumns
+from sparfa_server.orm.binary import decode_matrix_arrays
+from sparfa_server.orm.models import (Course, BaseBase, Response, EcosystemMatrixPayload,
+                                      EcosystemMatrix, Page, CalculationLease)
 
 
 class TestBaseBase(object):
@@ -33,8 +39,120 @@ class TestResponse(object):
             'responded_at': str(response.responded_at)
         }
 
+    def test_dict_for_algs_from_values(self):
+        student_uuid = uuid4()
+        exercise_uuid = uuid4()
+        is_correct = choice((True, False))
+        responded_at = datetime.now()
+        assert Response.dict_for_algs_from_values(
+            student_uuid=student_uuid,
+            exercise_uuid=exercise_uuid,
+            is_correct=is_correct,
+            responded_at=responded_at
+        ) == Response(
+            student_uuid=student_uuid,
+            exercise_uuid=exercise_uuid,
+            is_correct=is_correct,
+            responded_at=responded_at
+        ).dict_for_algs
+
 
 class TestEcosystemMatrix(object):
+    def test_payload(self):
+        ecosystem_matrix = EcosystemMatrix(uuid=str(uuid4()), ecosystem_uuid=str(uuid4()))
+        assert ecosystem_matrix.payload is None
+        assert ecosystem_matrix.Q_ids is None
+
+        Q_ids = [uuid4(), uuid4()]
+        ecosystem_matrix.Q_ids = Q_ids
+        assert isinstance(ecosystem_matrix.payload, EcosystemMatrixPayload)
+        assert ecosystem_matrix.payload.Q_ids == Q_ids
+        assert ecosystem_matrix.Q_ids == Q_ids
+
+        values = ecosystem_matrix.dict
+        assert values['uuid'] == ecosystem_matrix.uuid
+        assert values['ecosystem_uuid'] == ecosystem_matrix.ecosystem_uuid
+        assert values['Q_ids'] == Q_ids
+        assert set(EcosystemMatrix.PAYLOAD_COLUMNS) <= set(values.keys())
+        assert 'payload' not in values
+
+        assert EcosystemMatrix(**values).Q_ids == Q_ids
+
+    def test_delta_encoded_payload(self):
+        Q_ids = [str(uuid4()), str(uuid4()), str(uuid4())]
+        C_ids = [str(uuid4()), str(uuid4())]
+        h_mask_nc_nq = array(((False, True, True), (True, True, False)))
+
+        with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_STORAGE', 'delta'):
+            previous_ecosystem_matrix = EcosystemMatrix(
+                uuid=str(uuid4()),
+                ecosystem_uuid=str(uuid4()),
+                Q_ids=Q_ids,
+                C_ids=C_ids,
+                d_NQx1=array(((1.0,), (0.5,), (0.0,))),
+                W_NCxNQ=array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0))),
+                H_mask_NCxNQ=h_mask_nc_nq
+            )
+            ecosystem_matrix = EcosystemMatrix(
+                uuid=str(uuid4()),
+                ecosystem_uuid=previous_ecosystem_matrix.ecosystem_uuid,
+                Q_ids=list(Q_ids),
+                C_ids=list(C_ids),
+                d_NQx1=array(((1.0,), (0.5,), (0.25,))),
+                W_NCxNQ=array(((0.0, 0.5, 0.75), (1.0, 0.5, 0.0))),
+                H_mask_NCxNQ=h_mask_nc_nq
+            )
+
+            session = MagicMock()
+            EcosystemMatrix.upsert_values(
+                session, [ecosystem_matrix.dict],
+                previous_ecosystem_matrices=[previous_ecosystem_matrix]
+            )
+
+        (matrix_call, payload_call) = session.upsert_values.call_args_list
+        assert matrix_call[0][0] == EcosystemMatrix
+        assert [values['uuid'] for values in matrix_call[0][1]] == [ecosystem_matrix.uuid]
+        assert not set(EcosystemMatrix.PAYLOAD_COLUMNS) & set(matrix_call[0][1][0].keys())
+
+        assert payload_call[0][0] == EcosystemMatrixPayload
+        (payload_values,) = payload_call[0][1]
+        assert payload_values['uuid'] == ecosystem_matrix.uuid
+        assert payload_values['parent_uuid'] == previous_ecosystem_matrix.uuid
+        assert payload_values['Q_ids'] is None
+        assert payload_values['C_ids'] is None
+        assert payload_values['H_mask_data'] is None
+
+        payload = EcosystemMatrixPayload(**payload_values)
+        payload.parent = previous_ecosystem_matrix.payload
+        delta_encoded_matrix = EcosystemMatrix(
+            uuid=ecosystem_matrix.uuid,
+            ecosystem_uuid=ecosystem_matrix.ecosystem_uuid,
+            payload=payload
+        )
+        assert delta_encoded_matrix.is_delta_encoded
+        assert delta_encoded_matrix.Q_ids == Q_ids
+        assert delta_encoded_matrix.C_ids == C_ids
+        assert (delta_encoded_matrix.d_NQx1 == ecosystem_matrix.d_NQx1).all()
+        assert (delta_encoded_matrix.W_NCxNQ == ecosystem_matrix.W_NCxNQ).all()
+        assert (delta_encoded_matrix.H_mask_NCxNQ == h_mask_nc_nq).all()
+
+        # dict always returns fully materialized matrices
+        materialized_matrix = EcosystemMatrix(**delta_encoded_matrix.dict)
+        assert not materialized_matrix.is_delta_encoded
+        assert materialized_matrix.Q_ids == Q_ids
+        assert (materialized_matrix.W_NCxNQ == ecosystem_matrix.W_NCxNQ).all()
+
+        # Matrices with different structures are not delta-encoded
+        session = MagicMock()
+        with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_STORAGE', 'delta'):
+            EcosystemMatrix.upsert_values(
+                session, [dict(ecosystem_matrix.dict, Q_ids=Q_ids[::-1])],
+                previous_ecosystem_matrices=[previous_ecosystem_matrix]
+            )
+        (payload_values,) = session.upsert_values.call_args_list[1][0][1]
+        assert payload_values['parent_uuid'] is None
+        assert payload_values['Q_ids'] == Q_ids[::-1]
+
     def test_NC(self):
         ecosystem_matrix = EcosystemMatrix(C_ids=[uuid4(), uuid4(), uuid4()])
         assert ecosystem_matrix.NC == len(ecosystem_matrix.C_ids)
@@ -52,6 +170,33 @@ class TestEcosystemMatrix(object):
         )
         assert (ecosystem_matrix.W_NCxNQ == w_ncxnq).all()
 
+    def test_W_NCxNQ_csr(self):
+        w_ncxnq = array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0)))
+        ecosystem_matrix = EcosystemMatrix(
+            C_ids=[uuid4(), uuid4()],
+            Q_ids=[uuid4(), uuid4(), uuid4()],
+            W_NCxNQ=csr_matrix(w_ncxnq)
+        )
+        assert ecosystem_matrix.W_data == [0.5, 1.0, 1.0, 0.5]
+        assert isinstance(ecosystem_matrix.W_NCxNQ_csr, csr_matrix)
+        assert (ecosystem_matrix.W_NCxNQ_csr.toarray() == w_ncxnq).all()
+
+        # Explicit zeros are not stored
+        ecosystem_matrix.W_NCxNQ = csr_matrix(
+            ([0.0, 0.5], ([0, 1], [0, 1])), shape=w_ncxnq.shape
+        )
+        assert ecosystem_matrix.W_data == [0.5]
+
+    def test_H_mask_NCxNQ_csr(self):
+        h_mask_nc_nq = array(((False, True, True), (True, True, False)))
+        ecosystem_matrix = EcosystemMatrix(
+            C_ids=[uuid4(), uuid4()],
+            Q_ids=[uuid4(), uuid4(), uuid4()],
+            H_mask_NCxNQ=csr_matrix(h_mask_nc_nq)
+        )
+        assert isinstance(ecosystem_matrix.H_mask_NCxNQ_csr, csr_matrix)
+        assert (ecosystem_matrix.H_mask_NCxNQ_csr.toarray() == h_mask_nc_nq).all()
+
     def test_H_mask_NCxNQ(self):
         h_mask_nc_nq = array(((False, True, True), (True, True, False)))
         ecosystem_matrix = EcosystemMatrix(
@@ -66,6 +211,146 @@ class TestEcosystemMatrix(object):
         ecosystem_matrix = EcosystemMatrix(d_NQx1=d_nqx1)
         assert (ecosystem_matrix.d_NQx1 == d_nqx1).all()
 
+    def test_matrices(self):
+        w_ncxnq = array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0)))
+        h_mask_nc_nq = array(((False, True, True), (True, True, False)))
+        d_nqx1 = array(((1.0,), (0.5,), (0.0,)))
+
+        with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_STORAGE', 'compressed'):
+            ecosystem_matrix = EcosystemMatrix(
+                C_ids=[uuid4(), uuid4()],
+                Q_ids=[uuid4(), uuid4(), uuid4()],
+                d_NQx1=d_nqx1,
+                W_NCxNQ=w_ncxnq,
+                H_mask_NCxNQ=h_mask_nc_nq
+            )
+
+        with patch(
+            'sparfa_server.orm.models.decode_matrix_arrays', wraps=decode_matrix_arrays
+        ) as decode:
+            matrices = ecosystem_matrix.matrices
+
+        # The data is only decoded once for all of the matrices
+        decode.assert_called_once_with(ecosystem_matrix.data)
+        assert matrices['arrays']['W_data'].tolist() == [0.5, 1.0, 1.0, 0.5]
+        assert isinstance(matrices['W_NCxNQ_csr'], csr_matrix)
+        assert (matrices['W_NCxNQ_csr'].toarray() == w_ncxnq).all()
+        assert isinstance(matrices['H_mask_NCxNQ_csr'], csr_matrix)
+        assert (matrices['H_mask_NCxNQ_csr'].toarray() == h_mask_nc_nq).all()
+        assert (matrices['d_NQx1'] == d_nqx1).all()
+
+    def test_binary_storage(self):
+        w_ncxnq = array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0)))
+        h_mask_nc_nq = array(((False, True, True), (True, True, False)))
+        d_nqx1 = array(((1.0,), (0.5,), (0.0,)))
+
+        for storage in ('binary', 'compressed'):
+            with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_STORAGE', storage):
+                ecosystem_matrix = EcosystemMatrix(
+                    C_ids=[uuid4(), uuid4()],
+                    Q_ids=[uuid4(), uuid4(), uuid4()],
+                    d_NQx1=d_nqx1,
+                    W_NCxNQ=w_ncxnq,
+                    H_mask_NCxNQ=h_mask_nc_nq
+                )
+
+            assert ecosystem_matrix.data is not None
+            assert ecosystem_matrix.d_data is None
+            assert ecosystem_matrix.W_data is None
+            assert ecosystem_matrix.H_mask_data is None
+            assert (ecosystem_matrix.d_NQx1 == d_nqx1).all()
+            assert (ecosystem_matrix.W_NCxNQ == w_ncxnq).all()
+            assert (ecosystem_matrix.H_mask_NCxNQ == h_mask_nc_nq).all()
+
+            decoded_dict = ecosystem_matrix.decoded_dict
+            assert 'data' not in decoded_dict
+            assert decoded_dict['d_data'] == [1.0, 0.5, 0.0]
+            assert decoded_dict['W_data'] == [0.5, 1.0, 1.0, 0.5]
+            assert decoded_dict['W_row'] == [0, 0, 1, 1]
+            assert decoded_dict['W_col'] == [1, 2, 0, 1]
+            assert decoded_dict['H_mask_data'] == [True, True, True, True]
+
+    def test_single_precision(self):
+        w_ncxnq = array(((0.0, 0.1, 1.0), (1.0, 0.1, 0.0)))
+        h_mask_nc_nq = array(((False, True, True), (True, True, False)))
+        d_nqx1 = array(((1.0,), (0.1,), (0.0,)))
+
+        for storage in ('arrays', 'binary', 'compressed'):
+            with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_STORAGE', storage), \
+                    patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_PRECISION', 'single'):
+                ecosystem_matrix = EcosystemMatrix(
+                    uuid=str(uuid4()),
+                    C_ids=[uuid4(), uuid4()],
+                    Q_ids=[uuid4(), uuid4(), uuid4()],
+                    d_NQx1=d_nqx1,
+                    W_NCxNQ=w_ncxnq,
+                    H_mask_NCxNQ=h_mask_nc_nq
+                )
+
+                assert ecosystem_matrix.d_NQx1.dtype == float32
+                assert ecosystem_matrix.W_NCxNQ.dtype == float32
+                assert allclose(ecosystem_matrix.d_NQx1, d_nqx1)
+                assert allclose(ecosystem_matrix.W_NCxNQ, w_ncxnq)
+                assert (ecosystem_matrix.H_mask_NCxNQ == h_mask_nc_nq).all()
+
+                decoded_dict = ecosystem_matrix.decoded_dict
+                assert decoded_dict['d_data'] == [1.0, 0.1, 0.0]
+                assert decoded_dict['W_data'] == [0.1, 1.0, 1.0, 0.1]
+
+    def test_single_precision_tesr_and_clue_interval(self):
+        ecosystem_uuid = uuid4()
+
+        pages = [Page(uuid=uuid4(), exercise_uuids=[uuid4() for i in range(5)])
+                 for j in range(3)]
+        exercise_uuids = [exercise_uuid for page in pages for exercise_uuid in page.exercise_uuids]
+        student_uuids = [uuid4() for i in range(10)]
+        responses = [Response(
+            student_uuid=student_uuid,
+            exercise_uuid=exercise_uuid,
+            is_correct=(i + j) % 3 != 0,
+            responded_at=datetime.now()
+        ) for i, student_uuid in enumerate(student_uuids)
+            for j, exercise_uuid in enumerate(exercise_uuids)]
+
+        double_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+            ecosystem_uuid=ecosystem_uuid, pages=pages, responses=responses
+        )
+        with patch('sparfa_server.orm.models.ECOSYSTEM_MATRIX_PRECISION', 'single'):
+            single_matrix = EcosystemMatrix(
+                uuid=str(uuid4()),
+                ecosystem_uuid=ecosystem_uuid,
+                Q_ids=double_matrix.Q_ids,
+                C_ids=double_matrix.C_ids,
+                d_NQx1=double_matrix.d_NQx1,
+                W_NCxNQ=double_matrix.W_NCxNQ,
+                H_mask_NCxNQ=double_matrix.H_mask_NCxNQ
+            )
+            assert single_matrix.W_NCxNQ.dtype == float32
+
+        target_student_uuid = student_uuids[0]
+        target_responses = [response for response in responses
+                            if response.student_uuid == target_student_uuid][:5]
+        target_response_dicts = [response.dict_for_algs for response in target_responses]
+
+        orderings = []
+        clue_intervals = []
+        for ecosystem_matrix in (double_matrix, single_matrix):
+            algs = ecosystem_matrix.to_sparfa_algs_with_student_uuids_responses(
+                student_uuids=[target_student_uuid], responses=target_responses
+            )
+            orderings.append([info.Q_id for info in algs.tesr(
+                target_L_id=target_student_uuid,
+                target_Q_ids=exercise_uuids,
+                target_responses=target_response_dicts
+            )])
+            clue_intervals.append(algs.calc_clue_interval(
+                confidence=.5, target_L_ids=[target_student_uuid], target_Q_ids=exercise_uuids
+            ))
+
+        assert orderings[1] == orderings[0]
+        assert clue_intervals[1][3] == clue_intervals[0][3]
+        assert allclose(clue_intervals[1][:3], clue_intervals[0][:3], atol=1e-4)
+
     def test_response_dicts_for_algs_from_responses(self):
         responses = [Response(
             student_uuid=uuid4(),
@@ -79,6 +364,9 @@ class TestEcosystemMatrix(object):
         assert EcosystemMatrix._response_dicts_for_algs_from_responses(
             response_dicts
         ) == response_dicts
+        assert EcosystemMatrix._response_dicts_for_algs_from_responses(
+            ResponseColumns.from_dicts_for_algs(response_dicts)
+        ) == response_dicts
 
     def test_from_ecosystem_uuid_pages_responses(self):
         ecosystem_uuid = uuid4()
@@ -109,6 +397,154 @@ class TestEcosystemMatrix(object):
         assert ecosystem_matrix.W_NCxNQ.shape == (NC, NQ)
         assert ecosystem_matrix.H_mask_NCxNQ.shape == (NC, NQ)
 
+    def test_has_same_structure(self):
+        page_uuids = [str(uuid4()), str(uuid4())]
+        exercise_uuids = [str(uuid4()), str(uuid4())]
+        hints = [{'Q_id': exercise_uuids[0], 'C_id': page_uuids[0]},
+                 {'Q_id': exercise_uuids[1], 'C_id': page_uuids[1]}]
+        ecosystem_matrix = EcosystemMatrix(
+            C_ids=page_uuids,
+            Q_ids=exercise_uuids,
+            H_mask_NCxNQ=array(((True, False), (False, True)))
+        )
+
+        assert ecosystem_matrix.has_same_structure(C_ids=page_uuids, hints=hints)
+        assert ecosystem_matrix.has_same_structure(C_ids=page_uuids[::-1], hints=hints[::-1])
+        assert not ecosystem_matrix.has_same_structure(
+            C_ids=page_uuids + [str(uuid4())], hints=hints
+        )
+        assert not ecosystem_matrix.has_same_structure(C_ids=page_uuids, hints=hints[:1])
+        assert not ecosystem_matrix.has_same_structure(
+            C_ids=page_uuids, hints=[{'Q_id': exercise_uuids[0], 'C_id': page_uuids[1]},
+                                     {'Q_id': exercise_uuids[1], 'C_id': page_uuids[0]}]
+        )
+
+    def test_can_warm_start(self):
+        page_uuids = [str(uuid4())]
+        exercise_uuids = [str(uuid4())]
+        hints = [{'Q_id': exercise_uuids[0], 'C_id': page_uuids[0]}]
+        ecosystem_matrix = EcosystemMatrix(
+            num_responses=10,
+            C_ids=page_uuids,
+            Q_ids=exercise_uuids,
+            H_mask_NCxNQ=array(((True,),))
+        )
+
+        assert ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=10)
+        assert ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=19)
+        assert not ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=0)
+        assert not ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=20)
+        assert not ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=[], num_responses=10)
+
+        ecosystem_matrix.num_responses = 0
+        assert not ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=1)
+
+        # Refined matrices are compared to the number of responses of the last cold start
+        ecosystem_matrix.num_responses = 15
+        ecosystem_matrix.cold_start_num_responses = 10
+        assert ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=19)
+        assert not ecosystem_matrix.can_warm_start(C_ids=page_uuids, hints=hints, num_responses=20)
+
+    def test_pages_hash_from_pages(self):
+        pages = [Page(uuid=str(uuid4()), exercise_uuids=[str(uuid4()), str(uuid4())])
+                 for i in range(2)]
+        pages_hash = EcosystemMatrix.pages_hash_from_pages(pages)
+
+        assert EcosystemMatrix.pages_hash_from_pages(pages[::-1]) == pages_hash
+        assert EcosystemMatrix.pages_hash_from_pages(
+            [page.dict for page in pages]
+        ) == pages_hash
+        assert EcosystemMatrix.pages_hash_from_pages(pages[:1]) != pages_hash
+        assert EcosystemMatrix.pages_hash_from_pages([
+            pages[0], Page(uuid=pages[1].uuid, exercise_uuids=pages[1].exercise_uuids[:1])
+        ]) != pages_hash
+
+    def test_has_same_inputs(self):
+        ecosystem_matrix = EcosystemMatrix(
+            num_responses=10,
+            responses_watermark=100,
+            pages_hash='hash'
+        )
+
+        assert ecosystem_matrix.has_same_inputs(
+            num_responses=10, last_response_transaction_id=99, pages_hash='hash'
+        )
+        # Responses saved before transaction ids were recorded
+        assert ecosystem_matrix.has_same_inputs(
+            num_responses=10, last_response_transaction_id=None, pages_hash='hash'
+        )
+        assert not ecosystem_matrix.has_same_inputs(
+            num_responses=11, last_response_transaction_id=99, pages_hash='hash'
+        )
+        # Might not have been committed yet when the matrix's responses were read
+        assert not ecosystem_matrix.has_same_inputs(
+            num_responses=10, last_response_transaction_id=100, pages_hash='hash'
+        )
+        assert not ecosystem_matrix.has_same_inputs(
+            num_responses=10, last_response_transaction_id=99, pages_hash='new'
+        )
+        assert not EcosystemMatrix().has_same_inputs(
+            num_responses=0, last_response_transaction_id=None, pages_hash='hash'
+        )
+
+    def test_from_ecosystem_uuid_pages_responses_warm_start(self):
+        ecosystem_uuid = uuid4()
+
+        page_uuids = [uuid4(), uuid4()]
+        pages = [Page(uuid=uuid, exercise_uuids=[uuid4(), uuid4()]) for uuid in page_uuids]
+
+        exercise_uuids = [exercise_uuid for page in pages for exercise_uuid in page.exercise_uuids]
+
+        student_uuids = [uuid4(), uuid4()]
+        responses = [Response(
+            student_uuid=student_uuid,
+            exercise_uuid=exercise_uuid,
+            is_correct=choice((True, False)),
+            responded_at=datetime.now()
+        ) for student_uuid in student_uuids for exercise_uuid in exercise_uuids]
+
+        previous_ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+            ecosystem_uuid=ecosystem_uuid, pages=pages, responses=responses[:-1]
+        )
+        assert previous_ecosystem_matrix.num_responses == len(responses) - 1
+        assert previous_ecosystem_matrix.cold_start_num_responses == len(responses) - 1
+
+        with patch(
+            'sparfa_server.orm.models.SparfaAlgs.from_Ls_Qs_Cs_Hs_Rs', autospec=True
+        ) as from_Ls_Qs_Cs_Hs_Rs:
+            ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+                ecosystem_uuid=ecosystem_uuid,
+                pages=pages,
+                responses=responses,
+                previous_ecosystem_matrix=previous_ecosystem_matrix,
+                warm_start_epochs=5
+            )
+
+        from_Ls_Qs_Cs_Hs_Rs.assert_not_called()
+        assert ecosystem_matrix.uuid != previous_ecosystem_matrix.uuid
+        assert ecosystem_matrix.ecosystem_uuid == ecosystem_uuid
+        assert ecosystem_matrix.num_responses == len(responses)
+        # The refined matrix keeps the number of responses of the last cold start
+        assert ecosystem_matrix.cold_start_num_responses == len(responses) - 1
+        assert set(ecosystem_matrix.Q_ids) == set(previous_ecosystem_matrix.Q_ids)
+        assert set(ecosystem_matrix.C_ids) == set(previous_ecosystem_matrix.C_ids)
+        assert ecosystem_matrix.d_NQx1.shape == previous_ecosystem_matrix.d_NQx1.shape
+        assert ecosystem_matrix.W_NCxNQ.shape == previous_ecosystem_matrix.W_NCxNQ.shape
+        assert (ecosystem_matrix.H_mask_NCxNQ == previous_ecosystem_matrix.H_mask_NCxNQ).all()
+
+        new_page = Page(uuid=uuid4(), exercise_uuids=[uuid4()])
+        ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+            ecosystem_uuid=ecosystem_uuid,
+            pages=pages + [new_page],
+            responses=responses,
+            previous_ecosystem_matrix=previous_ecosystem_matrix,
+            warm_start_epochs=5
+        )
+
+        # Structure changed, so this was a cold start
+        assert set(ecosystem_matrix.C_ids) == set(page_uuids + [new_page.uuid])
+        assert ecosystem_matrix.num_responses == len(responses)
+
     def test_to_sparfa_algs_with_student_uuids_responses(self):
         ecosystem_uuid = uuid4()
 
@@ -145,3 +581,62 @@ class TestEcosystemMatrix(object):
         assert (algs.d_NQx1 == ecosystem_matrix.d_NQx1).all()
         assert (algs.W_NCxNQ == ecosystem_matrix.W_NCxNQ).all()
         assert (algs.H_mask_NCxNQ == ecosystem_matrix.H_mask_NCxNQ).all()
+
+
+class TestCalculationLease(object):
+    def test_claim_release(self, transaction):
+        calculation_uuids = [str(uuid4()) for i in range(3)]
+        duration = timedelta(minutes=5)
+
+        with transaction() as session:
+            assert CalculationLease.claim(session, [], duration) == set()
+            assert CalculationLease.claim(
+                session, calculation_uuids[:2], duration
+            ) == set(calculation_uuids[:2])
+
+        # Calculations that are already claimed are skipped
+        with transaction() as session:
+            assert CalculationLease.claim(
+                session, calculation_uuids, duration
+            ) == set(calculation_uuids[2:])
+
+        # Expired leases can be claimed again
+        with transaction() as session:
+            session.query(CalculationLease).filter(
+                CalculationLease.uuid == calculation_uuids[0]
+            ).update({CalculationLease.expires_at: func.now()}, synchronize_session=False)
+
+        with transaction() as session:
+            assert CalculationLease.claim(
+                session, calculation_uuids, duration
+            ) == set(calculation_uuids[:1])
+
+            CalculationLease.release(session, calculation_uuids[1:])
+
+        with transaction() as session:
+            assert CalculationLease.claim(
+                session, calculation_uuids, duration
+            ) == set(calculation_uuids[1:])
+
+    def test_extend(self, transaction):
+        calculation_uuids = [str(uuid4()) for i in range(3)]
+        duration = timedelta(minutes=5)
+
+        with transaction() as session:
+            assert CalculationLease.extend(session, [], duration) == set()
+            CalculationLease.claim(session, calculation_uuids[:2], duration)
+            session.query(CalculationLease).update(
+                {CalculationLease.expires_at: func.now()}, synchronize_session=False
+            )
+
+        # Only existing leases are extended
+        with transaction() as session:
+            assert CalculationLease.extend(
+                session, calculation_uuids, duration
+            ) == set(calculation_uuids[:2])
+
+        # Extended leases are no longer expired
+        with transaction() as session:
+            assert CalculationLease.claim(
+                session, calculation_uuids, duration
+            ) == set(calculation_uuids[2:])
@@ -73,6 +73,9 @@ class TestBiglearnSession(object):
             else:
                 assert course.sequence_number == 2
         assert set(course.metadata_sequence_number for course in courses) == set((0, 1))
+        # Updated rows also have their updated_at updated
+        for course in courses:
+            assert course.updated_at > course.created_at
 
     def test_upsert_models(self):
         course_1 = Course(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=0)
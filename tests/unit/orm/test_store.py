@@ -0,0 +1,122 @@
+from os import listdir, path, utime
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from uuid import uuid4
+
+from numpy import array
+
+from sparfa_server.orm import EcosystemMatrix
+from sparfa_server.orm.binary import encode_matrix_arrays
+from sparfa_server.orm.cache import BYTES_PER_ID, DecodedEcosystemMatrix
+from sparfa_server.orm.store import EcosystemMatrixStore
+
+
+def _ecosystem_matrix():
+    return EcosystemMatrix(
+        uuid=str(uuid4()),
+        C_ids=[uuid4(), uuid4()],
+        Q_ids=[uuid4(), uuid4(), uuid4()],
+        d_NQx1=array(((1.0,), (0.5,), (0.0,))),
+        W_NCxNQ=array(((0.0, 0.5, 1.0), (1.0, 0.5, 0.0))),
+        H_mask_NCxNQ=array(((False, True, True), (True, True, False)))
+    )
+
+
+def _shape(ecosystem_matrix):
+    return len(ecosystem_matrix.C_ids), len(ecosystem_matrix.Q_ids)
+
+
+def _add(store, ecosystem_matrix):
+    store.add(ecosystem_matrix.uuid, ecosystem_matrix.arrays, _shape(ecosystem_matrix))
+
+
+def test_ecosystem_matrix_store():
+    ecosystem_matrix = _ecosystem_matrix()
+
+    with TemporaryDirectory() as directory:
+        store = EcosystemMatrixStore(directory)
+        assert ecosystem_matrix.uuid not in store
+        assert store.get(ecosystem_matrix.uuid) is None
+
+        _add(store, ecosystem_matrix)
+        assert ecosystem_matrix.uuid in store
+        assert listdir(directory) == [ecosystem_matrix.uuid + '.spfa']
+
+        stored_arrays, W_NCxNQ, H_mask_NCxNQ = store.get(ecosystem_matrix.uuid)
+        assert {key: value.tolist() for key, value in stored_arrays.items()} == {
+            key: value.tolist() for key, value in ecosystem_matrix.arrays.items()
+        }
+        assert W_NCxNQ.tolist() == ecosystem_matrix.W_NCxNQ.tolist()
+        assert H_mask_NCxNQ.tolist() == ecosystem_matrix.H_mask_NCxNQ.tolist()
+        for value in list(stored_arrays.values()) + [W_NCxNQ, H_mask_NCxNQ]:
+            assert not value.flags.writeable
+
+        store.discard(ecosystem_matrix.uuid)
+        assert ecosystem_matrix.uuid not in store
+        assert listdir(directory) == []
+        # Discarding a matrix that is not in the store does nothing
+        store.discard(ecosystem_matrix.uuid)
+
+        # Files written by older versions are discarded, so they can be replaced
+        with open(path.join(directory, ecosystem_matrix.uuid + '.spfa'), 'wb') as file:
+            file.write(encode_matrix_arrays(ecosystem_matrix.arrays))
+        assert store.get(ecosystem_matrix.uuid) is None
+        assert ecosystem_matrix.uuid not in store
+
+
+def test_decoded_ecosystem_matrix_store():
+    ecosystem_matrix = _ecosystem_matrix()
+
+    with TemporaryDirectory() as directory:
+        store = EcosystemMatrixStore(directory)
+        with patch('sparfa_server.orm.cache.ECOSYSTEM_MATRIX_STORE', None):
+            decoded = DecodedEcosystemMatrix(ecosystem_matrix)
+
+        # The dense matrices are built in process memory without the store, so they are counted
+        assert decoded.nbytes >= decoded.W_NCxNQ.nbytes + decoded.H_mask_NCxNQ.nbytes + \
+            2 * BYTES_PER_ID * (len(decoded.Q_ids) + len(decoded.C_ids))
+
+        with patch('sparfa_server.orm.cache.ECOSYSTEM_MATRIX_STORE', store):
+            # The matrix is mapped from the store as soon as it is added to it
+            for stored_decoded in (DecodedEcosystemMatrix(ecosystem_matrix),
+                                   DecodedEcosystemMatrix(ecosystem_matrix)):
+                assert ecosystem_matrix.uuid in store
+                assert not stored_decoded.arrays['W_data'].flags.writeable
+                assert not stored_decoded.W_NCxNQ.flags.writeable
+                assert not stored_decoded.H_mask_NCxNQ.flags.writeable
+                assert (stored_decoded.d_NQx1 == ecosystem_matrix.d_NQx1).all()
+                assert (stored_decoded.W_NCxNQ == ecosystem_matrix.W_NCxNQ).all()
+                assert (stored_decoded.H_mask_NCxNQ == ecosystem_matrix.H_mask_NCxNQ).all()
+                # All of the arrays are in the OS page cache, only the ids are in process memory
+                assert stored_decoded.nbytes == \
+                    2 * BYTES_PER_ID * (len(stored_decoded.Q_ids) + len(stored_decoded.C_ids))
+
+
+def test_ecosystem_matrix_store_eviction():
+    ecosystem_matrices = [_ecosystem_matrix() for ii in range(3)]
+
+    with TemporaryDirectory() as directory:
+        store = EcosystemMatrixStore(directory)
+        _add(store, ecosystem_matrices[0])
+        num_bytes = path.getsize(path.join(directory, listdir(directory)[0]))
+        store.max_bytes = 2 * num_bytes
+
+        # Make ecosystem_matrices[0] the least recently used
+        utime(path.join(directory, ecosystem_matrices[0].uuid + '.spfa'), (0, 0))
+        _add(store, ecosystem_matrices[1])
+        assert ecosystem_matrices[0].uuid in store
+        assert ecosystem_matrices[1].uuid in store
+
+        _add(store, ecosystem_matrices[2])
+        assert ecosystem_matrices[0].uuid not in store
+        assert ecosystem_matrices[1].uuid in store
+        assert ecosystem_matrices[2].uuid in store
+
+        # Reading a matrix makes it the most recently used
+        utime(path.join(directory, ecosystem_matrices[1].uuid + '.spfa'), (0, 0))
+        assert store.get(ecosystem_matrices[1].uuid) is not None
+        utime(path.join(directory, ecosystem_matrices[2].uuid + '.spfa'), (1, 1))
+        _add(store, ecosystem_matrices[0])
+        assert ecosystem_matrices[0].uuid in store
+        assert ecosystem_matrices[1].uuid in store
+        assert ecosystem_matrices[2].uuid not in store
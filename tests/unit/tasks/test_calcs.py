@@ -1,17 +1,22 @@
-from uuid import uuid4, UUID
+from uuid import uuid4
 from random import choice, shuffle
-from datetime import datetime
-from unittest.mock import patch
-from contextlib import closing
+from datetime import datetime, timedelta
+from threading import Event, current_thread
+from unittest.mock import MagicMock, patch
 
+from numpy import array
+from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql.expression import func
 
-from sparfa_server.orm.sessions import ENGINE
-from sparfa_server.orm import Ecosystem, Page, Response, EcosystemMatrix
+from sparfa_server.orm import (Ecosystem, Page, Response, EcosystemMatrix,
+                               EcosystemMatrixStats, CalculationLease)
+from sparfa_server.orm.cache import DecodedEcosystemMatrix
+from sparfa_server.orm.sessions import ENGINE, BiglearnSession
 from sparfa_server.tasks.calcs import (calculate_ecosystem_matrices,
                                        calculate_exercises,
-                                       calculate_clues)
+                                       calculate_clues,
+                                       _map_ecosystem_calculations,
+                                       _process_calculations)
 
 
 def test_calculate_ecosystem_matrices(transaction):
@@ -194,17 +199,27 @@ def test_calculate_exercises(transaction):
         with patch(
             'sparfa_server.tasks.calcs.BLSCHED.update_exercise_calculations', autospec=True
         ) as update_exercise_calculations:
-            with closing(sessionmaker(bind=ENGINE)()) as session:
-                query = [func.pg_try_advisory_xact_lock(
-                    (UUID(calculation['calculation_uuid']).int >> 64) - 2**63
-                ) for calculation in exercise_calculations]
-                session.query(*query).one()
-                calculate_exercises()
+            # Calculations claimed by other workers are skipped
+            with transaction() as session:
+                lease = CalculationLease(
+                    uuid=calculation_uuid, expires_at=datetime.now() + timedelta(minutes=5)
+                )
+                session.add(lease)
+
+            calculate_exercises()
+
+            # Expired leases can be claimed again
+            with transaction() as session:
+                lease.expires_at = func.now()
 
             calculate_exercises()
 
     update_exercise_calculations.assert_not_called()
 
+    # Calculations that were not updated are released immediately
+    with transaction() as session:
+        assert session.query(CalculationLease).count() == 0
+
     ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
         ecosystem_uuid=ecosystem.uuid, pages=pages, responses=responses
     )
@@ -242,6 +257,99 @@ def test_calculate_exercises(transaction):
     assert set(exercise_calculation['exercise_uuids']) == set(exercise_uuids)
     assert exercise_calculation['exercise_uuids'][-1] == unknown_exercise_uuid
 
+    # Calculations are released after their update is acknowledged
+    with transaction() as session:
+        assert session.query(CalculationLease).count() == 0
+
+    # Unchanged calculations reuse the cached ordering without building the algs
+    with patch(
+        'sparfa_server.tasks.calcs.BLSCHED.fetch_exercise_calculations', autospec=True
+    ) as fetch_exercise_calculations:
+        fetch_exercise_calculations.side_effect = [[{
+            'calculation_uuid': str(uuid4()),
+            'ecosystem_uuid': ecosystem.uuid,
+            'student_uuid': student_uuid,
+            'exercise_uuids': exercise_uuids
+        }], []]
+
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.update_exercise_calculations', autospec=True
+        ) as update_exercise_calculations:
+            with patch.object(
+                EcosystemMatrix, 'decoded_to_sparfa_algs_with_student_uuids_responses'
+            ) as decoded_to_sparfa_algs_with_student_uuids_responses:
+                calculate_exercises()
+
+    decoded_to_sparfa_algs_with_student_uuids_responses.assert_not_called()
+    update_exercise_calculations.assert_called_once()
+    cached_exercise_calculation = update_exercise_calculations.call_args[0][0][0]
+    assert cached_exercise_calculation['exercise_uuids'] == exercise_calculation['exercise_uuids']
+
+
+def test_calculate_exercises_same_student(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    page_1 = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                  exercise_uuids=[str(uuid4()), str(uuid4())])
+    page_2 = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                  exercise_uuids=[str(uuid4()), str(uuid4())])
+    pages = [page_1, page_2]
+
+    student_uuid = str(uuid4())
+    responses = [Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=student_uuid,
+        exercise_uuid=page.exercise_uuids[0],
+        is_correct=choice((True, False)),
+        is_real_response=True,
+        responded_at=datetime.now()
+    ) for page in pages]
+
+    ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+        ecosystem_uuid=ecosystem.uuid, pages=pages, responses=responses
+    )
+
+    with transaction() as session:
+        session.add(ecosystem)
+        session.add(page_1)
+        session.add(page_2)
+        session.add_all(responses)
+        session.add(ecosystem_matrix)
+
+    exercise_calculations = [{
+        'calculation_uuid': str(uuid4()),
+        'ecosystem_uuid': ecosystem.uuid,
+        'student_uuid': student_uuid,
+        'exercise_uuids': page.exercise_uuids
+    } for page in pages]
+
+    with patch(
+        'sparfa_server.tasks.calcs.BLSCHED.fetch_exercise_calculations', autospec=True
+    ) as fetch_exercise_calculations:
+        fetch_exercise_calculations.side_effect = [exercise_calculations, []]
+
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.update_exercise_calculations', autospec=True
+        ) as update_exercise_calculations:
+            with patch.object(
+                EcosystemMatrix, 'decoded_to_sparfa_algs_with_student_uuids_responses',
+                side_effect=EcosystemMatrix.decoded_to_sparfa_algs_with_student_uuids_responses
+            ) as decoded_to_sparfa_algs_with_student_uuids_responses:
+                calculate_exercises()
+
+    update_exercise_calculations.assert_called_once()
+    assert [set(request['exercise_uuids'])
+            for request in update_exercise_calculations.call_args[0][0]] == \
+        [set(page.exercise_uuids) for page in pages]
+
+    # Each calculation's ordering only depends on the student's responses to its own exercises
+    assert [
+        [response['Q_id'] for response in call[1]['responses']]
+        for call in decoded_to_sparfa_algs_with_student_uuids_responses.call_args_list
+    ] == [[response.exercise_uuid] for response in responses]
+
 
 def test_calculate_clues(transaction):
     course_uuid = str(uuid4())
@@ -355,3 +463,662 @@ def test_calculate_clues(transaction):
     assert clue_data['minimum'] <= clue_data['most_likely'] <= clue_data['maximum']
     assert clue_data['is_real']
     assert clue_data['ecosystem_uuid'] == ecosystem.uuid
+
+
+def test_calculate_ecosystem_matrices_warm_start(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+
+    page_1 = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                  exercise_uuids=[str(uuid4()), str(uuid4())])
+    page_2 = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                  exercise_uuids=[str(uuid4()), str(uuid4())])
+    pages = [page_1, page_2]
+    exercise_uuids = [exercise_uuid for page in pages for exercise_uuid in page.exercise_uuids]
+
+    old_responses = [Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=str(uuid4()),
+        exercise_uuid=exercise_uuid,
+        is_correct=choice((True, False)),
+        is_real_response=True,
+        responded_at=datetime.now(),
+        # Saved by a transaction committed before the previous matrix was calculated
+        transaction_id=1
+    ) for exercise_uuid in exercise_uuids]
+    new_response = Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=str(uuid4()),
+        exercise_uuid=exercise_uuids[0],
+        is_correct=choice((True, False)),
+        is_real_response=True,
+        responded_at=datetime.now()
+    )
+
+    previous_ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+        ecosystem_uuid=ecosystem.uuid, pages=pages, responses=old_responses
+    )
+    previous_ecosystem_matrix.responses_watermark = 2
+
+    with transaction() as session:
+        session.add(ecosystem)
+        session.add(page_1)
+        session.add(page_2)
+        session.add(previous_ecosystem_matrix)
+        for response in old_responses:
+            session.add(response)
+        session.add(new_response)
+
+    calculation_uuid = str(uuid4())
+    with patch('sparfa_server.tasks.calcs.ECOSYSTEM_MATRIX_WARM_START_EPOCHS', 5):
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+        ) as fetch_ecosystem_matrix_updates:
+            fetch_ecosystem_matrix_updates.side_effect = [[{
+                'calculation_uuid': calculation_uuid, 'ecosystem_uuid': ecosystem.uuid
+            }], []]
+
+            with patch(
+                'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+            ) as ecosystem_matrices_updated:
+                with patch(
+                    'sparfa_server.orm.models.SparfaAlgs.from_Ls_Qs_Cs_Hs_Rs', autospec=True
+                ) as from_Ls_Qs_Cs_Hs_Rs:
+                    calculate_ecosystem_matrices()
+
+    from_Ls_Qs_Cs_Hs_Rs.assert_not_called()
+    ecosystem_matrices_updated.assert_called_once_with([{'calculation_uuid': calculation_uuid}])
+
+    with transaction() as session:
+        new_ecosystem_matrix = session.query(EcosystemMatrix).filter(
+            EcosystemMatrix.ecosystem_uuid == ecosystem.uuid,
+            EcosystemMatrix.superseded_at.is_(None)
+        ).one()
+        stats = session.query(EcosystemMatrixStats).filter(
+            EcosystemMatrixStats.ecosystem_uuid == ecosystem.uuid
+        ).one()
+
+    assert new_ecosystem_matrix.uuid != previous_ecosystem_matrix.uuid
+    assert new_ecosystem_matrix.num_responses == len(old_responses) + 1
+    assert stats.is_delta
+    assert stats.num_responses == len(old_responses) + 1
+    assert stats.num_loaded_responses == 1
+    assert 2 <= new_ecosystem_matrix.responses_watermark <= new_response.transaction_id
+    assert set(new_ecosystem_matrix.Q_ids) == set(exercise_uuids)
+    assert set(new_ecosystem_matrix.C_ids) == set(page.uuid for page in pages)
+
+
+def test_calculate_ecosystem_matrices_processes(transaction):
+    ecosystems = [Ecosystem(
+        uuid=str(uuid4()), metadata_sequence_number=i, sequence_number=1
+    ) for i in range(2)]
+
+    pages = [Page(
+        uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        exercise_uuids=[str(uuid4()), str(uuid4())]
+    ) for ecosystem in ecosystems]
+
+    responses = [Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=page.ecosystem_uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=str(uuid4()),
+        exercise_uuid=exercise_uuid,
+        is_correct=choice((True, False)),
+        is_real_response=True,
+        responded_at=datetime.now()
+    ) for page in pages for exercise_uuid in page.exercise_uuids]
+
+    with transaction() as session:
+        for model in ecosystems + pages + responses:
+            session.add(model)
+
+    ecosystem_matrix_updates = [{
+        'calculation_uuid': str(uuid4()), 'ecosystem_uuid': ecosystem.uuid
+    } for ecosystem in ecosystems]
+
+    with patch('sparfa_server.tasks.calcs.NUM_ECOSYSTEM_MATRIX_PROCESSES', 2):
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+        ) as fetch_ecosystem_matrix_updates:
+            fetch_ecosystem_matrix_updates.side_effect = [ecosystem_matrix_updates, []]
+
+            with patch(
+                'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+            ) as ecosystem_matrices_updated:
+                calculate_ecosystem_matrices()
+
+    # All calculations are reported at once
+    ecosystem_matrices_updated.assert_called_once()
+    args = ecosystem_matrices_updated.call_args
+    assert sorted(args[0][0], key=lambda request: request['calculation_uuid']) == sorted(
+        [{'calculation_uuid': update['calculation_uuid']} for update in ecosystem_matrix_updates],
+        key=lambda request: request['calculation_uuid']
+    )
+
+    with transaction() as session:
+        for ecosystem, page in zip(ecosystems, pages):
+            ecosystem_matrix = session.query(EcosystemMatrix).filter(
+                EcosystemMatrix.ecosystem_uuid == ecosystem.uuid
+            ).one()
+
+            assert ecosystem_matrix.C_ids == [page.uuid]
+            assert set(ecosystem_matrix.Q_ids) == set(page.exercise_uuids)
+            assert ecosystem_matrix.num_responses == len(page.exercise_uuids)
+
+            stats = session.query(EcosystemMatrixStats).filter(
+                EcosystemMatrixStats.ecosystem_uuid == ecosystem.uuid
+            ).one()
+
+            assert stats.ecosystem_matrix_uuid == ecosystem_matrix.uuid
+            assert not stats.is_delta
+            assert stats.num_responses == len(page.exercise_uuids)
+            assert stats.num_loaded_responses == len(page.exercise_uuids)
+            assert stats.num_students == len(page.exercise_uuids)
+            assert stats.num_exercises == len(page.exercise_uuids)
+            assert stats.num_concepts == 1
+            assert stats.load_seconds >= 0
+            assert stats.calculation_seconds >= 0
+            assert stats.save_seconds >= 0
+            assert stats.peak_rss_kb > 0
+
+
+def test_calculate_ecosystem_matrices_concurrent_calculation(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    page = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                exercise_uuids=[str(uuid4()), str(uuid4())])
+
+    with transaction() as session:
+        session.add(ecosystem)
+        session.add(page)
+
+    calculation_uuid = str(uuid4())
+    newer_calculation_uuid = str(uuid4())
+
+    def calculate_ecosystem_matrices_concurrently(ecosystem_matrix_inputs):
+        # Simulate another worker saving a newer calculation while we were calculating this one
+        with transaction() as session:
+            session.query(Ecosystem).filter(Ecosystem.uuid == ecosystem.uuid).update(
+                {Ecosystem.last_ecosystem_matrix_update_calculation_uuid: newer_calculation_uuid},
+                synchronize_session=False
+            )
+
+        return [({
+            'uuid': str(uuid4()),
+            'ecosystem_uuid': ecosystem.uuid,
+            'Q_ids': [],
+            'C_ids': [],
+            'd_data': [],
+            'W_data': [],
+            'W_row': [],
+            'W_col': [],
+            'H_mask_data': [],
+            'H_mask_row': [],
+            'H_mask_col': []
+        }, {}) for inputs in ecosystem_matrix_inputs]
+
+    with patch(
+        'sparfa_server.tasks.calcs._calculate_ecosystem_matrices', autospec=True
+    ) as _calculate_ecosystem_matrices:
+        _calculate_ecosystem_matrices.side_effect = calculate_ecosystem_matrices_concurrently
+
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+        ) as fetch_ecosystem_matrix_updates:
+            fetch_ecosystem_matrix_updates.side_effect = [[{
+                'calculation_uuid': calculation_uuid, 'ecosystem_uuid': ecosystem.uuid
+            }], []]
+
+            with patch(
+                'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+            ) as ecosystem_matrices_updated:
+                calculate_ecosystem_matrices()
+
+    _calculate_ecosystem_matrices.assert_called_once()
+    ecosystem_matrices_updated.assert_called_once_with([{'calculation_uuid': calculation_uuid}])
+
+    with transaction() as session:
+        # The newer matrix wins, so our ecosystem matrix was discarded
+        assert not session.query(EcosystemMatrix).filter(
+            EcosystemMatrix.ecosystem_uuid == ecosystem.uuid
+        ).all()
+        assert session.query(Ecosystem).filter(
+            Ecosystem.uuid == ecosystem.uuid
+        ).one().last_ecosystem_matrix_update_calculation_uuid == newer_calculation_uuid
+        # Our lease was released
+        assert not session.query(CalculationLease).all()
+
+
+def test_calculate_ecosystem_matrices_leased_calculation(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    calculation_uuid = str(uuid4())
+
+    with transaction() as session:
+        session.add(ecosystem)
+        # Simulate another worker still calculating this calculation
+        CalculationLease.claim(session, [calculation_uuid], timedelta(hours=1))
+
+    with patch(
+        'sparfa_server.tasks.calcs._calculate_ecosystem_matrices', autospec=True
+    ) as _calculate_ecosystem_matrices:
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+        ) as fetch_ecosystem_matrix_updates:
+            fetch_ecosystem_matrix_updates.return_value = [{
+                'calculation_uuid': calculation_uuid, 'ecosystem_uuid': ecosystem.uuid
+            }]
+
+            with patch(
+                'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+            ) as ecosystem_matrices_updated:
+                calculate_ecosystem_matrices()
+
+    # The calculation is left to the other worker, which will tell biglearn-scheduler when done
+    _calculate_ecosystem_matrices.assert_not_called()
+    ecosystem_matrices_updated.assert_not_called()
+
+    with transaction() as session:
+        assert str(session.query(CalculationLease).one().uuid) == calculation_uuid
+
+
+def test_calculate_ecosystem_matrices_unchanged(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    page = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                exercise_uuids=[str(uuid4()), str(uuid4())])
+    responses = [Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=str(uuid4()),
+        exercise_uuid=exercise_uuid,
+        is_correct=choice((True, False)),
+        is_real_response=True,
+        responded_at=datetime.now(),
+        transaction_id=1
+    ) for exercise_uuid in page.exercise_uuids]
+
+    current_ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+        ecosystem_uuid=ecosystem.uuid, pages=[page], responses=responses
+    )
+
+    with transaction() as session:
+        session.add(ecosystem)
+        session.add(page)
+        for response in responses:
+            session.add(response)
+        current_ecosystem_matrix.responses_watermark = 2
+        session.add(current_ecosystem_matrix)
+
+    calculation_uuid = str(uuid4())
+    with patch(
+        'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+    ) as fetch_ecosystem_matrix_updates:
+        fetch_ecosystem_matrix_updates.side_effect = [[{
+            'calculation_uuid': calculation_uuid, 'ecosystem_uuid': ecosystem.uuid
+        }], []]
+
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+        ) as ecosystem_matrices_updated:
+            with patch(
+                'sparfa_server.tasks.calcs._calculate_ecosystem_matrices', autospec=True
+            ) as _calculate_ecosystem_matrices:
+                calculate_ecosystem_matrices()
+
+    _calculate_ecosystem_matrices.assert_not_called()
+    ecosystem_matrices_updated.assert_called_once_with([{'calculation_uuid': calculation_uuid}])
+
+    with transaction() as session:
+        assert session.query(Ecosystem).filter(
+            Ecosystem.uuid == ecosystem.uuid
+        ).one().last_ecosystem_matrix_update_calculation_uuid == calculation_uuid
+
+        ecosystem_matrix = session.query(EcosystemMatrix).filter(
+            EcosystemMatrix.ecosystem_uuid == ecosystem.uuid
+        ).one()
+
+    assert ecosystem_matrix.uuid == current_ecosystem_matrix.uuid
+    assert ecosystem_matrix.superseded_at is None
+
+
+def test_calculate_ecosystem_matrices_corrected_response(transaction):
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    page = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                exercise_uuids=[str(uuid4()), str(uuid4())])
+    responses = [Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=str(uuid4()),
+        exercise_uuid=exercise_uuid,
+        is_correct=False,
+        is_real_response=True,
+        responded_at=datetime.now() - timedelta(days=1),
+        transaction_id=1
+    ) for exercise_uuid in page.exercise_uuids]
+
+    current_ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+        ecosystem_uuid=ecosystem.uuid, pages=[page], responses=responses
+    )
+
+    with transaction() as session:
+        session.add(ecosystem)
+        session.add(page)
+        for response in responses:
+            session.add(response)
+        current_ecosystem_matrix.responses_watermark = 2
+        session.add(current_ecosystem_matrix)
+
+    # A corrected answer upserts the same trial, so the number of responses does not change
+    corrected_response_values = dict(responses[0].dict, is_correct=True)
+    with transaction() as session:
+        session.upsert_values(Response, [corrected_response_values])
+
+    calculation_uuid = str(uuid4())
+    with patch(
+        'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+    ) as fetch_ecosystem_matrix_updates:
+        fetch_ecosystem_matrix_updates.side_effect = [[{
+            'calculation_uuid': calculation_uuid, 'ecosystem_uuid': ecosystem.uuid
+        }], []]
+
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+        ) as ecosystem_matrices_updated:
+            calculate_ecosystem_matrices()
+
+    ecosystem_matrices_updated.assert_called_once_with([{'calculation_uuid': calculation_uuid}])
+
+    with transaction() as session:
+        # The corrected answer changed the max transaction_id, so the matrix was recalculated
+        ecosystem_matrix = session.query(EcosystemMatrix).filter(
+            EcosystemMatrix.ecosystem_uuid == ecosystem.uuid,
+            EcosystemMatrix.superseded_at.is_(None)
+        ).one()
+        corrected_response = session.query(Response).filter(
+            Response.uuid == responses[0].uuid
+        ).one()
+
+    assert ecosystem_matrix.uuid != current_ecosystem_matrix.uuid
+    assert ecosystem_matrix.num_responses == len(responses)
+    assert corrected_response.is_correct
+    assert corrected_response.transaction_id >= current_ecosystem_matrix.responses_watermark
+    assert 2 <= ecosystem_matrix.responses_watermark <= corrected_response.transaction_id
+
+
+def test_calculate_ecosystem_matrices_priority(transaction):
+    quiet_ecosystem = Ecosystem(
+        uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1, num_pending_responses=1
+    )
+    busy_ecosystem = Ecosystem(
+        uuid=str(uuid4()), metadata_sequence_number=1, sequence_number=1, num_pending_responses=5
+    )
+    ecosystems = [quiet_ecosystem, busy_ecosystem]
+    pages = [Page(
+        uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid, exercise_uuids=[str(uuid4())]
+    ) for ecosystem in ecosystems]
+
+    with transaction() as session:
+        for model in ecosystems + pages:
+            session.add(model)
+
+    ecosystem_matrix_updates = [{
+        'calculation_uuid': str(uuid4()), 'ecosystem_uuid': ecosystem.uuid
+    } for ecosystem in ecosystems]
+
+    with patch('sparfa_server.tasks.calcs.NUM_ECOSYSTEM_MATRIX_PROCESSES', 1):
+        with patch(
+            'sparfa_server.tasks.calcs.BLSCHED.fetch_ecosystem_matrix_updates', autospec=True
+        ) as fetch_ecosystem_matrix_updates:
+            fetch_ecosystem_matrix_updates.side_effect = [
+                ecosystem_matrix_updates, ecosystem_matrix_updates, []
+            ]
+
+            with patch(
+                'sparfa_server.tasks.calcs.BLSCHED.ecosystem_matrices_updated', autospec=True
+            ) as ecosystem_matrices_updated:
+                calculate_ecosystem_matrices()
+
+    # The ecosystem with the most pending responses is calculated first
+    assert [args[0][0] for args in ecosystem_matrices_updated.call_args_list] == [
+        [{'calculation_uuid': ecosystem_matrix_updates[1]['calculation_uuid']}],
+        [{'calculation_uuid': ecosystem_matrix_updates[0]['calculation_uuid']}]
+    ]
+
+    with transaction() as session:
+        assert [ecosystem.num_pending_responses for ecosystem in session.query(Ecosystem).filter(
+            Ecosystem.uuid.in_([ecosystem.uuid for ecosystem in ecosystems])
+        ).all()] == [0, 0]
+
+
+def test_process_calculations_pipelined():
+    calculations_1 = [{'calculation_uuid': str(uuid4())} for i in range(2)]
+    calculations_2 = [{'calculation_uuid': str(uuid4())}]
+    # biglearn-scheduler returns calculations again until their update has been received
+    fetch_calculations = MagicMock(side_effect=[
+        calculations_1, calculations_1 + calculations_2, calculations_2, []
+    ])
+    calculated_calculation_uuids = []
+    updated_calculation_uuids = []
+
+    def calculate(session, calculations):
+        calculated_calculation_uuids.append(
+            [calculation['calculation_uuid'] for calculation in calculations]
+        )
+        return calculations
+
+    def update_calculations(requests):
+        updated_calculation_uuids.append([request['calculation_uuid'] for request in requests])
+
+    with patch('sparfa_server.tasks.calcs.PIPELINE_CALCULATIONS', True):
+        _process_calculations(fetch_calculations, calculate, update_calculations)
+
+    expected_calculation_uuids = [
+        [calculation['calculation_uuid'] for calculation in calculations_1],
+        [calculation['calculation_uuid'] for calculation in calculations_2]
+    ]
+    assert fetch_calculations.call_count == 4
+    assert calculated_calculation_uuids == expected_calculation_uuids
+    assert updated_calculation_uuids == expected_calculation_uuids
+
+    # Calculations are not updated if there is nothing to calculate
+    fetch_calculations = MagicMock(side_effect=[calculations_1])
+    update_calculations = MagicMock()
+    with patch('sparfa_server.tasks.calcs.PIPELINE_CALCULATIONS', True):
+        _process_calculations(fetch_calculations, lambda session, calcs: None, update_calculations)
+
+    update_calculations.assert_not_called()
+
+
+def test_calculate_exercises_pipelined(transaction):
+    # The suite session is shared by every call to Session() and cannot be used across threads,
+    # so this test uses real sessions and commits, then deletes everything it created
+    Session = sessionmaker(bind=ENGINE, class_=BiglearnSession)
+
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
+    page = Page(uuid=str(uuid4()), ecosystem_uuid=ecosystem.uuid,
+                exercise_uuids=[str(uuid4()), str(uuid4())])
+    student_uuid = str(uuid4())
+    response = Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem.uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=student_uuid,
+        exercise_uuid=page.exercise_uuids[0],
+        is_correct=True,
+        is_real_response=True,
+        responded_at=datetime.now()
+    )
+    ecosystem_matrix = EcosystemMatrix.from_ecosystem_uuid_pages_responses(
+        ecosystem_uuid=ecosystem.uuid, pages=[page], responses=[response]
+    )
+    exercise_calculations_1 = [{
+        'calculation_uuid': str(uuid4()),
+        'ecosystem_uuid': ecosystem.uuid,
+        'student_uuid': student_uuid,
+        'exercise_uuids': page.exercise_uuids
+    }]
+    exercise_calculations_2 = [{
+        'calculation_uuid': str(uuid4()),
+        'ecosystem_uuid': ecosystem.uuid,
+        'student_uuid': student_uuid,
+        'exercise_uuids': page.exercise_uuids[::-1]
+    }]
+    calculation_uuids = [
+        calculation['calculation_uuid']
+        for calculation in exercise_calculations_1 + exercise_calculations_2
+    ]
+
+    def leased_calculation_uuids():
+        session = Session()
+        try:
+            return set(str(lease.uuid) for lease in session.query(CalculationLease).filter(
+                CalculationLease.uuid.in_(calculation_uuids)
+            ))
+        finally:
+            session.close()
+
+    fetched = [Event() for i in range(3)]
+    update_threads = []
+    leases_during_updates = []
+    leases_during_fetches = []
+
+    def fetch_exercise_calculations():
+        leases_during_fetches.append(leased_calculation_uuids())
+        fetched[len(leases_during_fetches) - 1].set()
+        if len(leases_during_fetches) == 1:
+            return exercise_calculations_1
+        elif len(leases_during_fetches) == 2:
+            # biglearn-scheduler returns calculations again until their update is received
+            return exercise_calculations_1 + exercise_calculations_2
+        return []
+
+    def update_exercise_calculations(exercise_calculation_requests):
+        update_threads.append(current_thread().name)
+        leases_during_updates.append(leased_calculation_uuids())
+        # Each update is only acknowledged once the next batch has been fetched
+        assert fetched[len(update_threads)].wait(10)
+
+    try:
+        with patch('sparfa_server.orm.sessions.Session', Session):
+            with transaction() as session:
+                session.add(ecosystem)
+                session.add(page)
+                session.add(response)
+                session.add(ecosystem_matrix)
+
+            with patch('sparfa_server.tasks.calcs.PIPELINE_CALCULATIONS', True):
+                with patch(
+                    'sparfa_server.tasks.calcs.BLSCHED.fetch_exercise_calculations',
+                    side_effect=fetch_exercise_calculations
+                ):
+                    with patch(
+                        'sparfa_server.tasks.calcs.BLSCHED.update_exercise_calculations',
+                        side_effect=update_exercise_calculations
+                    ):
+                        calculate_exercises()
+
+        assert update_threads and current_thread().name not in update_threads
+
+        # The leases are visible to other sessions until biglearn-scheduler acknowledges
+        # the update, even while the next batch is fetched and calculated
+        assert leases_during_fetches == [
+            set(), set(calculation_uuids[:1]), set(calculation_uuids[1:])
+        ]
+        assert leases_during_updates == [set(calculation_uuids[:1]), set(calculation_uuids[1:])]
+        assert leased_calculation_uuids() == set()
+    finally:
+        session = Session()
+        try:
+            session.query(CalculationLease).filter(
+                CalculationLease.uuid.in_(calculation_uuids)
+            ).delete(synchronize_session=False)
+            for cls in (EcosystemMatrix, Response, Page, Ecosystem):
+                column = cls.uuid if cls is Ecosystem else cls.ecosystem_uuid
+                session.query(cls).filter(
+                    column == ecosystem.uuid
+                ).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+
+def test_map_ecosystem_calculations_threads():
+    ecosystem_matrices = [MagicMock() for i in range(3)]
+    ecosystem_matrices_calculations = [
+        (ecosystem_matrix, [{'calculation_uuid': str(uuid4())}])
+        for ecosystem_matrix in ecosystem_matrices
+    ]
+    thread_names = set()
+
+    def calculate(decoded_ecosystem_matrix, calculations):
+        thread_names.add(current_thread().name)
+        return [(decoded_ecosystem_matrix, calculation) for calculation in calculations]
+
+    # The function gets the decoded matrices
+    expected_results = [
+        [(ecosystem_matrix.decoded, calculation) for calculation in calculations]
+        for ecosystem_matrix, calculations in ecosystem_matrices_calculations
+    ]
+
+    assert _map_ecosystem_calculations(calculate, ecosystem_matrices_calculations) == \
+        expected_results
+    assert thread_names == set([current_thread().name])
+
+    # The results are returned in order, even though they are calculated in worker threads
+    thread_names.clear()
+    with patch('sparfa_server.tasks.calcs.ECOSYSTEM_CALCULATION_THREADS', 2):
+        assert _map_ecosystem_calculations(calculate, ecosystem_matrices_calculations) == \
+            expected_results
+        assert _map_ecosystem_calculations(calculate, []) == []
+
+    assert thread_names and current_thread().name not in thread_names
+
+
+def test_map_ecosystem_calculations_uncached():
+    ecosystem_matrices = [EcosystemMatrix(
+        uuid=str(uuid4()),
+        ecosystem_uuid=str(uuid4()),
+        C_ids=[str(uuid4())],
+        Q_ids=[str(uuid4()), str(uuid4())],
+        d_NQx1=array(((1.0,), (0.0,))),
+        W_NCxNQ=array(((0.5, 1.0),)),
+        H_mask_NCxNQ=array(((True, False),))
+    ) for i in range(3)]
+    ecosystem_matrices_calculations = [
+        (ecosystem_matrix, [{'calculation_uuid': str(uuid4())}])
+        for ecosystem_matrix in ecosystem_matrices
+    ]
+    decoding_thread_names = []
+    calculating_thread_names = set()
+
+    def init(self, ecosystem_matrix):
+        decoding_thread_names.append(current_thread().name)
+        decoded_ecosystem_matrix_init(self, ecosystem_matrix)
+
+    def calculate(decoded_ecosystem_matrix, calculations):
+        calculating_thread_names.add(current_thread().name)
+        assert isinstance(decoded_ecosystem_matrix, DecodedEcosystemMatrix)
+        return decoded_ecosystem_matrix.uuid, decoded_ecosystem_matrix.ecosystem_uuid
+
+    # None of the matrices are cached, so they are all decoded, but only in the calling thread
+    decoded_ecosystem_matrix_init = DecodedEcosystemMatrix.__init__
+    with patch.object(DecodedEcosystemMatrix, '__init__', init):
+        with patch('sparfa_server.tasks.calcs.ECOSYSTEM_CALCULATION_THREADS', 2):
+            assert _map_ecosystem_calculations(calculate, ecosystem_matrices_calculations) == [
+                (ecosystem_matrix.uuid, ecosystem_matrix.ecosystem_uuid)
+                for ecosystem_matrix in ecosystem_matrices
+            ]
+
+    assert decoding_thread_names == [current_thread().name] * len(ecosystem_matrices)
+    assert calculating_thread_names and current_thread().name not in calculating_thread_names
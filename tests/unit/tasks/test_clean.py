@@ -1,8 +1,9 @@
 from uuid import uuid4
 from datetime import datetime, timedelta
 
-from sparfa_server.orm import Ecosystem, EcosystemMatrix
-from sparfa_server.tasks.clean import cleanup_ecosystem_matrices
+from sparfa_server.orm import (Ecosystem, EcosystemMatrixPayload, EcosystemMatrix,
+                               CalculationLease)
+from sparfa_server.tasks.clean import cleanup_ecosystem_matrices, cleanup_calculation_leases
 
 
 def test_cleanup_ecosystem_matrices(transaction):
@@ -94,3 +95,71 @@ def test_cleanup_ecosystem_matrices(transaction):
     assert ecosystem_matrix_2 in ecosystem_matrices
     assert ecosystem_matrix_3 in ecosystem_matrices
     assert ecosystem_matrix_4 not in ecosystem_matrices
+
+    with transaction() as session:
+        # The payloads are deleted together with their matrices
+        assert set(payload.uuid for payload in session.query(EcosystemMatrixPayload).all()) == set(
+            ecosystem_matrix.uuid for ecosystem_matrix in ecosystem_matrices
+        )
+
+
+def test_cleanup_ecosystem_matrices_delta_encoded(transaction):
+    ecosystem_uuid = str(uuid4())
+
+    parent_ecosystem_matrix = EcosystemMatrix(
+        uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem_uuid,
+        is_used_in_assignments=False,
+        superseded_at=datetime.now() - timedelta(days=60),
+        Q_ids=[],
+        C_ids=[],
+        d_data=[],
+        W_data=[],
+        W_row=[],
+        W_col=[],
+        H_mask_data=[],
+        H_mask_row=[],
+        H_mask_col=[]
+    )
+
+    delta_encoded_ecosystem_matrix = EcosystemMatrix(
+        uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem_uuid,
+        is_used_in_assignments=False,
+        superseded_at=datetime.now() - timedelta(days=30)
+    )
+    delta_encoded_ecosystem_matrix.payload = EcosystemMatrixPayload(
+        parent=parent_ecosystem_matrix.payload
+    )
+
+    with transaction() as session:
+        session.add(parent_ecosystem_matrix)
+        session.add(delta_encoded_ecosystem_matrix)
+
+    # The parent is kept while the delta-encoded matrix still needs it
+    cleanup_ecosystem_matrices()
+
+    with transaction() as session:
+        assert session.query(EcosystemMatrix).all() == [parent_ecosystem_matrix]
+
+    cleanup_ecosystem_matrices()
+
+    with transaction() as session:
+        assert not session.query(EcosystemMatrix).all()
+        assert not session.query(EcosystemMatrixPayload).all()
+
+
+def test_cleanup_calculation_leases(transaction):
+    lease_1 = CalculationLease(uuid=str(uuid4()), expires_at=datetime.now() + timedelta(minutes=5))
+    lease_2 = CalculationLease(uuid=str(uuid4()), expires_at=datetime.now() - timedelta(days=1))
+    lease_3 = CalculationLease(uuid=str(uuid4()), expires_at=datetime.now() - timedelta(days=31))
+
+    with transaction() as session:
+        session.add_all([lease_1, lease_2, lease_3])
+
+    cleanup_calculation_leases()
+
+    with transaction() as session:
+        assert set(lease.uuid for lease in session.query(CalculationLease)) == set(
+            [lease_1.uuid, lease_2.uuid]
+        )
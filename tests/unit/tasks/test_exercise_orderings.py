@@ -0,0 +1,96 @@
+from uuid import uuid4
+from datetime import datetime
+from unittest.mock import patch
+
+from redis.exceptions import ConnectionError
+
+from sparfa_server.tasks.exercise_orderings import (exercise_ordering_key,
+                                                    fetch_exercise_orderings,
+                                                    store_exercise_orderings)
+
+
+def test_exercise_ordering_key():
+    ecosystem_matrix_uuid = str(uuid4())
+    student_uuid = str(uuid4())
+    exercise_uuids = [str(uuid4()), str(uuid4())]
+    response_dicts = [{
+        'L_id': student_uuid,
+        'Q_id': exercise_uuids[0],
+        'correct?': True,
+        'responded_at': str(datetime.now())
+    }]
+
+    key = exercise_ordering_key(ecosystem_matrix_uuid, student_uuid, exercise_uuids, response_dicts)
+    assert key.startswith('exercise_orderings:{}:{}:'.format(ecosystem_matrix_uuid, student_uuid))
+
+    # The order of the exercises and responses does not matter
+    assert exercise_ordering_key(
+        ecosystem_matrix_uuid, student_uuid, reversed(exercise_uuids), list(response_dicts)
+    ) == key
+
+    # Any change to the inputs of the ordering changes the key
+    assert exercise_ordering_key(
+        str(uuid4()), student_uuid, exercise_uuids, response_dicts
+    ) != key
+    assert exercise_ordering_key(
+        ecosystem_matrix_uuid, str(uuid4()), exercise_uuids, response_dicts
+    ) != key
+    assert exercise_ordering_key(
+        ecosystem_matrix_uuid, student_uuid, exercise_uuids[:1], response_dicts
+    ) != key
+    assert exercise_ordering_key(
+        ecosystem_matrix_uuid, student_uuid, exercise_uuids, []
+    ) != key
+    assert exercise_ordering_key(
+        ecosystem_matrix_uuid, student_uuid, exercise_uuids,
+        [dict(response_dicts[0], **{'correct?': False})]
+    ) != key
+
+
+def test_fetch_store_exercise_orderings(redis):
+    key_1 = 'exercise_orderings:{}'.format(uuid4())
+    key_2 = 'exercise_orderings:{}'.format(uuid4())
+    key_3 = 'exercise_orderings:{}'.format(uuid4())
+    ordered_exercise_uuids = [str(uuid4()), str(uuid4())]
+
+    assert fetch_exercise_orderings([]) == {}
+    assert fetch_exercise_orderings([key_1, key_2]) == {}
+
+    store_exercise_orderings({key_1: ordered_exercise_uuids, key_2: []})
+
+    assert fetch_exercise_orderings([key_1, key_2, key_3]) == {
+        key_1: ordered_exercise_uuids, key_2: []
+    }
+    assert redis.ttl(key_1) > 0
+
+    with patch('sparfa_server.tasks.exercise_orderings.TTL', 0):
+        store_exercise_orderings({key_3: ordered_exercise_uuids})
+
+        assert fetch_exercise_orderings([key_1, key_3]) == {}
+
+    assert redis.get(key_3) is None
+
+
+def test_fetch_exercise_orderings_redis_error(redis):
+    key_1 = 'exercise_orderings:{}'.format(uuid4())
+    key_2 = 'exercise_orderings:{}'.format(uuid4())
+
+    store_exercise_orderings({key_1: [str(uuid4()), str(uuid4())]})
+
+    # Every key is treated as a miss, so the orderings are calculated again
+    with patch(
+        'sparfa_server.tasks.exercise_orderings.REDIS.mget', side_effect=ConnectionError
+    ):
+        assert fetch_exercise_orderings([key_1, key_2]) == {}
+
+
+def test_store_exercise_orderings_redis_error(redis):
+    key = 'exercise_orderings:{}'.format(uuid4())
+
+    # The orderings are simply not cached
+    with patch(
+        'sparfa_server.tasks.exercise_orderings.REDIS.pipeline', side_effect=ConnectionError
+    ):
+        store_exercise_orderings({key: [str(uuid4()), str(uuid4())]})
+
+    assert redis.get(key) is None
@@ -1,5 +1,6 @@
 from uuid import uuid4
 from unittest.mock import patch
+from collections import Counter
 from datetime import datetime
 
 from sparfa_server.orm import Ecosystem, Page, EcosystemMatrix, Course, Response
@@ -8,7 +9,8 @@ from sparfa_server.tasks.loaders import (load_ecosystem_metadata,
                                          _load_grouped_ecosystem_events,
                                          load_course_metadata,
                                          load_course_events,
-                                         _load_grouped_course_events)
+                                         _load_grouped_course_events,
+                                         _add_pending_responses)
 from sparfa_server.orm.sessions import BiglearnSession
 from constants import UUID_REGEX
 
@@ -236,18 +238,24 @@ def test_load_course_events(transaction):
     course_2 = Course(uuid=course_uuids[1], metadata_sequence_number=1, sequence_number=1)
     course_3 = Course(uuid=course_uuids[2], metadata_sequence_number=2, sequence_number=2)
     course_4 = Course(uuid=course_uuids[3], metadata_sequence_number=3, sequence_number=3)
+    ecosystem = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
 
     with transaction() as session:
         session.add(course_1)
         session.add(course_2)
         session.add(course_3)
         session.add(course_4)
+        session.add(ecosystem)
 
     with patch(
         'sparfa_server.tasks.loaders._load_grouped_course_events', autospec=True
     ) as load_grouped_course_events:
         load_grouped_course_events.side_effect = [
-            [course_2.uuid], [course_3.uuid], [], [course_3.uuid], []
+            ([course_2.uuid], Counter({ecosystem.uuid: 2})),
+            ([course_3.uuid], Counter()),
+            ([], Counter()),
+            ([course_3.uuid], Counter({ecosystem.uuid: 1})),
+            ([], Counter())
         ]
         load_course_events(batch_size=2)
 
@@ -267,10 +275,15 @@ def test_load_course_events(transaction):
         set((course_3.uuid,))
     ]
 
+    with transaction() as session:
+        assert session.query(Ecosystem).filter(
+            Ecosystem.uuid == ecosystem.uuid
+        ).one().num_pending_responses == 3
+
 
 def test_load_grouped_course_events(transaction):
     with transaction() as session:
-        assert _load_grouped_course_events(session, []) == []
+        assert _load_grouped_course_events(session, []) == ([], {})
 
     course_1 = Course(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1)
     course_2 = Course(uuid=str(uuid4()), metadata_sequence_number=1, sequence_number=2)
@@ -288,11 +301,16 @@ def test_load_grouped_course_events(transaction):
         H_mask_col=[]
     )
 
+    ecosystem_1 = Ecosystem(
+        uuid=ecosystem_matrix_1.ecosystem_uuid, metadata_sequence_number=0, sequence_number=1
+    )
+
     assert not ecosystem_matrix_1.is_used_in_assignments
 
     with transaction() as session:
         session.add(course_1)
         session.add(course_2)
+        session.add(ecosystem_1)
         session.add(ecosystem_matrix_1)
 
     request_uuid_1 = str(uuid4())
@@ -538,7 +556,9 @@ def test_load_grouped_course_events(transaction):
 
             with transaction() as session:
                 courses = session.query(Course).all()
-                assert _load_grouped_course_events(session, courses) == [course_1.uuid]
+                assert _load_grouped_course_events(session, courses) == (
+                    [course_1.uuid], {ecosystem_matrix_1.ecosystem_uuid: 1, ecosystem_2_uuid: 1}
+                )
 
     fetch_course_events.assert_called_once()
     args = fetch_course_events.call_args
@@ -559,6 +579,11 @@ def test_load_grouped_course_events(transaction):
         ecosystem_matrices = session.query(EcosystemMatrix).all()
         responses = session.query(Response).all()
         courses = session.query(Course).all()
+        ecosystems = session.query(Ecosystem).all()
+
+    # The pending responses are only added after the responses are committed
+    assert len(ecosystems) == 1
+    assert ecosystems[0].num_pending_responses == 0
 
     assert len(ecosystem_matrices) == 1
     ecosystem_matrix = ecosystem_matrices[0]
@@ -605,3 +630,24 @@ def test_load_grouped_course_events(transaction):
     for course in courses:
         assert course.uuid in [course_1.uuid, course_2.uuid]
         assert course.sequence_number == 7 if course == course_1 else 4
+
+
+def test_add_pending_responses(transaction):
+    ecosystem_1 = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=0, sequence_number=1,
+                            num_pending_responses=1)
+    ecosystem_2 = Ecosystem(uuid=str(uuid4()), metadata_sequence_number=1, sequence_number=1)
+
+    with transaction() as session:
+        session.add(ecosystem_1)
+        session.add(ecosystem_2)
+
+    _add_pending_responses(Counter())
+    _add_pending_responses(Counter({ecosystem_1.uuid: 2, ecosystem_2.uuid: 1}))
+
+    with transaction() as session:
+        num_pending_responses_by_ecosystem_uuid = {
+            ecosystem.uuid: ecosystem.num_pending_responses
+            for ecosystem in session.query(Ecosystem).all()
+        }
+
+    assert num_pending_responses_by_ecosystem_uuid == {ecosystem_1.uuid: 3, ecosystem_2.uuid: 1}
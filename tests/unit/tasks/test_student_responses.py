@@ -0,0 +1,221 @@
+from uuid import uuid4
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from redis.exceptions import ConnectionError
+
+from sparfa_server.orm import Response
+from sparfa_server.tasks.student_responses import (update_student_responses,
+                                                   fetch_student_responses)
+
+
+def _response(ecosystem_uuid, student_uuid, exercise_uuid, is_correct, responded_at):
+    return Response(
+        uuid=str(uuid4()),
+        course_uuid=str(uuid4()),
+        ecosystem_uuid=ecosystem_uuid,
+        trial_uuid=str(uuid4()),
+        student_uuid=student_uuid,
+        exercise_uuid=exercise_uuid,
+        is_correct=is_correct,
+        is_real_response=True,
+        responded_at=responded_at
+    )
+
+
+def test_fetch_student_responses(transaction, redis):
+    ecosystem_uuid = str(uuid4())
+    student_uuid_1 = str(uuid4())
+    student_uuid_2 = str(uuid4())
+    exercise_uuid_1 = str(uuid4())
+    exercise_uuid_2 = str(uuid4())
+    now = datetime.now()
+
+    response_1 = _response(ecosystem_uuid, student_uuid_1, exercise_uuid_1, False,
+                           now - timedelta(days=1))
+    response_2 = _response(ecosystem_uuid, student_uuid_1, exercise_uuid_1, True, now)
+    response_3 = _response(ecosystem_uuid, student_uuid_1, exercise_uuid_2, False, now)
+    response_4 = _response(str(uuid4()), student_uuid_2, exercise_uuid_1, True, now)
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {}) == {}
+
+        session.add_all([response_1, response_2, response_3, response_4])
+
+    exercise_uuids = [exercise_uuid_1, exercise_uuid_2]
+    expected_responses = {
+        (ecosystem_uuid, student_uuid_1): sorted(
+            [response_2.dict_for_algs, response_3.dict_for_algs], key=lambda resp: resp['Q_id']
+        ),
+        (ecosystem_uuid, student_uuid_2): []
+    }
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid_1): exercise_uuids,
+            (ecosystem_uuid, student_uuid_2): exercise_uuids
+        }) == expected_responses
+
+    # Cached students are not loaded from the database again
+    response_5 = _response(ecosystem_uuid, student_uuid_2, exercise_uuid_2, True, now)
+    with transaction() as session:
+        session.add(response_5)
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid_1): exercise_uuids,
+            (ecosystem_uuid, student_uuid_2): exercise_uuids
+        }) == expected_responses
+
+        update_student_responses(session, [response_5.trial_uuid])
+
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid_2): exercise_uuids
+        }) == {
+            (ecosystem_uuid, student_uuid_2): [response_5.dict_for_algs]
+        }
+
+    # Responses older than the cached ones do not replace them
+    response_6 = _response(ecosystem_uuid, student_uuid_1, exercise_uuid_2, True,
+                           now - timedelta(days=1))
+    with transaction() as session:
+        session.add(response_6)
+
+    with transaction() as session:
+        update_student_responses(session, [response_6.trial_uuid])
+
+        assert fetch_student_responses(
+            session, {(ecosystem_uuid, student_uuid_1): exercise_uuids}
+        ) == {(ecosystem_uuid, student_uuid_1): expected_responses[
+            (ecosystem_uuid, student_uuid_1)
+        ]}
+
+        # Only the responses to the given exercises are returned
+        assert fetch_student_responses(
+            session, {(ecosystem_uuid, student_uuid_1): [exercise_uuid_2, str(uuid4())]}
+        ) == {(ecosystem_uuid, student_uuid_1): [response_3.dict_for_algs]}
+
+    # Students updated before being cached are still loaded from the database
+    redis.flushdb()
+    with transaction() as session:
+        update_student_responses(session, [response_5.trial_uuid])
+
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid_1): exercise_uuids,
+            (ecosystem_uuid, student_uuid_2): exercise_uuids
+        }) == {
+            (ecosystem_uuid, student_uuid_1): expected_responses[(ecosystem_uuid, student_uuid_1)],
+            (ecosystem_uuid, student_uuid_2): [response_5.dict_for_algs]
+        }
+
+
+def test_fetch_student_responses_without_cache(transaction, redis):
+    ecosystem_uuid = str(uuid4())
+    student_uuid = str(uuid4())
+    exercise_uuid = str(uuid4())
+    now = datetime.now()
+    response_1 = _response(ecosystem_uuid, student_uuid, exercise_uuid, False,
+                           now - timedelta(days=1))
+    response_2 = _response(ecosystem_uuid, student_uuid, exercise_uuid, True, now)
+    response_3 = _response(ecosystem_uuid, student_uuid, str(uuid4()), True, now)
+
+    with patch('sparfa_server.tasks.student_responses.TTL', 0):
+        with transaction() as session:
+            session.add_all([response_1, response_2, response_3])
+
+            update_student_responses(session, [response_2.trial_uuid])
+
+            assert fetch_student_responses(session, {
+                (ecosystem_uuid, student_uuid): [exercise_uuid, str(uuid4())]
+            }) == {(ecosystem_uuid, student_uuid): [response_2.dict_for_algs]}
+
+    assert redis.keys() == []
+
+
+def test_update_student_responses_redis_error(transaction, redis):
+    ecosystem_uuid = str(uuid4())
+    student_uuid = str(uuid4())
+    exercise_uuid = str(uuid4())
+    now = datetime.now()
+    response_1 = _response(ecosystem_uuid, student_uuid, exercise_uuid, False,
+                           now - timedelta(days=1))
+    response_2 = _response(ecosystem_uuid, student_uuid, exercise_uuid, True, now)
+
+    with transaction() as session:
+        session.add(response_1)
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid): [exercise_uuid]
+        }) == {(ecosystem_uuid, student_uuid): [response_1.dict_for_algs]}
+    assert redis.keys()
+
+    # The responses are still saved, but the cached student is dropped
+    with transaction() as session:
+        session.add(response_2)
+        session.flush()
+
+        with patch(
+            'sparfa_server.tasks.student_responses.MERGE_SCRIPT', side_effect=ConnectionError
+        ):
+            update_student_responses(session, [response_2.trial_uuid])
+
+    assert redis.keys() == []
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid): [exercise_uuid]
+        }) == {(ecosystem_uuid, student_uuid): [response_2.dict_for_algs]}
+
+    # Nothing is raised if Redis is completely down
+    with transaction() as session:
+        with patch(
+            'sparfa_server.tasks.student_responses.REDIS.pipeline', side_effect=ConnectionError
+        ):
+            with patch(
+                'sparfa_server.tasks.student_responses.REDIS.delete', side_effect=ConnectionError
+            ):
+                update_student_responses(session, [response_2.trial_uuid])
+
+
+def test_fetch_student_responses_redis_error(transaction, redis):
+    ecosystem_uuid = str(uuid4())
+    student_uuid = str(uuid4())
+    exercise_uuid_1 = str(uuid4())
+    exercise_uuid_2 = str(uuid4())
+    now = datetime.now()
+    response_1 = _response(ecosystem_uuid, student_uuid, exercise_uuid_1, False, now)
+    response_2 = _response(ecosystem_uuid, student_uuid, exercise_uuid_2, True, now)
+
+    with transaction() as session:
+        session.add(response_1)
+        session.add(response_2)
+
+    # The students are loaded from the database if Redis is completely down
+    with transaction() as session:
+        with patch(
+            'sparfa_server.tasks.student_responses.REDIS.pipeline', side_effect=ConnectionError
+        ):
+            assert fetch_student_responses(session, {
+                (ecosystem_uuid, student_uuid): [exercise_uuid_1]
+            }) == {(ecosystem_uuid, student_uuid): [response_1.dict_for_algs]}
+
+    assert redis.keys() == []
+
+    with transaction() as session:
+        assert fetch_student_responses(session, {
+            (ecosystem_uuid, student_uuid): [exercise_uuid_1, exercise_uuid_2]
+        }) == {(ecosystem_uuid, student_uuid): sorted(
+            [response_1.dict_for_algs, response_2.dict_for_algs], key=lambda resp: resp['Q_id']
+        )}
+
+    assert redis.keys()
+
+    # Cached students are loaded from the database as well if Redis fails while fetching them
+    with transaction() as session:
+        with patch(
+            'sparfa_server.tasks.student_responses.REDIS.pipeline', side_effect=ConnectionError
+        ):
+            assert fetch_student_responses(session, {
+                (ecosystem_uuid, student_uuid): [exercise_uuid_2]
+            }) == {(ecosystem_uuid, student_uuid): [response_2.dict_for_algs]}
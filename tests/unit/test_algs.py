@@ -0,0 +1,230 @@
+from uuid import uuid4
+from random import choice
+from datetime import datetime, timedelta
+
+from numpy import allclose, array, ones, zeros
+from numpy.random import rand
+from scipy.sparse import csr_matrix, issparse
+
+from sparfa_algs.sgd.sparfa_algs import SparfaAlgs
+
+from sparfa_server.algs import ResponseColumns, convert_Rs, refine_W_d
+
+
+def test_refine_W_d():
+    NC = 2
+    NQ = 4
+    NL = 3
+
+    H_mask_NCxNQ = array(((True, True, False, False), (False, False, True, True)))
+    W_NCxNQ = rand(NC, NQ) * H_mask_NCxNQ
+    d_NQx1 = zeros((NQ, 1))
+    U_NCxNL = rand(NC, NL)
+    G_NQxNL = ones((NQ, NL))
+    G_mask_NQxNL = ones((NQ, NL), dtype=bool)
+
+    refined_W_NCxNQ, refined_d_NQx1 = refine_W_d(
+        W_NCxNQ=W_NCxNQ,
+        d_NQx1=d_NQx1,
+        H_mask_NCxNQ=H_mask_NCxNQ,
+        U_NCxNL=U_NCxNL,
+        G_NQxNL=G_NQxNL,
+        G_mask_NQxNL=G_mask_NQxNL,
+        num_epochs=5
+    )
+
+    assert refined_W_NCxNQ.shape == (NC, NQ)
+    assert refined_d_NQx1.shape == (NQ, 1)
+    # All responses are correct, so exercises become easier and associations stronger
+    assert (refined_d_NQx1 < d_NQx1).all()
+    assert (refined_W_NCxNQ[H_mask_NCxNQ] > W_NCxNQ[H_mask_NCxNQ]).all()
+    # W respects H_mask
+    assert (refined_W_NCxNQ[~H_mask_NCxNQ] == 0).all()
+    # The inputs are not modified
+    assert (d_NQx1 == 0).all()
+
+    unchanged_W_NCxNQ, unchanged_d_NQx1 = refine_W_d(
+        W_NCxNQ=W_NCxNQ,
+        d_NQx1=d_NQx1,
+        H_mask_NCxNQ=H_mask_NCxNQ,
+        U_NCxNL=U_NCxNL,
+        G_NQxNL=G_NQxNL,
+        G_mask_NQxNL=zeros((NQ, NL), dtype=bool),
+        num_epochs=5
+    )
+
+    assert (unchanged_W_NCxNQ == W_NCxNQ).all()
+    assert (unchanged_d_NQx1 == d_NQx1).all()
+
+
+def test_convert_Rs():
+    L_ids = [str(uuid4()) for i in range(3)]
+    Q_ids = [str(uuid4()) for i in range(4)]
+    unknown_ids = [str(uuid4()), str(uuid4())]
+    now = datetime.now()
+    # Repeated student/exercise pairs and ties check that the latest response wins
+    response_dicts = [{
+        'L_id':         choice(L_ids + unknown_ids),
+        'Q_id':         choice(Q_ids + unknown_ids),
+        'correct?':     choice((True, False)),
+        'responded_at': str(now - timedelta(seconds=choice(range(5))))
+    } for i in range(50)]
+
+    G_NQxNL, G_mask_NQxNL = convert_Rs(
+        responses=response_dicts, L_ids=L_ids[:2], Q_ids=Q_ids
+    )
+    expected_G_NQxNL, expected_G_mask_NQxNL = SparfaAlgs.convert_Rs(
+        responses=response_dicts, L_ids=L_ids[:2], Q_ids=Q_ids
+    )
+
+    assert G_NQxNL.shape == (len(Q_ids), 2)
+    assert (G_NQxNL == expected_G_NQxNL).all()
+    assert (G_mask_NQxNL == expected_G_mask_NQxNL).all()
+
+    columns_G_NQxNL, columns_G_mask_NQxNL = convert_Rs(
+        responses=ResponseColumns.from_dicts_for_algs(response_dicts),
+        L_ids=L_ids[:2],
+        Q_ids=Q_ids
+    )
+
+    assert (columns_G_NQxNL == G_NQxNL).all()
+    assert (columns_G_mask_NQxNL == G_mask_NQxNL).all()
+
+    empty_G_NQxNL, empty_G_mask_NQxNL = convert_Rs(responses=[], L_ids=L_ids, Q_ids=Q_ids)
+
+    assert (empty_G_NQxNL == 0).all()
+    assert not empty_G_mask_NQxNL.any()
+
+
+def test_refine_W_d_sparse():
+    NC = 2
+    NQ = 4
+    NL = 3
+
+    H_mask_NCxNQ = array(((True, True, False, False), (False, False, True, True)))
+    W_NCxNQ = rand(NC, NQ) * H_mask_NCxNQ
+    d_NQx1 = rand(NQ, 1)
+    U_NCxNL = rand(NC, NL)
+    G_NQxNL = rand(NQ, NL).round()
+    G_mask_NQxNL = rand(NQ, NL) > 0.25
+
+    dense_W_NCxNQ, dense_d_NQx1 = refine_W_d(
+        W_NCxNQ=W_NCxNQ,
+        d_NQx1=d_NQx1,
+        H_mask_NCxNQ=H_mask_NCxNQ,
+        U_NCxNL=U_NCxNL,
+        G_NQxNL=G_NQxNL,
+        G_mask_NQxNL=G_mask_NQxNL,
+        num_epochs=5
+    )
+    sparse_W_NCxNQ, sparse_d_NQx1 = refine_W_d(
+        W_NCxNQ=csr_matrix(W_NCxNQ),
+        d_NQx1=d_NQx1,
+        H_mask_NCxNQ=csr_matrix(H_mask_NCxNQ),
+        U_NCxNL=U_NCxNL,
+        G_NQxNL=G_NQxNL,
+        G_mask_NQxNL=G_mask_NQxNL,
+        num_epochs=5
+    )
+
+    assert issparse(sparse_W_NCxNQ)
+    assert allclose(sparse_W_NCxNQ.toarray(), dense_W_NCxNQ)
+    assert allclose(sparse_d_NQx1, dense_d_NQx1)
+
+
+class TestResponseColumns(object):
+    def test_from_values(self):
+        student_uuids = [uuid4(), uuid4()]
+        exercise_uuids = [uuid4(), uuid4(), uuid4()]
+        values = [(
+            student_uuid,
+            exercise_uuid,
+            choice((True, False)),
+            datetime.now() - timedelta(days=choice((0, 1)))
+        ) for student_uuid in student_uuids for exercise_uuid in exercise_uuids]
+
+        columns = ResponseColumns.from_values(value for value in values)
+
+        assert len(columns) == len(values)
+        assert columns.L_ids == [str(student_uuid) for student_uuid in student_uuids]
+        assert columns.Q_ids == [str(exercise_uuid) for exercise_uuid in exercise_uuids]
+        assert columns.L_idx_by_id == {L_id: idx for idx, L_id in enumerate(columns.L_ids)}
+        assert columns.Q_idx_by_id == {Q_id: idx for idx, Q_id in enumerate(columns.Q_ids)}
+        assert columns.L_idx.tolist() == [0, 0, 0, 1, 1, 1]
+        assert columns.Q_idx.tolist() == [0, 1, 2, 0, 1, 2]
+        assert columns.is_correct.tolist() == [value[2] for value in values]
+        assert columns.responded_at.tolist() == [
+            (value[3] - datetime(1970, 1, 1)) // timedelta(microseconds=1) for value in values
+        ]
+
+        assert len(ResponseColumns.from_values([])) == 0
+
+    def test_from_values_batch_size(self):
+        student_uuids = [uuid4(), uuid4()]
+        exercise_uuids = [uuid4(), uuid4(), uuid4()]
+        now = datetime.now()
+        values = [(
+            choice(student_uuids),
+            choice(exercise_uuids),
+            choice((True, False)),
+            now - timedelta(days=choice((0, 1, 2)))
+        ) for ii in range(100)]
+
+        latest_columns = ResponseColumns.from_values(values).latest()
+
+        for batch_size in (1, 7, 100, 1000):
+            columns = ResponseColumns.from_values(
+                (value for value in values), batch_size=batch_size
+            )
+
+            assert len(columns) <= len(student_uuids) * len(exercise_uuids)
+            assert columns.L_ids == latest_columns.L_ids
+            assert columns.Q_ids == latest_columns.Q_ids
+            assert columns.L_idx.tolist() == latest_columns.L_idx.tolist()
+            assert columns.Q_idx.tolist() == latest_columns.Q_idx.tolist()
+            assert columns.is_correct.tolist() == latest_columns.is_correct.tolist()
+            assert columns.responded_at.tolist() == latest_columns.responded_at.tolist()
+
+        assert len(ResponseColumns.from_values([], batch_size=7)) == 0
+
+    def test_latest(self):
+        student_uuid = str(uuid4())
+        exercise_uuids = [str(uuid4()), str(uuid4())]
+        now = datetime.now()
+        columns = ResponseColumns.from_values([
+            (student_uuid, exercise_uuids[0], False, now - timedelta(days=1)),
+            (student_uuid, exercise_uuids[1], False, now),
+            (student_uuid, exercise_uuids[0], True, now),
+            (student_uuid, exercise_uuids[1], True, now - timedelta(days=1)),
+            (student_uuid, exercise_uuids[1], True, now)
+        ])
+
+        latest_columns = columns.latest()
+
+        # Later responses win ties, and the remaining responses keep their order
+        assert latest_columns.L_ids == columns.L_ids
+        assert latest_columns.Q_ids == columns.Q_ids
+        assert latest_columns.Q_idx.tolist() == [0, 1]
+        assert latest_columns.is_correct.tolist() == [True, True]
+
+        G_NQxNL, G_mask_NQxNL = convert_Rs(
+            responses=columns, L_ids=columns.L_ids, Q_ids=columns.Q_ids
+        )
+        latest_G_NQxNL, latest_G_mask_NQxNL = convert_Rs(
+            responses=latest_columns, L_ids=columns.L_ids, Q_ids=columns.Q_ids
+        )
+        assert (latest_G_NQxNL == G_NQxNL).all()
+        assert (latest_G_mask_NQxNL == G_mask_NQxNL).all()
+
+    def test_dicts_for_algs(self):
+        response_dicts = [{
+            'L_id':         str(uuid4()),
+            'Q_id':         str(uuid4()),
+            'correct?':     choice((True, False)),
+            'responded_at': str(datetime.now().replace(microsecond=microsecond))
+        } for microsecond in (0, 1, 999999)]
+
+        columns = ResponseColumns.from_dicts_for_algs(response_dicts)
+
+        assert len(columns) == len(response_dicts)
+        assert list(columns.dicts_for_algs()) == response_dicts
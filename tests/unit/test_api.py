@@ -87,6 +87,10 @@ def test_fetch_ecosystem_matrices(flask):
     ecosystem_matrix_2 = EcosystemMatrix(
         uuid=str(uuid4()),
         ecosystem_uuid=str(uuid4()),
+        num_responses=2,
+        cold_start_num_responses=2,
+        responses_watermark=1,
+        pages_hash='hash',
         Q_ids=[question_1_uuid, question_2_uuid],
         C_ids=[concept_1_uuid, concept_2_uuid],
         d_data=[0, 0.5],
@@ -198,6 +202,9 @@ def test_fetch_ecosystem_matrices(flask):
             assert ecosystem_matrix_response['L_ids'] == []
 
         if ecosystem_matrix:
+            # Only the matrix itself is sent, not the columns used to calculate the next one
+            for key in EcosystemMatrix.INTERNAL_COLUMNS:
+                assert key not in ecosystem_matrix_response
             assert ecosystem_matrix_response['ecosystem_uuid'] == ecosystem_matrix.ecosystem_uuid
             assert ecosystem_matrix_response['Q_ids'] == ecosystem_matrix.Q_ids
             assert ecosystem_matrix_response['C_ids'] == ecosystem_matrix.C_ids
@@ -1,5 +1,8 @@
 from sys import modules
 from importlib import reload
+from unittest.mock import patch
+
+from pytest import raises
 
 from sparfa_server import config
 
@@ -24,3 +27,15 @@ def test_environment_variable_overrides():
 
     assert '/test_' in config.PG_URL
     assert config.REDIS_URL.endswith('/13')
+
+
+def test_invalid_choices():
+    for name in ('ECOSYSTEM_MATRIX_STORAGE', 'ECOSYSTEM_MATRIX_PRECISION'):
+        try:
+            with patch.dict('os.environ', {name: 'invalid'}):
+                with raises(ValueError) as excinfo:
+                    reload(config)
+
+            assert name in str(excinfo.value)
+        finally:
+            reload(config)